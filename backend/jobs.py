@@ -0,0 +1,367 @@
+"""Background jobs with durable state in Mongo.
+
+Jobs are submitted as ``queued`` documents in the ``jobs`` collection. Every
+API worker runs a dispatcher that claims queued jobs while its pools have room,
+so a job submitted on one worker may run on another, and queued jobs survive
+restarts. A running job holds a lease that its worker renews; when a worker
+dies the lease runs out and the job is queued again (or failed after
+``max_attempts``). Singleton job types also take a lease-based lock in
+``job_locks`` so no two workers run them at the same time, and an active
+singleton carries ``singleton_key`` so a unique partial index lets only one be
+queued or running.
+"""
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime, timedelta
+import multiprocessing
+import os
+import socket
+import threading
+import traceback
+import uuid
+
+from pymongo import ASCENDING, DESCENDING, ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+ACTIVE_STATUSES = [QUEUED, RUNNING]
+
+THREAD = "thread"
+PROCESS = "process"
+
+PROGRESS_INTERVAL_SECONDS = 0.5
+
+
+class JobType:
+    """A kind of job: ``handler(params, progress) -> result``.
+
+    Process jobs run in a separate process and are called as
+    ``handler(params)``; the handler must be a module-level function.
+    """
+
+    def __init__(self, name: str, handler, singleton: bool = False, executor: str = THREAD):
+        self.name = name
+        self.handler = handler
+        self.singleton = singleton
+        self.executor = executor
+
+
+class JobRunner:
+    def __init__(
+        self,
+        get_db,
+        job_types: list,
+        thread_workers: int = 4,
+        process_workers: int = 1,
+        lease_seconds: int = 60,
+        poll_seconds: float = 1.0,
+        max_attempts: int = 3,
+        on_update=None,
+        process_initializer=None
+    ):
+        self.get_db = get_db
+        self.job_types = {job_type.name: job_type for job_type in job_types}
+        self.capacity = {THREAD: thread_workers, PROCESS: process_workers}
+        self.lease_seconds = lease_seconds
+        self.poll_seconds = poll_seconds
+        self.max_attempts = max_attempts
+        self.on_update = on_update
+        self.process_initializer = process_initializer
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+        self._running = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._thread = None
+        self._executors = {}
+
+    # Lifecycle
+
+    def start(self):
+        self._stopping.clear()
+        self._executors = {THREAD: ThreadPoolExecutor(max_workers=self.capacity[THREAD], thread_name_prefix="job")}
+        if self.capacity[PROCESS]:
+            self._executors[PROCESS] = ProcessPoolExecutor(
+                max_workers=self.capacity[PROCESS],
+                # Spawned children import the app fresh instead of inheriting the Mongo client
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=self.process_initializer
+            )
+        self._thread = threading.Thread(target=self._dispatch_loop, name="job-dispatcher", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop claiming jobs. Jobs still running here are requeued once their lease runs out."""
+        self._stopping.set()
+        self._wakeup.set()
+        if self._thread:
+            self._thread.join(timeout=5)
+        for executor in self._executors.values():
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    # Submission and lookup
+
+    def submit(self, name: str, params: dict = None, submitted_by: str = None) -> dict:
+        """Queue a job. A singleton that is already queued or running is returned instead."""
+        job_type = self.job_types[name]
+        database = self.get_db()
+        now = datetime.utcnow()
+        job = {
+            "id": str(uuid.uuid4()),
+            "type": name,
+            "params": params or {},
+            "executor": job_type.executor,
+            "status": QUEUED,
+            "attempts": 0,
+            "progress": None,
+            "result": None,
+            "error": None,
+            "submitted_by": submitted_by,
+            "worker": None,
+            "lease_expires_at": None,
+            "created_at": now,
+            "started_at": None,
+            "finished_at": None,
+            "updated_at": now
+        }
+        if job_type.singleton:
+            job["singleton_key"] = name
+        while True:
+            try:
+                database.jobs.insert_one(dict(job))
+                break
+            except DuplicateKeyError:
+                if not job_type.singleton:
+                    raise
+                active = database.jobs.find_one({"singleton_key": name}, {"_id": 0})
+                # Otherwise the active one finished in between; try again
+                if active:
+                    return active
+        self._notify(job)
+        self._wakeup.set()
+        return job
+
+    def ensure_indexes(self):
+        database = self.get_db()
+        database.jobs.create_index([("id", ASCENDING)], unique=True)
+        database.jobs.create_index([("status", ASCENDING), ("created_at", ASCENDING)])
+        database.jobs.create_index([("type", ASCENDING), ("status", ASCENDING)])
+        database.jobs.create_index([("created_at", DESCENDING)])
+        database.jobs.create_index([("finished_at", ASCENDING)], expireAfterSeconds=30 * 24 * 3600)
+        # Only active singletons have the key, so at most one per type is queued or running
+        database.jobs.create_index(
+            [("singleton_key", ASCENDING)],
+            unique=True,
+            partialFilterExpression={"singleton_key": {"$type": "string"}}
+        )
+
+    def get(self, job_id: str):
+        return self.get_db().jobs.find_one({"id": job_id}, {"_id": 0})
+
+    # Dispatcher
+
+    def _dispatch_loop(self):
+        while not self._stopping.is_set():
+            try:
+                self._recover_expired()
+                self._renew_leases()
+                self._claim()
+            except Exception:
+                traceback.print_exc()
+            self._wakeup.wait(self.poll_seconds)
+            self._wakeup.clear()
+
+    def _lease_expiry(self) -> datetime:
+        return datetime.utcnow() + timedelta(seconds=self.lease_seconds)
+
+    def _recover_expired(self):
+        """Requeue (or fail) jobs whose worker stopped renewing the lease"""
+        database = self.get_db()
+        now = datetime.utcnow()
+        for job in database.jobs.find({"status": RUNNING, "lease_expires_at": {"$lt": now}}, {"_id": 0}):
+            retry = job["attempts"] < self.max_attempts
+            update = {
+                "status": QUEUED if retry else FAILED,
+                "worker": None,
+                "lease_expires_at": None,
+                "updated_at": now
+            }
+            changes = {"$set": update}
+            if not retry:
+                update.update({"error": "Worker stopped before the job finished", "finished_at": now})
+                changes["$unset"] = {"singleton_key": ""}
+            recovered = database.jobs.find_one_and_update(
+                {"id": job["id"], "status": RUNNING, "lease_expires_at": job["lease_expires_at"]},
+                changes,
+                projection={"_id": 0},
+                return_document=ReturnDocument.AFTER
+            )
+            if recovered:
+                self._notify(recovered)
+
+    def _renew_leases(self):
+        with self._lock:
+            running = list(self._running)
+        if not running:
+            return
+        database = self.get_db()
+        expires_at = self._lease_expiry()
+        database.jobs.update_many(
+            {"id": {"$in": running}, "worker": self.worker_id},
+            {"$set": {"lease_expires_at": expires_at}}
+        )
+        database.job_locks.update_many(
+            {"owner": {"$in": [self._lock_owner(job_id) for job_id in running]}},
+            {"$set": {"expires_at": expires_at}}
+        )
+
+    def _free_executors(self) -> list:
+        with self._lock:
+            in_use = {THREAD: 0, PROCESS: 0}
+            for executor in self._running.values():
+                in_use[executor] += 1
+        return [executor for executor, capacity in self.capacity.items() if in_use[executor] < capacity]
+
+    def _claim(self):
+        database = self.get_db()
+        while not self._stopping.is_set():
+            free = self._free_executors()
+            if not free:
+                return
+            now = datetime.utcnow()
+            job = database.jobs.find_one_and_update(
+                {"status": QUEUED, "executor": {"$in": free}, "type": {"$in": list(self.job_types)}},
+                {
+                    "$set": {
+                        "status": RUNNING,
+                        "worker": self.worker_id,
+                        "lease_expires_at": self._lease_expiry(),
+                        "started_at": now,
+                        "updated_at": now
+                    },
+                    "$inc": {"attempts": 1}
+                },
+                projection={"_id": 0},
+                sort=[("created_at", 1)],
+                return_document=ReturnDocument.AFTER
+            )
+            if not job:
+                return
+
+            job_type = self.job_types[job["type"]]
+            if job_type.singleton and not self._acquire_lock(job):
+                # Another worker holds the lock; hand the job back and retry on a later poll
+                database.jobs.update_one(
+                    {"id": job["id"], "worker": self.worker_id},
+                    {"$set": {"status": QUEUED, "worker": None, "lease_expires_at": None},
+                     "$inc": {"attempts": -1}}
+                )
+                return
+
+            with self._lock:
+                self._running[job["id"]] = job_type.executor
+            self._notify(job)
+            self._start(job, job_type)
+
+    def _lock_owner(self, job_id: str) -> str:
+        # A requeued job claimed by another worker must not share the stalled worker's lock
+        return f"{self.worker_id}:{job_id}"
+
+    def _acquire_lock(self, job: dict) -> bool:
+        with self._lock:
+            if job["id"] in self._running:
+                # Requeued while this worker still runs it
+                return False
+        database = self.get_db()
+        owner = self._lock_owner(job["id"])
+        try:
+            database.job_locks.find_one_and_update(
+                {"_id": job["type"], "$or": [{"expires_at": {"$lt": datetime.utcnow()}}, {"owner": owner}]},
+                {"$set": {"owner": owner, "expires_at": self._lease_expiry()}},
+                upsert=True
+            )
+            return True
+        except DuplicateKeyError:
+            return False
+
+    def _release_lock(self, job: dict):
+        self.get_db().job_locks.delete_one({"_id": job["type"], "owner": self._lock_owner(job["id"])})
+
+    # Execution
+
+    def _start(self, job: dict, job_type: JobType):
+        if job_type.executor == PROCESS:
+            future = self._executors[PROCESS].submit(job_type.handler, job["params"])
+            future.add_done_callback(lambda done: self._finish_future(job, job_type, done))
+        else:
+            self._executors[THREAD].submit(self._run_in_thread, job, job_type)
+
+    def _run_in_thread(self, job: dict, job_type: JobType):
+        try:
+            result = job_type.handler(job["params"], self._progress_reporter(job))
+        except Exception as error:
+            self._finish(job, job_type, error=error)
+        else:
+            self._finish(job, job_type, result=result)
+
+    def _finish_future(self, job: dict, job_type: JobType, future):
+        error = future.exception() if not future.cancelled() else RuntimeError("Job cancelled")
+        if error:
+            self._finish(job, job_type, error=error)
+        else:
+            self._finish(job, job_type, result=future.result())
+
+    def _finish(self, job: dict, job_type: JobType, result=None, error: Exception = None):
+        now = datetime.utcnow()
+        update = {
+            "status": FAILED if error else SUCCEEDED,
+            "result": None if error else result,
+            "error": f"{type(error).__name__}: {error}" if error else None,
+            "lease_expires_at": None,
+            "finished_at": now,
+            "updated_at": now
+        }
+        try:
+            finished = self.get_db().jobs.find_one_and_update(
+                {"id": job["id"], "worker": self.worker_id},
+                {"$set": update, "$unset": {"singleton_key": ""}},
+                projection={"_id": 0},
+                return_document=ReturnDocument.AFTER
+            )
+            if job_type.singleton:
+                self._release_lock(job)
+            if finished:
+                self._notify(finished)
+        finally:
+            with self._lock:
+                self._running.pop(job["id"], None)
+            self._wakeup.set()
+
+    def _progress_reporter(self, job: dict):
+        last_reported = [0.0]
+
+        def progress(done: int, total: int = None, message: str = None):
+            now = datetime.utcnow()
+            if now.timestamp() - last_reported[0] < PROGRESS_INTERVAL_SECONDS and done != total:
+                return
+            last_reported[0] = now.timestamp()
+            updated = self.get_db().jobs.find_one_and_update(
+                {"id": job["id"], "worker": self.worker_id},
+                {"$set": {"progress": {"done": done, "total": total, "message": message}, "updated_at": now}},
+                projection={"_id": 0},
+                return_document=ReturnDocument.AFTER
+            )
+            if updated:
+                self._notify(updated)
+
+        return progress
+
+    def _notify(self, job: dict):
+        if self.on_update:
+            try:
+                self.on_update(job)
+            except Exception:
+                traceback.print_exc()
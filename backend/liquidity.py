@@ -0,0 +1,134 @@
+"""Fund liquidity cash-flow forecast.
+
+Projects the available balance forward from the current fund pool, adding
+scheduled repayments as they fall due and taking out the loans that are
+approved (and, in a second series, still pending) up front.
+"""
+from datetime import date, datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+from portfolio import load_installment_columns
+
+PENDING_APPLICATION_STATUSES = ["pending", "under_review", "requires_higher_approval"]
+
+
+def load_inflows(database, statuses: list, session=None) -> pd.DataFrame:
+    """Unpaid remainder of every outstanding installment with its due date"""
+    columns = load_installment_columns(
+        database,
+        {"status": {"$in": statuses}},
+        ["due_date", "amount", "paid_amount"],
+        archived=False,
+        session=session
+    )
+    frame = pd.DataFrame({
+        "due_date": pd.to_datetime(pd.Series(columns["due_date"], dtype="object")),
+        "remaining": (
+            pd.Series(columns["amount"], dtype=float)
+            - pd.Series(columns["paid_amount"], dtype=float).fillna(0.0)
+        ).clip(lower=0.0)
+    })
+    return frame
+
+
+def load_outflows(database, session=None) -> tuple:
+    """Totals of approved and pending applications not yet disbursed"""
+    totals = {
+        row["_id"]: row["total"]
+        for row in database.finance_applications.aggregate([
+            {"$match": {"status": {"$in": ["approved", *PENDING_APPLICATION_STATUSES]}}},
+            {"$group": {
+                "_id": "$status",
+                "total": {"$sum": {"$ifNull": ["$approved_amount", "$amount"]}}
+            }}
+        ], session=session)
+    }
+    approved = float(totals.get("approved", 0.0))
+    pending = float(sum(totals.get(status, 0.0) for status in PENDING_APPLICATION_STATUSES))
+    return approved, pending
+
+
+def period_starts(start: date, granularity: str, periods: int) -> list:
+    if granularity == "daily":
+        return [start + timedelta(days=offset) for offset in range(periods)]
+    month_index = start.year * 12 + start.month - 1 + np.arange(periods)
+    return [date(int(index // 12), int(index % 12) + 1, 1) for index in month_index]
+
+
+def compute_liquidity_forecast(
+    opening_balance: float,
+    inflows: pd.DataFrame,
+    approved_outflows: float,
+    pending_outflows: float,
+    start: date,
+    granularity: str,
+    periods: int
+) -> dict:
+    """Bucket inflows by day or month and accumulate the projected balance.
+
+    Installments already past due are reported as ``overdue_inflows`` and left
+    out of the projection, so the forecast never relies on arrears being paid.
+    """
+    due = inflows["due_date"].dt.normalize()
+    start_ts = pd.Timestamp(start)
+    if granularity == "daily":
+        offsets = (due - start_ts).dt.days.to_numpy()
+    else:
+        offsets = ((due.dt.year - start.year) * 12 + due.dt.month - start.month).to_numpy()
+
+    remaining = inflows["remaining"].to_numpy(dtype=float)
+    overdue = (due < start_ts).to_numpy()
+    in_horizon = ~overdue & (offsets >= 0) & (offsets < periods)
+    bucketed = np.bincount(
+        offsets[in_horizon].astype(int), weights=remaining[in_horizon], minlength=periods
+    )[:periods]
+
+    balance = opening_balance - approved_outflows + np.cumsum(bucketed)
+    balance_with_pending = balance - pending_outflows
+    starts = period_starts(start, granularity, periods)
+
+    def first_shortfall(series):
+        negative = np.flatnonzero(series < 0)
+        return starts[negative[0]].isoformat() if negative.size else None
+
+    return {
+        "start": start.isoformat(),
+        "granularity": granularity,
+        "periods": periods,
+        "opening_balance": round(float(opening_balance), 2),
+        "approved_outflows": round(approved_outflows, 2),
+        "pending_outflows": round(pending_outflows, 2),
+        "overdue_inflows": round(float(remaining[overdue].sum()), 2),
+        "scheduled_inflows": round(float(bucketed.sum()), 2),
+        "minimum_balance": round(float(balance.min()), 2),
+        "minimum_balance_with_pending": round(float(balance_with_pending.min()), 2),
+        "first_shortfall": first_shortfall(balance),
+        "first_shortfall_with_pending": first_shortfall(balance_with_pending),
+        "series": [
+            {
+                "period_start": period_start.isoformat(),
+                "inflows": round(float(inflow), 2),
+                "balance": round(float(closing), 2),
+                "balance_with_pending": round(float(closing_with_pending), 2)
+            }
+            for period_start, inflow, closing, closing_with_pending
+            in zip(starts, bucketed, balance, balance_with_pending)
+        ]
+    }
+
+
+def build_liquidity_forecast(
+    database,
+    opening_balance: float,
+    inflow_statuses: list,
+    granularity: str,
+    periods: int,
+    start: date = None,
+    session=None
+) -> dict:
+    start = start or datetime.utcnow().date()
+    inflows = load_inflows(database, inflow_statuses, session=session)
+    approved, pending = load_outflows(database, session=session)
+    return compute_liquidity_forecast(opening_balance, inflows, approved, pending, start, granularity, periods)
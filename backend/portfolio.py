@@ -0,0 +1,285 @@
+"""Loan portfolio analytics.
+
+Installments and disbursements are pulled from Mongo in columnar batches and
+the metrics are computed with pandas/NumPy over the whole book at once.
+Reports are cached per (as-of date, portfolio version), where the version is a
+change counter that disbursements and repayments advance.
+"""
+from collections import OrderedDict
+from datetime import date, datetime, time
+import threading
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+from repository import USER_COUNTRY, users_by_ids
+
+BATCH_SIZE = 20000
+AGING_BUCKETS = ["current", "1-30", "31-60", "61-90", "90+"]
+AGING_BINS = [-np.inf, 0, 30, 60, 90, np.inf]
+PAR_THRESHOLDS = [1, 30, 60, 90]
+MEMORY_CACHE_SIZE = 32
+
+# Schedules in the per-installment layout and in the embedded (one document
+# per loan) layout; both are read so reports work during a layout migration
+INSTALLMENT_COLLECTIONS = ["payment_schedules", "archived_payment_schedules"]
+EMBEDDED_SCHEDULE_COLLECTIONS = ["loan_schedules", "archived_loan_schedules"]
+SCHEDULE_FIELDS = ["application_id", "disbursement_id", "user_id"]
+INSTALLMENT_FIELDS = [
+    "application_id", "user_id", "due_date", "amount", "principal_amount",
+    "interest_amount", "paid_amount", "paid_date"
+]
+
+_memory_cache = OrderedDict()
+_memory_cache_lock = threading.Lock()
+
+
+def load_columns(cursor, fields: list) -> dict:
+    """Drain a cursor batch by batch into one list per field"""
+    columns = {field: [] for field in fields}
+    batch = []
+    for document in cursor.batch_size(BATCH_SIZE):
+        batch.append(document)
+        if len(batch) >= BATCH_SIZE:
+            _extend_columns(columns, batch)
+            batch = []
+    _extend_columns(columns, batch)
+    return columns
+
+
+def _extend_columns(columns: dict, batch: list):
+    for field, values in columns.items():
+        values.extend(document.get(field) for document in batch)
+
+
+def load_installment_columns(database, match: dict, fields: list, archived: bool = True, session=None) -> dict:
+    """Columns of every installment matching ``match``, from both schedule layouts.
+
+    ``match`` may filter on installment fields such as status or due_date, and
+    on the schedule-level SCHEDULE_FIELDS.
+    """
+    columns = {field: [] for field in fields}
+    projected = fields + [field for field in match if field not in fields]
+    # Skip loans without a matching installment before unwinding
+    loan_match = {field: condition for field, condition in match.items() if field in SCHEDULE_FIELDS}
+    installment_match = {field: condition for field, condition in match.items() if field not in SCHEDULE_FIELDS}
+    if installment_match:
+        loan_match["installments"] = {"$elemMatch": installment_match}
+    collections = list(zip(INSTALLMENT_COLLECTIONS, EMBEDDED_SCHEDULE_COLLECTIONS))
+    for flat_name, embedded_name in collections if archived else collections[:1]:
+        cursors = [
+            database[flat_name].find(match, {"_id": 0, **{field: 1 for field in fields}}, session=session),
+            database[embedded_name].aggregate([
+                {"$match": loan_match},
+                {"$unwind": "$installments"},
+                {"$project": {
+                    "_id": 0,
+                    **{field: f"${field}" if field in SCHEDULE_FIELDS else f"$installments.{field}" for field in projected}
+                }},
+                {"$match": match}
+            ], session=session)
+        ]
+        for cursor in cursors:
+            loaded = load_columns(cursor, fields)
+            for field in fields:
+                columns[field].extend(loaded[field])
+    return columns
+
+
+def load_portfolio_frames(database, as_of: datetime, session=None) -> tuple:
+    """Load installments of loans disbursed by ``as_of`` and member countries"""
+    disbursements = pd.DataFrame(load_columns(
+        database.disbursements.find(
+            {"status": "disbursed", "disbursement_date": {"$lte": as_of}},
+            {"_id": 0, "application_id": 1},
+            session=session
+        ),
+        ["application_id"]
+    ))
+    if disbursements.empty:
+        return pd.DataFrame(columns=INSTALLMENT_FIELDS), {}
+
+    # Fully repaid loans may have been archived, but they still count for
+    # interest income and for as-of dates before their last payment
+    application_ids = disbursements["application_id"].tolist()
+    columns = {field: [] for field in INSTALLMENT_FIELDS}
+    for start in range(0, len(application_ids), BATCH_SIZE):
+        loaded = load_installment_columns(
+            database,
+            {"application_id": {"$in": application_ids[start:start + BATCH_SIZE]}},
+            INSTALLMENT_FIELDS,
+            session=session
+        )
+        for field in INSTALLMENT_FIELDS:
+            columns[field].extend(loaded[field])
+    installments = pd.DataFrame(columns)
+
+    user_ids = installments["user_id"].unique().tolist()
+    countries = {
+        user_id: user.get("country") or "Unknown"
+        for user_id, user in users_by_ids(database, user_ids, USER_COUNTRY, session).items()
+    }
+    return installments, countries
+
+
+def compute_portfolio_metrics(installments: pd.DataFrame, countries: dict, as_of: datetime) -> dict:
+    """Outstanding principal, aging, PAR, interest income and per-country figures.
+
+    Payments dated after ``as_of`` are ignored. Installment payments are split
+    between principal and interest in proportion to the installment amounts.
+    A loan's days past due come from its oldest unpaid installment.
+    """
+    report = {
+        "as_of": as_of.date().isoformat(),
+        "loan_count": 0,
+        "outstanding_principal": 0.0,
+        "interest_income": 0.0,
+        "aging": [
+            {"bucket": bucket, "loan_count": 0, "outstanding_principal": 0.0, "share": 0.0}
+            for bucket in AGING_BUCKETS
+        ],
+        "par": {f"par_{days}": 0.0 for days in PAR_THRESHOLDS},
+        "countries": []
+    }
+    if installments.empty:
+        return report
+
+    as_of_ts = pd.Timestamp(as_of)
+    amount = installments["amount"].astype(float).to_numpy()
+    paid_amount = installments["paid_amount"].fillna(0.0).astype(float).to_numpy()
+    paid_date = pd.to_datetime(installments["paid_date"])
+    due_date = pd.to_datetime(installments["due_date"])
+
+    # Only count payments made on or before the as-of date
+    paid_amount = np.where((paid_date <= as_of_ts).to_numpy(), paid_amount, 0.0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        paid_ratio = np.clip(np.where(amount > 0, paid_amount / amount, 1.0), 0.0, 1.0)
+
+    principal_outstanding = installments["principal_amount"].astype(float).to_numpy() * (1.0 - paid_ratio)
+    interest_collected = installments["interest_amount"].astype(float).to_numpy() * paid_ratio
+    overdue_days = (as_of_ts - due_date).dt.days.to_numpy()
+    days_past_due = np.where((paid_ratio < 1.0) & (overdue_days > 0), overdue_days, 0)
+
+    frame = pd.DataFrame({
+        "application_id": installments["application_id"].to_numpy(),
+        "user_id": installments["user_id"].to_numpy(),
+        "principal_outstanding": principal_outstanding,
+        "interest_collected": interest_collected,
+        "days_past_due": days_past_due
+    })
+    frame["country"] = frame["user_id"].map(countries).fillna("Unknown")
+
+    loans = frame.groupby("application_id", sort=False).agg(
+        country=("country", "first"),
+        outstanding=("principal_outstanding", "sum"),
+        days_past_due=("days_past_due", "max")
+    )
+    loans = loans[loans["outstanding"] > 0.005]
+    loans["bucket"] = pd.cut(loans["days_past_due"], bins=AGING_BINS, labels=AGING_BUCKETS)
+
+    total_outstanding = float(loans["outstanding"].sum())
+    interest_by_country = frame.groupby("country")["interest_collected"].sum()
+
+    aging = loans.groupby("bucket", observed=False)["outstanding"].agg(["size", "sum"])
+    report["aging"] = [
+        {
+            "bucket": bucket,
+            "loan_count": int(aging.loc[bucket, "size"]),
+            "outstanding_principal": round(float(aging.loc[bucket, "sum"]), 2),
+            "share": round(float(aging.loc[bucket, "sum"]) / total_outstanding, 4) if total_outstanding else 0.0
+        }
+        for bucket in AGING_BUCKETS
+    ]
+
+    for days in PAR_THRESHOLDS:
+        at_risk = float(loans.loc[loans["days_past_due"] >= days, "outstanding"].sum())
+        report["par"][f"par_{days}"] = round(at_risk / total_outstanding, 4) if total_outstanding else 0.0
+
+    loans["at_risk_30"] = np.where(loans["days_past_due"] >= 30, loans["outstanding"], 0.0)
+    by_country = loans.groupby("country").agg(
+        loan_count=("outstanding", "size"),
+        outstanding=("outstanding", "sum"),
+        at_risk_30=("at_risk_30", "sum")
+    )
+    country_names = sorted(set(by_country.index) | set(interest_by_country.index))
+    report["countries"] = sorted(
+        [
+            {
+                "country": country,
+                "loan_count": int(by_country["loan_count"].get(country, 0)),
+                "outstanding_principal": round(float(by_country["outstanding"].get(country, 0.0)), 2),
+                "interest_income": round(float(interest_by_country.get(country, 0.0)), 2),
+                "par_30": round(
+                    float(by_country["at_risk_30"].get(country, 0.0)) / float(by_country["outstanding"].get(country)), 4
+                ) if by_country["outstanding"].get(country, 0.0) else 0.0
+            }
+            for country in country_names
+        ],
+        key=lambda row: row["outstanding_principal"],
+        reverse=True
+    )
+
+    report["loan_count"] = int(len(loans))
+    report["outstanding_principal"] = round(total_outstanding, 2)
+    report["interest_income"] = round(float(interest_collected.sum()), 2)
+    return report
+
+
+def as_of_datetime(as_of: Optional[date]) -> datetime:
+    """End of the as-of day, defaulting to today (UTC)"""
+    as_of = as_of or datetime.utcnow().date()
+    return datetime.combine(as_of, time.max)
+
+
+def cached_report(database, cache_key: str, build, session=None) -> dict:
+    """Return the report stored under ``cache_key``, building it on a miss.
+
+    Hits come from an in-process LRU first, then from the shared
+    ``report_cache`` collection so other workers reuse the result.
+    """
+    with _memory_cache_lock:
+        if cache_key in _memory_cache:
+            _memory_cache.move_to_end(cache_key)
+            return _memory_cache[cache_key]
+
+    cached = database.report_cache.find_one({"id": cache_key}, {"_id": 0, "report": 1}, session=session)
+    if cached:
+        report = cached["report"]
+    else:
+        report = build()
+        database.report_cache.update_one(
+            {"id": cache_key},
+            {"$set": {"report": report, "created_at": datetime.utcnow()}},
+            upsert=True
+        )
+
+    with _memory_cache_lock:
+        _memory_cache[cache_key] = report
+        while len(_memory_cache) > MEMORY_CACHE_SIZE:
+            _memory_cache.popitem(last=False)
+    return report
+
+
+def get_portfolio_report(
+    database, as_of: Optional[date], version: int, session=None, cache_database=None
+) -> dict:
+    """Portfolio report for ``as_of``, cached per portfolio version.
+
+    The report is built from ``database`` and cached in ``cache_database``
+    when one is given, so the build can read from a secondary.
+    """
+    as_of_dt = as_of_datetime(as_of)
+
+    def build():
+        installments, countries = load_portfolio_frames(database, as_of_dt, session=session)
+        report = compute_portfolio_metrics(installments, countries, as_of_dt)
+        report["version"] = version
+        return report
+
+    return cached_report(
+        cache_database if cache_database is not None else database,
+        f"portfolio:{as_of_dt.date().isoformat()}:{version}",
+        build,
+        session=session
+    )
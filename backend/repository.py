@@ -0,0 +1,132 @@
+"""Collection access with explicit projections.
+
+Handlers read users and applications through the functions below, naming the
+fields each use case reads instead of fetching whole documents, and load
+related documents with one query per collection rather than one per row. Id
+lookups go through ``by_id`` so they follow the configured id storage.
+"""
+import os
+from typing import Optional
+
+# Document ids. "field" keeps the uuid in a uniquely indexed `id` field next to
+# Mongo's ObjectId _id; "primary" also stores it as the _id, so id lookups use
+# the primary key and the extra index is dropped.
+ID_STORAGE = os.environ.get('ID_STORAGE', 'field')
+
+# Projections per use case
+USER_PROFILE = {"_id": 0, "password_hash": 0}
+USER_CONTACT = {"_id": 0, "id": 1, "full_name": 1, "email": 1, "country": 1}
+USER_COUNTRY = {"_id": 0, "id": 1, "country": 1}
+USER_ID = {"_id": 0, "id": 1}
+APPLICATION_SUMMARY = {
+    "_id": 0, "id": 1, "user_id": 1, "amount": 1, "purpose": 1,
+    "requested_duration_months": 1, "description": 1, "status": 1
+}
+
+
+def by_id(value) -> dict:
+    """Filter on document ids; ``value`` may be an operator such as {"$in": [...]}"""
+    return {"_id" if ID_STORAGE == "primary" else "id": value}
+
+
+def with_id(document: dict) -> dict:
+    """Prepare a document for insert: with primary id storage its uuid is its _id"""
+    if ID_STORAGE == "primary":
+        document["_id"] = document["id"]
+    return document
+
+
+def including(projection: dict, *fields: str) -> dict:
+    """Add ``fields`` to an inclusion projection; exclusion projections already return them"""
+    if any(value for key, value in projection.items() if key != "_id"):
+        return {**projection, **{field: 1 for field in fields}}
+    return projection
+
+
+def fields_projection(fields: list, always: tuple = ("id",)) -> dict:
+    """Inclusion projection for a sparse fieldset"""
+    return {"_id": 0, **{field: 1 for field in [*always, *fields]}}
+
+
+def find_by_ids(collections: list, ids, projection: dict) -> dict:
+    """Documents keyed by id, one query per collection. Earlier collections win."""
+    ids = list(dict.fromkeys(ids))
+    found = {}
+    for collection in collections:
+        missing = [document_id for document_id in ids if document_id not in found]
+        if not missing:
+            break
+        for document in collection.find(by_id({"$in": missing}), including(projection, "id")):
+            found[document["id"]] = document
+    return found
+
+
+def find_grouped(collections: list, key: str, values, projection: dict, sort_by: str = None) -> dict:
+    """Documents whose ``key`` is in ``values``, grouped by that key"""
+    grouped = {value: [] for value in values}
+    if not grouped:
+        return grouped
+    for collection in collections:
+        for document in collection.find({key: {"$in": list(grouped)}}, including(projection, key, *filter(None, [sort_by]))):
+            grouped[document[key]].append(document)
+    if sort_by:
+        for documents in grouped.values():
+            documents.sort(key=lambda document: document[sort_by])
+    return grouped
+
+
+def get_user(database, user_id: str, projection: dict = USER_PROFILE, **conditions) -> Optional[dict]:
+    return database.users.find_one({**by_id(user_id), **conditions}, projection)
+
+
+def get_user_by_email(database, email: str, projection: Optional[dict] = USER_ID) -> Optional[dict]:
+    return database.users.find_one({"email": email}, projection)
+
+
+def users_by_ids(database, user_ids, projection: dict, session=None, **conditions) -> dict:
+    """Users keyed by id, in one query"""
+    return {
+        user["id"]: user
+        for user in database.users.find(
+            {**by_id({"$in": list(user_ids)}), **conditions}, including(projection, "id"), session=session
+        )
+    }
+
+
+def country_user_ids(database, country: str, session=None) -> list:
+    return [user["id"] for user in database.users.find({"country": country}, USER_ID, session=session)]
+
+
+def find_users(database, query: dict, projection: dict, sort: list = None, limit: int = 0, session=None) -> list:
+    cursor = database.users.find(query, projection, session=session)
+    if sort:
+        cursor = cursor.sort(sort)
+    return list(cursor.limit(limit))
+
+
+def get_application(database, application_id: str, projection: Optional[dict] = None) -> Optional[dict]:
+    return database.finance_applications.find_one(by_id(application_id), projection)
+
+
+def applications_by_ids(database, application_ids, projection: dict) -> dict:
+    """Applications keyed by id, in one query"""
+    return {
+        application["id"]: application
+        for application in database.finance_applications.find(
+            by_id({"$in": list(application_ids)}), including(projection, "id")
+        )
+    }
+
+
+def find_applications(
+    database, query: dict, projection: Optional[dict] = None, sort: list = None, limit: int = 0, session=None
+) -> list:
+    cursor = database.finance_applications.find(query, projection, session=session)
+    if sort:
+        cursor = cursor.sort(sort)
+    return list(cursor.limit(limit))
+
+
+def select_fields(document: dict, fields: list) -> dict:
+    """Only ``fields`` of a document, with None for any it lacks"""
+    return {field: document.get(field) for field in fields}
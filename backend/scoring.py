@@ -0,0 +1,79 @@
+"""Member credit scores from repayment history.
+
+Every installment that has fallen due, hot or archived, is loaded in columnar
+batches and scored per member with pandas in one pass. The scores are stored
+on member stats with the scoring version, so an application reads its
+member's score with the stats it already loads.
+"""
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from portfolio import load_installment_columns
+
+# Bump when the scoring rules change; scores of other versions are ignored
+CREDIT_SCORE_VERSION = 1
+# Installments paid, or still unpaid, more than this many days late are defaults
+DEFAULT_DAYS = 90
+# Points for the share of installments paid on time and for promptness, which
+# falls to zero at LATE_DAYS_CAP days of average lateness
+ON_TIME_POINTS = 60.0
+PROMPTNESS_POINTS = 40.0
+LATE_DAYS_CAP = 60
+DEFAULT_PENALTY = 25.0
+
+SCORE_FIELDS = ["user_id", "due_date", "amount", "paid_amount", "paid_date"]
+SCORE_COLUMNS = ["installments_due", "on_time_ratio", "average_days_late", "defaults", "score"]
+
+
+def compute_credit_scores(installments: pd.DataFrame, as_of: datetime) -> pd.DataFrame:
+    """Repayment behaviour and a 0-100 score per member, indexed by user id.
+
+    Only installments due by ``as_of`` count, and payments after it are
+    ignored. An installment is on time when it was paid in full by its due
+    date; otherwise it is late until paid in full, or until ``as_of``. The score
+    adds ON_TIME_POINTS for the on-time share and PROMPTNESS_POINTS for average
+    lateness, less DEFAULT_PENALTY per default.
+    """
+    if installments.empty:
+        return pd.DataFrame(columns=SCORE_COLUMNS, index=pd.Index([], name="user_id"))
+
+    as_of_ts = pd.Timestamp(as_of)
+    due_date = pd.to_datetime(installments["due_date"])
+    paid_date = pd.to_datetime(installments["paid_date"])
+    amount = installments["amount"].astype(float).to_numpy()
+    paid_amount = installments["paid_amount"].fillna(0.0).astype(float).to_numpy()
+
+    paid_in_full = (paid_date <= as_of_ts).to_numpy() & (paid_amount >= amount - 0.005)
+    settled = paid_date.where(paid_in_full, as_of_ts)
+    days_late = np.clip((settled - due_date).dt.days.to_numpy(), 0, None)
+
+    frame = pd.DataFrame({
+        "user_id": installments["user_id"].to_numpy(),
+        "on_time": paid_in_full & (days_late == 0),
+        "days_late": days_late,
+        "default": days_late > DEFAULT_DAYS
+    })[(due_date <= as_of_ts).to_numpy()]
+
+    scores = frame.groupby("user_id").agg(
+        installments_due=("on_time", "size"),
+        on_time_ratio=("on_time", "mean"),
+        average_days_late=("days_late", "mean"),
+        defaults=("default", "sum")
+    )
+    promptness = 1 - np.minimum(scores["average_days_late"], LATE_DAYS_CAP) / LATE_DAYS_CAP
+    scores["score"] = (
+        ON_TIME_POINTS * scores["on_time_ratio"] + PROMPTNESS_POINTS * promptness
+        - DEFAULT_PENALTY * scores["defaults"]
+    ).clip(0, 100)
+    scores["on_time_ratio"] = scores["on_time_ratio"].round(4)
+    scores["average_days_late"] = scores["average_days_late"].round(1)
+    scores["score"] = scores["score"].round(1)
+    return scores[SCORE_COLUMNS]
+
+
+def score_members(database, as_of: datetime) -> pd.DataFrame:
+    """Credit scores of every member with an installment due by ``as_of``"""
+    installments = pd.DataFrame(load_installment_columns(database, {"due_date": {"$lte": as_of}}, SCORE_FIELDS))
+    return compute_credit_scores(installments, as_of)
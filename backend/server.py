@@ -1,21 +1,167 @@
-from fastapi import FastAPI, HTTPException, Depends, status
+from fastapi import BackgroundTasks, FastAPI, HTTPException, Depends, Query, status, UploadFile, File, Response, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+from fastapi.encoders import jsonable_encoder
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel, EmailStr, Field
-from pymongo import MongoClient
+import pymongo
+from pymongo import MongoClient, UpdateOne, ReplaceOne, ASCENDING, DESCENDING, ReturnDocument
+from pymongo.errors import BulkWriteError, DuplicateKeyError, OperationFailure, PyMongoError
+from pymongo.read_preferences import Primary, PrimaryPreferred, Secondary, SecondaryPreferred, Nearest
 from werkzeug.security import generate_password_hash, check_password_hash
 import jwt
 import os
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
 from typing import Optional, List
 import uuid
 from enum import Enum
+from contextlib import asynccontextmanager, contextmanager
+import asyncio
+import csv
+import hashlib
+import io
+import json
+import logging
+import math
+import random
+import re
+import secrets
+import threading
+import time
+import unicodedata
+
+import numpy as np
+
+from jobs import JobRunner, JobType, PROCESS
+from liquidity import build_liquidity_forecast
+from portfolio import cached_report, get_portfolio_report
+import repository
+from repository import (
+    APPLICATION_SUMMARY, USER_CONTACT, USER_COUNTRY, USER_ID, USER_PROFILE,
+    applications_by_ids, by_id, country_user_ids, fields_projection, find_applications, find_by_ids,
+    find_grouped, find_users, get_application, get_user, get_user_by_email, including, select_fields,
+    users_by_ids, with_id
+)
+from scoring import CREDIT_SCORE_VERSION, score_members
 
 # Environment setup
+logger = logging.getLogger(__name__)
+
 MONGO_URL = os.environ.get('MONGO_URL', 'mongodb://localhost:27017')
 DB_NAME = os.environ.get('DB_NAME', 'fund_management')
 SECRET_KEY = os.environ.get('SECRET_KEY', 'your-secret-key-change-in-production')
 
+# MongoDB client settings (per worker process)
+MONGO_MAX_POOL_SIZE = int(os.environ.get('MONGO_MAX_POOL_SIZE', '50'))
+MONGO_MIN_POOL_SIZE = int(os.environ.get('MONGO_MIN_POOL_SIZE', '0'))
+MONGO_CONNECT_TIMEOUT_MS = int(os.environ.get('MONGO_CONNECT_TIMEOUT_MS', '5000'))
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.environ.get('MONGO_SERVER_SELECTION_TIMEOUT_MS', '10000'))
+MONGO_SOCKET_TIMEOUT_MS = int(os.environ.get('MONGO_SOCKET_TIMEOUT_MS', '0')) or None
+MONGO_COMPRESSORS = os.environ.get('MONGO_COMPRESSORS')  # e.g. "zstd,snappy,zlib"
+
+# Read preference profiles: (mode, maxStalenessSeconds). Analytics and export
+# reads may go to secondaries; transactional reads always use the primary.
+READ_PROFILES = {
+    "transactional": ("primary", None),
+    "analytics": (
+        os.environ.get('READ_PROFILE_ANALYTICS', 'secondaryPreferred'),
+        int(os.environ.get('READ_PROFILE_ANALYTICS_MAX_STALENESS', '120'))
+    ),
+    "export": (
+        os.environ.get('READ_PROFILE_EXPORT', 'secondaryPreferred'),
+        int(os.environ.get('READ_PROFILE_EXPORT_MAX_STALENESS', '600'))
+    )
+}
+
+# Server process settings
+WEB_CONCURRENCY = int(os.environ.get('WEB_CONCURRENCY', '1'))
+PORT = int(os.environ.get('PORT', '8001'))
+GRACEFUL_SHUTDOWN_SECONDS = int(os.environ.get('GRACEFUL_SHUTDOWN_SECONDS', '30'))
+
+# Background jobs (per worker process)
+JOB_THREAD_WORKERS = int(os.environ.get('JOB_THREAD_WORKERS', '2'))
+JOB_PROCESS_WORKERS = int(os.environ.get('JOB_PROCESS_WORKERS', '1'))
+JOB_LEASE_SECONDS = int(os.environ.get('JOB_LEASE_SECONDS', '60'))
+JOB_MAX_ATTEMPTS = int(os.environ.get('JOB_MAX_ATTEMPTS', '3'))
+
+# Idempotency-Key support for money-moving POSTs
+IDEMPOTENCY_TTL_HOURS = int(os.environ.get('IDEMPOTENCY_TTL_HOURS', '24'))
+IDEMPOTENCY_LOCK_SECONDS = int(os.environ.get('IDEMPOTENCY_LOCK_SECONDS', '30'))
+IDEMPOTENCY_POLL_SECONDS = 0.1
+
+# An application write takes its change_seq before it lands, and holds a claim
+# meanwhile so approval queue tokens stay below it. Claims of writers that died
+# are ignored, and removed, after this long.
+CHANGE_CLAIM_SECONDS = int(os.environ.get('CHANGE_CLAIM_SECONDS', '300'))
+
+# Heavy read classes: (time budget in ms, concurrent requests per worker). The
+# budget bounds every Mongo operation of the request (maxTimeMS, pool waits).
+# Past the limit a request waits up to LOAD_SHED_WAIT_SECONDS for a slot and
+# is then turned away with a 503 and Retry-After.
+ROUTE_CLASSES = {
+    "dashboards": (
+        int(os.environ.get('ROUTE_BUDGET_DASHBOARDS_MS', '5000')),
+        int(os.environ.get('ROUTE_LIMIT_DASHBOARDS', '16'))
+    ),
+    "admin_lists": (
+        int(os.environ.get('ROUTE_BUDGET_ADMIN_LISTS_MS', '10000')),
+        int(os.environ.get('ROUTE_LIMIT_ADMIN_LISTS', '4'))
+    ),
+    "exports": (
+        int(os.environ.get('ROUTE_BUDGET_EXPORTS_MS', '30000')),
+        int(os.environ.get('ROUTE_LIMIT_EXPORTS', '2'))
+    )
+}
+LOAD_SHED_WAIT_SECONDS = float(os.environ.get('LOAD_SHED_WAIT_SECONDS', '2'))
+LOAD_SHED_RETRY_AFTER_SECONDS = int(os.environ.get('LOAD_SHED_RETRY_AFTER_SECONDS', '5'))
+
+# Hot/cold tiering: closed loans move to archive collections after this many days
+ARCHIVE_AFTER_DAYS = int(os.environ.get('ARCHIVE_AFTER_DAYS', '180'))
+ARCHIVE_BATCH_SIZE = 500
+ARCHIVE_COLLECTIONS = {
+    "finance_applications": "archived_finance_applications",
+    "guarantors": "archived_guarantors",
+    "approval_history": "archived_approval_history",
+    "payment_schedules": "archived_payment_schedules",
+    "loan_schedules": "archived_loan_schedules"
+}
+
+# Payment schedule storage. "installments" keeps one payment_schedules document
+# per installment; "embedded" keeps one loan_schedules document per
+# disbursement holding its installments in an array.
+SCHEDULE_LAYOUT = os.environ.get('SCHEDULE_LAYOUT', 'installments')
+SCHEDULE_COLLECTIONS = {"installments": "payment_schedules", "embedded": "loan_schedules"}
+# Collections whose documents are looked up by uuid (see repository.ID_STORAGE)
+ID_COLLECTIONS = [
+    "users", "deposits", "finance_applications", "guarantors", "approval_history", "disbursements",
+    "payment_schedules", "loan_schedules", "repayment_postings",
+    *ARCHIVE_COLLECTIONS.values()
+]
+
+# The fund pool is split over this many stripe documents, so concurrent money
+# movements write different documents; reads sum the stripes
+FUND_POOL_STRIPES = int(os.environ.get('FUND_POOL_STRIPES', '8'))
+FUND_POOL_TOTALS = ["total_deposits", "total_disbursed", "total_repaid", "available_balance", "total_receivables"]
+# Version counters that every money movement advances are striped the same way:
+# a bump $incs a random "<name>#<stripe>" counter and readers sum them
+STRIPED_VERSIONS = ["data", "fund_pool", "portfolio"]
+VERSION_STRIPES = int(os.environ.get('VERSION_STRIPES', '8'))
+
+# Payment fields a repayment posting writes, and those its writes are conditional on.
+# Installments also record the posting attempt that last wrote them.
+PAYMENT_FIELDS = ["paid_amount", "paid_date", "status"]
+PAYMENT_CHECK_FIELDS = ["paid_amount", "status"]
+# Times a repayment batch is read and allocated again after a concurrent change
+REPAYMENT_POSTING_ATTEMPTS = 3
+# Statement imports are written in transactions of about this many payments;
+# a member's payments always go in the same one
+REPAYMENT_CHUNK_SIZE = int(os.environ.get('REPAYMENT_CHUNK_SIZE', '500'))
+
+EMBEDDED_INSTALLMENT_FIELDS = [
+    "installment_number", "due_date", "amount", "principal_amount", "interest_amount",
+    "status", "paid_date", "paid_amount", "late_fee"
+]
+
 # Default Business Rules Configuration
 DEFAULT_MINIMUM_DEPOSIT_FOR_GUARANTOR = 500.0
 PRIORITY_WEIGHT = 100
@@ -27,12 +173,105 @@ APPROVAL_LIMITS = {
     "general_admin": float('inf')    # Can approve any amount
 }
 
-# MongoDB setup
-client = MongoClient(MONGO_URL)
-db = client[DB_NAME]
+# MongoDB setup: the client is created per worker in the app lifespan, never at
+# import time, so it is not shared across forked processes
+client = None
+db = None
+read_dbs = {}
+transaction_support = {}
+
+READ_PREFERENCE_MODES = {
+    "primaryPreferred": PrimaryPreferred,
+    "secondary": Secondary,
+    "secondaryPreferred": SecondaryPreferred,
+    "nearest": Nearest
+}
+
+def build_read_preference(mode: str, max_staleness: Optional[int]):
+    if mode == "primary":
+        return Primary()
+    return READ_PREFERENCE_MODES[mode](max_staleness=max_staleness or -1)
+
+def connect_mongo():
+    global client, db
+    options = {
+        "maxPoolSize": MONGO_MAX_POOL_SIZE,
+        "minPoolSize": MONGO_MIN_POOL_SIZE,
+        "connectTimeoutMS": MONGO_CONNECT_TIMEOUT_MS,
+        "serverSelectionTimeoutMS": MONGO_SERVER_SELECTION_TIMEOUT_MS,
+        "socketTimeoutMS": MONGO_SOCKET_TIMEOUT_MS,
+        "appname": "fund-manager"
+    }
+    if MONGO_COMPRESSORS:
+        options["compressors"] = MONGO_COMPRESSORS
+    client = MongoClient(MONGO_URL, **options)
+    db = client[DB_NAME]
+    read_dbs.clear()
+    transaction_support.clear()
+    for profile, (mode, max_staleness) in READ_PROFILES.items():
+        read_dbs[profile] = client.get_database(
+            DB_NAME, read_preference=build_read_preference(mode, max_staleness)
+        )
+
+def close_mongo():
+    global client, db
+    if client is not None:
+        client.close()
+    client = None
+    db = None
+    read_dbs.clear()
+    transaction_support.clear()
+
+def read_db(profile: str):
+    """Database handle for a named read profile (transactional, analytics, export).
+
+    Reads that feed a decision, like the balance check before a disbursement,
+    must keep using ``db`` (primary).
+    """
+    return read_dbs[profile]
+
+def supports_transactions() -> bool:
+    """Whether the deployment is a replica set or sharded cluster, which transactions need"""
+    if "supported" not in transaction_support:
+        hello = client.admin.command("hello")
+        transaction_support["supported"] = "setName" in hello or hello.get("msg") == "isdbgrid"
+    return transaction_support["supported"]
+
+def run_in_transaction(callback, rollback):
+    """Run ``callback(session)`` in a multi-document transaction.
+
+    The callback may be retried on transient errors, so it must start from
+    scratch each time. A standalone mongod has no transactions; there the
+    callback runs in a plain session and ``rollback()`` undoes its partial
+    writes when it fails.
+    """
+    with client.start_session() as session:
+        if supports_transactions():
+            return session.with_transaction(callback)
+        try:
+            return callback(session)
+        except BaseException:
+            rollback()
+            raise
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    connect_mongo()
+    # Multi-worker mode runs the one-time setup in the parent process instead
+    if os.environ.get('RUN_STARTUP_TASKS', 'true').lower() != 'false':
+        run_startup_tasks()
+    require_id_storage_migrated()
+    start_change_stream_watcher()
+    job_runner.start()
+    try:
+        yield
+    finally:
+        job_runner.stop()
+        stop_change_stream_watcher()
+        close_mongo()
 
 # FastAPI app
-app = FastAPI(title="Fund Management System API")
+app = FastAPI(title="Fund Management System API", lifespan=lifespan)
 
 # CORS middleware
 app.add_middleware(
@@ -41,10 +280,12 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Change-Token", "ETag"],
 )
 
 # Security
 security = HTTPBearer()
+optional_security = HTTPBearer(auto_error=False)
 
 # Enums
 class UserRole(str, Enum):
@@ -89,6 +330,53 @@ class PaymentStatus(str, Enum):
     OVERDUE = "overdue"
     PARTIAL = "partial"
 
+class PlanStrategy(str, Enum):
+    GREEDY = "greedy"
+    OPTIMAL = "optimal"
+
+class SearchKind(str, Enum):
+    ALL = "all"
+    USERS = "users"
+    APPLICATIONS = "applications"
+
+class RollupMetric(str, Enum):
+    DEPOSITS = "deposits"
+    DISBURSEMENTS = "disbursements"
+    REPAYMENTS = "repayments"
+
+class ReportGranularity(str, Enum):
+    DAY = "day"
+    MONTH = "month"
+    QUARTER = "quarter"
+    YEAR = "year"
+    TOTAL = "total"
+
+class ForecastGranularity(str, Enum):
+    DAILY = "daily"
+    MONTHLY = "monthly"
+
+# Budget cells for the optimal disbursement plan; larger budgets are planned
+# in coarser steps, with amounts rounded up so a plan never overspends
+PLAN_MAX_BUDGET_CELLS = 20000
+
+# Search: query terms considered, and matches ranked per query before paging
+SEARCH_MAX_QUERY_TOKENS = 5
+SEARCH_CANDIDATE_LIMIT = 1000
+SEARCH_MAX_PAGE_SIZE = 100
+
+# Daily rollup sources: metric -> (collection, filter, date field, amount field)
+ROLLUP_SOURCES = {
+    RollupMetric.DEPOSITS.value: ("deposits", {"status": "completed"}, "created_at", "amount"),
+    RollupMetric.DISBURSEMENTS.value: ("disbursements", {"status": "disbursed"}, "disbursement_date", "disbursed_amount"),
+    RollupMetric.REPAYMENTS.value: ("repayment_postings", {"allocated_amount": {"$gt": 0}}, "paid_date", "allocated_amount")
+}
+
+# Liquidity forecast horizons: (default, maximum) periods per granularity
+FORECAST_PERIODS = {
+    ForecastGranularity.DAILY: (90, 730),
+    ForecastGranularity.MONTHLY: (12, 60)
+}
+
 # Pydantic models
 class UserRegister(BaseModel):
     email: EmailStr
@@ -121,6 +409,16 @@ class ApplicationApprovalRequest(BaseModel):
     conditions: Optional[str] = None  # Any conditions for approval
     recommended_amount: Optional[float] = None  # If different from requested
 
+class BulkDecisionItem(BaseModel):
+    application_id: str
+    action: ApprovalAction
+    review_notes: Optional[str] = None
+    conditions: Optional[str] = None
+    recommended_amount: Optional[float] = None
+
+class BulkDecisionRequest(BaseModel):
+    items: List[BulkDecisionItem] = Field(min_length=1, max_length=500)
+
 class UserRoleUpdate(BaseModel):
     user_id: str
     new_role: UserRole
@@ -207,6 +505,19 @@ class FinanceApplication(BaseModel):
     guarantors: List[GuarantorResponse] = Field(default=[])
     approval_history: List[ApprovalHistory] = Field(default=[])
 
+APPLICATION_EXPANSIONS = ["guarantors", "approval_history"]
+APPLICATION_FIELDS = [field for field in FinanceApplication.model_fields if field not in APPLICATION_EXPANSIONS]
+# Reviewer details on admin listings and the stored fields they are computed from
+REVIEW_FIELD_SOURCES = {
+    "applicant_name": ["user_id"],
+    "applicant_email": ["user_id"],
+    "applicant_country": ["user_id"],
+    "required_approval_level": ["amount"],
+    "can_approve": ["amount", "user_id"],
+    "approval_restriction": ["amount", "user_id"]
+}
+REVIEW_FIELDS = list(REVIEW_FIELD_SOURCES)
+
 class Repayment(BaseModel):
     id: str
     user_id: str
@@ -260,6 +571,39 @@ class DisbursementRequest(BaseModel):
     reference_number: Optional[str] = Field(default=None)
     disbursement_method: Optional[str] = Field(default="bank_transfer")
 
+class RepaymentCreate(BaseModel):
+    user_id: str
+    amount: float = Field(gt=0)
+    application_id: Optional[str] = Field(default=None)  # Restrict allocation to one loan
+    reference: Optional[str] = Field(default=None)  # Bank reference, used to skip duplicates
+    paid_date: Optional[datetime] = Field(default=None)
+
+class RepaymentAllocation(BaseModel):
+    schedule_id: str
+    application_id: str
+    installment_number: int
+    amount: float
+    principal_amount: float
+    status: PaymentStatus
+
+class JobCreate(BaseModel):
+    type: str
+    params: dict = Field(default_factory=dict)
+
+class RepaymentPosting(BaseModel):
+    id: str
+    user_id: str
+    amount: float
+    allocated_amount: float
+    unallocated_amount: float
+    application_id: Optional[str] = Field(default=None)
+    reference: Optional[str] = Field(default=None)
+    paid_date: datetime
+    source: str
+    posted_by: str
+    created_at: datetime
+    allocations: List[RepaymentAllocation] = Field(default=[])
+
 # Role permissions
 ROLE_PERMISSIONS = {
     UserRole.MEMBER: ["view_own_data", "create_deposits", "create_applications"],
@@ -268,7 +612,59 @@ ROLE_PERMISSIONS = {
     UserRole.GENERAL_ADMIN: ["all_permissions", "manage_users", "assign_roles", "system_config", "approve_any_loan"]
 }
 
-# Utility functions
+# Live event stream
+REVIEWER_ROLES = [UserRole.COUNTRY_COORDINATOR.value, UserRole.FUND_ADMIN.value, UserRole.GENERAL_ADMIN.value]
+FUND_MANAGER_ROLES = [UserRole.FUND_ADMIN.value, UserRole.GENERAL_ADMIN.value]
+EVENT_QUEUE_SIZE = 100
+SSE_KEEPALIVE_SECONDS = 15
+# EventSource can't send headers, so the stream is opened with a ticket that
+# is good for one connection within this many seconds
+STREAM_TICKET_SECONDS = 30
+WATCHED_COLLECTIONS = ["finance_applications", "approval_history", "guarantors", "disbursements", "fund_pool_stripes", "jobs"]
+
+class EventBus:
+    """In-process fan-out of events to connected SSE clients"""
+    
+    def __init__(self):
+        self._subscribers = {}
+        self._lock = threading.Lock()
+    
+    def has_subscribers(self) -> bool:
+        return bool(self._subscribers)
+    
+    def subscribe(self) -> asyncio.Queue:
+        queue = asyncio.Queue(maxsize=EVENT_QUEUE_SIZE)
+        with self._lock:
+            self._subscribers[queue] = asyncio.get_running_loop()
+        return queue
+    
+    def unsubscribe(self, queue: asyncio.Queue):
+        with self._lock:
+            self._subscribers.pop(queue, None)
+    
+    def publish(self, event: dict):
+        """Deliver an event to every subscriber; safe to call from any thread"""
+        with self._lock:
+            subscribers = list(self._subscribers.items())
+        for queue, loop in subscribers:
+            try:
+                loop.call_soon_threadsafe(self._deliver, queue, event)
+            except RuntimeError:
+                # Event loop already closed
+                self.unsubscribe(queue)
+    
+    @staticmethod
+    def _deliver(queue: asyncio.Queue, event: dict):
+        if queue.full():
+            # Slow client: drop its backlog and tell it to refetch
+            while not queue.empty():
+                queue.get_nowait()
+            event = {"type": "resync", "data": {}}
+        queue.put_nowait(event)
+
+event_bus = EventBus()
+change_stream_state = {"enabled": False, "stopping": False, "stream": None}
+
 def get_system_config():
     """Get current system configuration"""
     config = db.system_config.find_one({"id": "system_config"})
@@ -290,9 +686,9 @@ def get_system_config():
     
     return SystemConfig(**config)
 
-def get_approval_limit(user_role: str) -> float:
+def get_approval_limit(user_role: str, config: SystemConfig = None) -> float:
     """Get approval limit for a specific role"""
-    config = get_system_config()
+    config = config or get_system_config()
     
     if user_role == "country_coordinator":
         return config.country_coordinator_limit
@@ -303,9 +699,9 @@ def get_approval_limit(user_role: str) -> float:
     else:
         return 0.0
 
-def determine_required_approval_level(amount: float, user_country: str = None) -> str:
+def determine_required_approval_level(amount: float, user_country: str = None, config: SystemConfig = None) -> str:
     """Determine what level of approval is required for an amount"""
-    config = get_system_config()
+    config = config or get_system_config()
     
     if amount <= config.country_coordinator_limit:
         return "country_coordinator"
@@ -314,9 +710,15 @@ def determine_required_approval_level(amount: float, user_country: str = None) -
     else:
         return "general_admin"
 
-def can_approve_application(approver_role: str, amount: float, applicant_country: str, approver_country: str) -> tuple[bool, str]:
+def can_approve_application(
+    approver_role: str,
+    amount: float,
+    applicant_country: str,
+    approver_country: str,
+    config: SystemConfig = None
+) -> tuple[bool, str]:
     """Check if user can approve an application"""
-    approval_limit = get_approval_limit(approver_role)
+    approval_limit = get_approval_limit(approver_role, config)
     
     # Check amount limit
     if amount > approval_limit:
@@ -328,6 +730,28 @@ def can_approve_application(approver_role: str, amount: float, applicant_country
     
     return True, "Approved"
 
+def decide_application_status(
+    action: ApprovalAction,
+    approval_amount: float,
+    approver_role: str,
+    config: SystemConfig = None
+) -> ApplicationStatus:
+    """Status an application moves to after a reviewer action"""
+    if action == ApprovalAction.APPROVE:
+        # Check if this approval is sufficient or needs escalation
+        required_level = determine_required_approval_level(approval_amount, config=config)
+        
+        if (approver_role == "country_coordinator" and required_level in ["fund_admin", "general_admin"]) or \
+           (approver_role == "fund_admin" and required_level == "general_admin"):
+            return ApplicationStatus.REQUIRES_HIGHER_APPROVAL
+        return ApplicationStatus.APPROVED
+    elif action == ApprovalAction.REJECT:
+        return ApplicationStatus.REJECTED
+    elif action == ApprovalAction.REQUEST_MORE_INFO:
+        return ApplicationStatus.UNDER_REVIEW
+    else:  # ApprovalAction.ESCALATE
+        return ApplicationStatus.REQUIRES_HIGHER_APPROVAL
+
 def create_access_token(data: dict):
     to_encode = data.copy()
     expire = datetime.utcnow() + timedelta(hours=24)
@@ -335,9 +759,9 @@ def create_access_token(data: dict):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm="HS256")
     return encoded_jwt
 
-def verify_token(credentials: HTTPAuthorizationCredentials = Depends(security)):
+def decode_access_token(token: str) -> str:
     try:
-        payload = jwt.decode(credentials.credentials, SECRET_KEY, algorithms=["HS256"])
+        payload = jwt.decode(token, SECRET_KEY, algorithms=["HS256"])
         user_id: str = payload.get("sub")
         if user_id is None:
             raise HTTPException(status_code=401, detail="Invalid token")
@@ -345,8 +769,11 @@ def verify_token(credentials: HTTPAuthorizationCredentials = Depends(security)):
     except jwt.PyJWTError:
         raise HTTPException(status_code=401, detail="Invalid token")
 
+def verify_token(credentials: HTTPAuthorizationCredentials = Depends(security)):
+    return decode_access_token(credentials.credentials)
+
 def get_current_user(user_id: str = Depends(verify_token)):
-    user = db.users.find_one({"id": user_id})
+    user = get_user(db, user_id)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     return user
@@ -362,53 +789,915 @@ def require_role(required_roles: List[UserRole]):
         return current_user
     return role_checker
 
-def calculate_priority_score(user_id: str) -> tuple[float, int]:
-    """Calculate priority score based on previous finances"""
-    previous_finances_count = db.finance_applications.count_documents({"user_id": user_id})
-    config = get_system_config()
+class RouteLimit:
+    """Requests of one route class in flight in this worker.
+
+    Slots are taken on the event loop; the throttled handlers themselves are
+    plain functions, so their blocking Mongo calls run in the threadpool.
+    """
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.in_flight = 0
+        self._slots = asyncio.Semaphore(limit)
+
+    async def acquire(self, timeout: float) -> bool:
+        """Wait up to ``timeout`` seconds for a slot"""
+        try:
+            await asyncio.wait_for(self._slots.acquire(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        self.in_flight += 1
+        return True
+
+    def release(self):
+        self.in_flight -= 1
+        self._slots.release()
+
+route_limits = {name: RouteLimit(limit) for name, (_, limit) in ROUTE_CLASSES.items()}
+
+def service_unavailable(detail: str) -> HTTPException:
+    return HTTPException(
+        status_code=503, detail=detail, headers={"Retry-After": str(LOAD_SHED_RETRY_AFTER_SECONDS)}
+    )
+
+def route_class(name: str):
+    """Dependency that holds a slot of the route class and applies its time budget.
+
+    Use it in the route decorator: ``dependencies=[Depends(route_class("exports"))]``.
+    """
+    budget_ms, _ = ROUTE_CLASSES[name]
+    limit = route_limits[name]
+
+    async def budgeted():
+        if not await limit.acquire(LOAD_SHED_WAIT_SECONDS):
+            raise service_unavailable("Server busy, please retry")
+        try:
+            with pymongo.timeout(budget_ms / 1000):
+                yield
+        except PyMongoError as error:
+            if not error.timeout:
+                raise
+            raise service_unavailable("Query time budget exceeded")
+        finally:
+            limit.release()
+    return budgeted
+
+def next_sequence(name: str, count: int = 1) -> int:
+    """Atomically advance a named change counter and return its new value.
+
+    With count > 1 the caller owns the block of values ending at the result.
+    """
+    counter = db.counters.find_one_and_update(
+        {"id": name},
+        {"$inc": {"seq": count}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER
+    )
+    return counter["seq"]
+
+def current_sequence(name: str) -> int:
+    """Read a named change counter without incrementing it"""
+    counter = db.counters.find_one({"id": name}, {"_id": 0, "seq": 1})
+    return counter["seq"] if counter else 0
+
+def bump_versions(*names: str):
+    """Advance the change counters behind conditional GETs.
+
+    Call after the data write so a reader never pairs a new version with old data.
+    """
+    operations = [
+        UpdateOne(
+            {"id": f"{name}#{random.randrange(VERSION_STRIPES)}" if name in STRIPED_VERSIONS else name},
+            {"$inc": {"seq": 1}},
+            upsert=True
+        )
+        for name in dict.fromkeys(names)
+    ]
+    if operations:
+        db.counters.bulk_write(operations, ordered=False)
+
+def read_versions(names: List[str], session=None) -> dict:
+    """Current value of each named change counter.
+
+    Striped counters are summed, including the unstriped document of earlier
+    deployments and stripes left over after lowering VERSION_STRIPES, so the
+    sum never goes back.
+    """
+    query = [{"id": {"$in": list(names)}}] + [
+        {"id": {"$regex": f"^{re.escape(name)}#"}} for name in names if name in STRIPED_VERSIONS
+    ]
+    versions = dict.fromkeys(names, 0)
+    for counter in db.counters.find({"$or": query}, {"_id": 0, "id": 1, "seq": 1}, session=session):
+        versions[counter["id"].split("#", 1)[0]] += counter["seq"]
+    return versions
+
+def check_etag(
+    request: Request,
+    response: Response,
+    scope: str,
+    version_names: List[str],
+    session=None
+) -> Optional[Response]:
+    """Set a version-based ETag and return a 304 when the client already has it.
+
+    The ETag only depends on change counters, so a match skips the endpoint's
+    queries and serialization entirely. Pass a causally consistent session when
+    the body is read from a secondary, so it is at least as new as the versions.
+    """
+    names = ["epoch", *version_names]
+    versions = read_versions(names, session)
+    etag = 'W/"' + "-".join([scope, *(str(versions[name]) for name in names)]) + '"'
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    
+    if_none_match = request.headers.get("if-none-match", "")
+    if etag in [tag.strip() for tag in if_none_match.split(",")]:
+        return Response(status_code=304, headers=headers)
+    
+    response.headers.update(headers)
+    return None
+
+def request_fingerprint(payload) -> str:
+    return hashlib.sha256(json.dumps(jsonable_encoder(payload), sort_keys=True).encode()).hexdigest()
+
+def renew_idempotency_lock(record_id: str, owner: str, stop: threading.Event, lost: threading.Event):
+    """Keep extending a claimed key's lock until ``stop`` is set; sets ``lost`` if the claim is gone"""
+    locked_until = datetime.utcnow() + timedelta(seconds=IDEMPOTENCY_LOCK_SECONDS)
+    while not stop.wait(IDEMPOTENCY_LOCK_SECONDS / 3):
+        renewed_until = datetime.utcnow() + timedelta(seconds=IDEMPOTENCY_LOCK_SECONDS)
+        try:
+            renewed = db.idempotency_keys.update_one(
+                {"id": record_id, "owner": owner, "status": "in_progress"},
+                {"$set": {"locked_until": renewed_until}}
+            )
+        except PyMongoError as exc:
+            if datetime.utcnow() >= locked_until:
+                logger.error("Idempotency lock %s lapsed while renewals failed: %s", record_id, exc)
+            else:
+                logger.warning("Could not renew idempotency lock %s: %s", record_id, exc)
+            continue
+        if not renewed.matched_count:
+            logger.error("Idempotency key %s was taken over while its request ran", record_id)
+            lost.set()
+            return
+        locked_until = renewed_until
+
+async def idempotent(request: Request, scope: str, payload, execute):
+    """Run ``execute()`` at most once per ``Idempotency-Key`` header.
+
+    The first request claims the key in ``idempotency_keys`` and stores its
+    response; retries get that response back without executing again.
+    Concurrent duplicates wait for the first one to finish. The claim's lock
+    is renewed while it executes, so a duplicate only takes over once the
+    worker holding it died. A request whose claim was taken over anyway gets a
+    409 instead of a response nothing recorded. A failed execution releases the
+    key so the client can retry. Requests without the header run as before.
+    """
+    key = request.headers.get("idempotency-key")
+    if not key:
+        return execute()
+    if len(key) > 255:
+        raise HTTPException(status_code=400, detail="Idempotency-Key must be at most 255 characters")
+    
+    record_id = f"{scope}:{key}"
+    fingerprint = request_fingerprint(payload)
+    # Identifies this attempt, so a request that lost its claim can't complete or release it
+    owner = str(uuid.uuid4())
+    
+    def claim() -> bool:
+        now = datetime.utcnow()
+        locked_until = now + timedelta(seconds=IDEMPOTENCY_LOCK_SECONDS)
+        try:
+            db.idempotency_keys.insert_one({
+                "id": record_id,
+                "fingerprint": fingerprint,
+                "status": "in_progress",
+                "owner": owner,
+                "locked_until": locked_until,
+                "created_at": now,
+                "expires_at": now + timedelta(hours=IDEMPOTENCY_TTL_HOURS)
+            })
+            return True
+        except DuplicateKeyError:
+            # Take over from a first request whose worker died mid-execution
+            return db.idempotency_keys.find_one_and_update(
+                {"id": record_id, "fingerprint": fingerprint, "status": "in_progress", "locked_until": {"$lt": now}},
+                {"$set": {"owner": owner, "locked_until": locked_until}}
+            ) is not None
+    
+    while not claim():
+        record = db.idempotency_keys.find_one({"id": record_id}, {"_id": 0})
+        if not record:
+            continue
+        if record["fingerprint"] != fingerprint:
+            raise HTTPException(status_code=400, detail="Idempotency-Key was already used for a different request")
+        if record["status"] == "completed":
+            return JSONResponse(
+                status_code=record["status_code"],
+                content=record["response"],
+                headers={"Idempotent-Replayed": "true"}
+            )
+        await asyncio.sleep(IDEMPOTENCY_POLL_SECONDS)
+    
+    stop_renewing = threading.Event()
+    claim_lost = threading.Event()
+    renewer = threading.Thread(
+        target=renew_idempotency_lock, args=(record_id, owner, stop_renewing, claim_lost),
+        name="idempotency-lock", daemon=True
+    )
+    renewer.start()
+    try:
+        result = execute()
+    except Exception:
+        db.idempotency_keys.delete_one({"id": record_id, "owner": owner, "status": "in_progress"})
+        raise
+    finally:
+        stop_renewing.set()
+        renewer.join()
+    
+    response = jsonable_encoder(result)
+    if not claim_lost.is_set():
+        completed = db.idempotency_keys.update_one(
+            {"id": record_id, "owner": owner, "status": "in_progress"},
+            {"$set": {"status": "completed", "status_code": 200, "response": response, "completed_at": datetime.utcnow()}}
+        )
+        if not completed.matched_count:
+            logger.error("Idempotency key %s was taken over before it completed", record_id)
+            claim_lost.set()
+    if claim_lost.is_set():
+        # The attempt that took over owns the stored response; a retry gets that one
+        raise HTTPException(
+            status_code=409,
+            detail="Idempotency-Key was taken over while this request ran; retry to get the recorded result"
+        )
+    return response
+
+def user_version(user_id: str) -> str:
+    """Change counter for everything a member's own views show"""
+    return f"user:{user_id}"
+
+@contextmanager
+def application_changes(count: int = 1):
+    """Reserve ``count`` change_seq values for application writes made in the block.
+
+    Yields the first value of the block. Until the block exits, a claim in
+    ``change_claims`` holds the counter value from before the reservation, and
+    approval queue tokens don't move past it. A delta therefore never skips a
+    write that took its number but hasn't landed yet.
+    """
+    claim_id = db.change_claims.insert_one({
+        "floor": current_sequence("finance_applications"),
+        "created_at": datetime.utcnow()
+    }).inserted_id
+    try:
+        yield next_sequence("finance_applications", count) - count + 1
+    finally:
+        db.change_claims.delete_one({"_id": claim_id})
+
+def landed_application_sequence() -> int:
+    """Highest change_seq at or below which every application write has landed"""
+    latest = current_sequence("finance_applications")
+    claim = db.change_claims.find_one(
+        {"created_at": {"$gt": datetime.utcnow() - timedelta(seconds=CHANGE_CLAIM_SECONDS)}},
+        {"_id": 0, "floor": 1},
+        sort=[("floor", ASCENDING)]
+    )
+    return min(latest, claim["floor"]) if claim else latest
+
+def application_change_fields(change_seq: int) -> dict:
+    """Fields every finance application write sets so delta readers can find it"""
+    return {"change_seq": change_seq, "updated_at": datetime.utcnow()}
+
+def touch_application(application_id: str):
+    """Mark an application as changed when its guarantors or history change"""
+    with application_changes() as change_seq:
+        db.finance_applications.update_one(by_id(application_id), {"$set": application_change_fields(change_seq)})
+
+def empty_member_stats(user_id: str) -> dict:
+    """Member stats for a user with no recorded activity"""
+    return {
+        "user_id": user_id,
+        "total_deposits": 0.0,
+        "deposit_count": 0,
+        "total_applications": 0,
+        "application_counts": {},
+        "outstanding_principal": 0.0,
+        "guarantee_exposure": 0.0,
+        "guarantee_capacity": 0.0
+    }
+
+def get_member_stats(user_id: str) -> dict:
+    """Get the incrementally maintained stats document for a member"""
+    stats = db.member_stats.find_one({"user_id": user_id}, {"_id": 0})
+    return {**empty_member_stats(user_id), **(stats or {})}
+
+def get_member_stats_map(user_ids: List[str]) -> dict:
+    """Get stats documents for many members with a single query"""
+    stats_map = {user_id: empty_member_stats(user_id) for user_id in user_ids}
+    for stats in db.member_stats.find({"user_id": {"$in": list(user_ids)}}, {"_id": 0}):
+        stats_map[stats["user_id"]].update(stats)
+    return stats_map
+
+def member_stats_update(deltas: dict) -> dict:
+    """Build an atomic $inc update for member stats deltas"""
+    # Guarantee capacity is the deposits not already backing live guarantees. It
+    # is always incremented so that upserted documents have it.
+    capacity_delta = deltas.get("total_deposits", 0) - deltas.get("guarantee_exposure", 0)
+    return {
+        "$inc": {**deltas, "guarantee_capacity": capacity_delta},
+        "$set": {"updated_at": datetime.utcnow()}
+    }
+
+def increment_member_stats(user_id: str, deltas: dict):
+    """Atomically apply counter deltas to a member's stats document"""
+    if deltas:
+        db.member_stats.update_one({"user_id": user_id}, member_stats_update(deltas), upsert=True)
+
+def increment_member_stats_bulk(deltas_by_user: dict, session=None):
+    """Apply counter deltas for many members with one bulk_write"""
+    operations = [
+        UpdateOne({"user_id": user_id}, member_stats_update(deltas), upsert=True)
+        for user_id, deltas in deltas_by_user.items() if deltas
+    ]
+    if operations:
+        db.member_stats.bulk_write(operations, ordered=False, session=session)
+
+def application_status_deltas(previous_status: Optional[str], new_status: str) -> dict:
+    """Member stats deltas for an application moving between statuses"""
+    if previous_status == new_status:
+        return {}
+    deltas = {f"application_counts.{new_status}": 1}
+    if previous_status is None:
+        deltas["total_applications"] = 1
+    else:
+        deltas[f"application_counts.{previous_status}"] = -1
+    return deltas
+
+def rebuild_member_stats() -> int:
+    """Recompute every member stats document from the source collections"""
+    stats_map = {user["id"]: empty_member_stats(user["id"]) for user in db.users.find({}, {"_id": 0, "id": 1})}
+    
+    def stats_for(user_id):
+        return stats_map.setdefault(user_id, empty_member_stats(user_id))
+    
+    for row in db.deposits.aggregate([
+        {"$match": {"status": "completed"}},
+        {"$group": {"_id": "$user_id", "total": {"$sum": "$amount"}, "count": {"$sum": 1}}}
+    ]):
+        stats_for(row["_id"]).update({"total_deposits": row["total"], "deposit_count": row["count"]})
+    
+    for row in db.finance_applications.aggregate([
+        archive_union("finance_applications"),
+        {"$group": {"_id": {"user_id": "$user_id", "status": "$status"}, "count": {"$sum": 1}}}
+    ]):
+        stats = stats_for(row["_id"]["user_id"])
+        stats["application_counts"][row["_id"]["status"]] = row["count"]
+        stats["total_applications"] += row["count"]
+    
+    for row in db.disbursements.aggregate([
+        {"$match": {"status": "disbursed"}},
+        {"$group": {"_id": "$user_id", "total": {"$sum": "$disbursed_amount"}}}
+    ]):
+        stats_for(row["_id"])["outstanding_principal"] += row["total"]
+    
+    # Repaid principal is the principal share of each paid or part-paid installment
+    for row in aggregate_installments([
+        {"$match": {"status": {"$in": ["paid", "partial"]}, "amount": {"$gt": 0}}},
+        {"$group": {
+            "_id": "$user_id",
+            "total": {"$sum": {"$multiply": [
+                "$principal_amount",
+                {"$divide": [{"$min": ["$paid_amount", "$amount"]}, "$amount"]}
+            ]}}
+        }}
+    ], include_archived=True):
+        stats_for(row["_id"])["outstanding_principal"] -= row["total"]
+    
+    # Guarantees of closed loans carry no exposure, and closed loans are the only ones archived
+    for row in db.guarantors.aggregate([
+        {"$match": {"status": "accepted", "exposure": {"$gt": 0}}},
+        {"$group": {"_id": "$guarantor_user_id", "total": {"$sum": "$exposure"}}}
+    ]):
+        stats_for(row["_id"])["guarantee_exposure"] += row["total"]
+    
+    now = datetime.utcnow()
+    operations = []
+    for stats in stats_map.values():
+        stats["outstanding_principal"] = round(max(stats["outstanding_principal"], 0.0), 2)
+        stats["guarantee_capacity"] = round(stats["total_deposits"] - stats["guarantee_exposure"], 2)
+        stats["updated_at"] = now
+        # Only the rebuilt fields are replaced; credit scores come from their own job
+        operations.append(UpdateOne({"user_id": stats["user_id"]}, {"$set": stats}, upsert=True))
+    if operations:
+        db.member_stats.bulk_write(operations, ordered=False)
+    
+    return len(operations)
+
+def rescore_members() -> int:
+    """Recompute every member's credit score from repayment history and store it on member stats"""
+    scored_at = datetime.utcnow()
+    scores = score_members(db, scored_at)
+    operations = [
+        # Members with installments have stats from their applications
+        UpdateOne({"user_id": user_id}, {"$set": {"credit": {
+            "score": float(row["score"]),
+            "on_time_ratio": float(row["on_time_ratio"]),
+            "average_days_late": float(row["average_days_late"]),
+            "defaults": int(row["defaults"]),
+            "installments_due": int(row["installments_due"]),
+            "version": CREDIT_SCORE_VERSION,
+            "scored_at": scored_at
+        }}})
+        for user_id, row in scores.iterrows()
+    ]
+    if operations:
+        db.member_stats.bulk_write(operations, ordered=False)
+    return len(operations)
+
+def rollup_day(moment: datetime) -> datetime:
+    return datetime(moment.year, moment.month, moment.day)
+
+def user_countries(user_ids) -> dict:
+    """Country of each user, loaded with one query"""
+    return {user_id: user.get("country") for user_id, user in users_by_ids(db, user_ids, USER_COUNTRY).items()}
+
+def record_rollups(entries: List[tuple]):
+    """Add (metric, moment, country, amount) entries to the daily rollups with one bulk_write"""
+    totals = {}
+    for metric, moment, country, amount in entries:
+        key = (metric, rollup_day(moment), country or "Unknown")
+        total, count = totals.get(key, (0.0, 0))
+        totals[key] = (total + amount, count + 1)
+    
+    now = datetime.utcnow()
+    operations = [
+        UpdateOne(
+            {"metric": metric, "day": day, "country": country},
+            {"$inc": {"total": total, "count": count}, "$set": {"updated_at": now}},
+            upsert=True
+        )
+        for (metric, day, country), (total, count) in totals.items()
+    ]
+    if operations:
+        db.daily_rollups.bulk_write(operations, ordered=False)
+
+def rebuild_daily_rollups() -> int:
+    """Recompute every daily rollup from the source transactions.
+
+    Writes that land while this runs can be counted twice or missed, so run it
+    when the fund is quiet.
+    """
+    started = datetime.utcnow()
+    rebuilt = 0
+    for metric, (collection, match, date_field, amount_field) in ROLLUP_SOURCES.items():
+        rows = db[collection].aggregate([
+            {"$match": {**match, date_field: {"$ne": None}}},
+            {"$group": {
+                "_id": {
+                    "user_id": "$user_id",
+                    "day": {"$dateToString": {"format": "%Y-%m-%d", "date": f"${date_field}"}}
+                },
+                "total": {"$sum": f"${amount_field}"},
+                "count": {"$sum": 1}
+            }}
+        ], allowDiskUse=True)
+        rows = list(rows)
+        countries = user_countries({row["_id"]["user_id"] for row in rows})
+        
+        totals = {}
+        for row in rows:
+            key = (datetime.strptime(row["_id"]["day"], "%Y-%m-%d"), countries.get(row["_id"]["user_id"]) or "Unknown")
+            total, count = totals.get(key, (0.0, 0))
+            totals[key] = (total + row["total"], count + row["count"])
+        
+        operations = [
+            ReplaceOne(
+                {"metric": metric, "day": day, "country": country},
+                {"metric": metric, "day": day, "country": country, "total": total, "count": count, "updated_at": started},
+                upsert=True
+            )
+            for (day, country), (total, count) in totals.items()
+        ]
+        if operations:
+            db.daily_rollups.bulk_write(operations, ordered=False)
+        db.daily_rollups.delete_many({"metric": metric, "updated_at": {"$lt": started}})
+        rebuilt += len(operations)
+    
+    return rebuilt
+
+def rollup_period(day: datetime, granularity: str) -> str:
+    if granularity == ReportGranularity.DAY.value:
+        return day.strftime("%Y-%m-%d")
+    if granularity == ReportGranularity.MONTH.value:
+        return day.strftime("%Y-%m")
+    if granularity == ReportGranularity.QUARTER.value:
+        return f"{day.year}-Q{(day.month - 1) // 3 + 1}"
+    if granularity == ReportGranularity.YEAR.value:
+        return str(day.year)
+    return "total"
+
+def set_guarantee_exposure(application_ids: List[str], share: float) -> List[str]:
+    """Set the exposure of the applications' accepted guarantees to ``share`` of
+    their guaranteed amount and apply the change to guarantor stats.
+
+    Returns the affected guarantor user ids.
+    """
+    if not supports_transactions():
+        return set_guarantee_exposure_one_by_one(application_ids, share)
+    
+    # In a transaction every conditional write matches what was read, or the
+    # whole attempt conflicts and is retried, so one bulk_write covers them all
+    deltas_by_user = {}
+    
+    def write(session):
+        deltas_by_user.clear()
+        changes = []
+        for g in db.guarantors.find(
+            {"application_id": {"$in": application_ids}, "status": GuarantorStatus.ACCEPTED.value},
+            {"_id": 0, "id": 1, "guarantor_user_id": 1, "guaranteed_amount": 1, "exposure": 1},
+            session=session
+        ):
+            exposure = round(g["guaranteed_amount"] * share, 2)
+            if exposure != (g.get("exposure") or 0.0):
+                changes.append((g, exposure))
+        if not changes:
+            return
+        db.guarantors.bulk_write([
+            UpdateOne(
+                {**by_id(g["id"]), "status": GuarantorStatus.ACCEPTED.value, "exposure": g.get("exposure")},
+                {"$set": {"exposure": exposure}}
+            )
+            for g, exposure in changes
+        ], ordered=False, session=session)
+        for g, exposure in changes:
+            deltas = deltas_by_user.setdefault(g["guarantor_user_id"], {"guarantee_exposure": 0.0})
+            deltas["guarantee_exposure"] += exposure - (g.get("exposure") or 0.0)
+        increment_member_stats_bulk(deltas_by_user, session)
+    
+    run_in_transaction(write, lambda: None)
+    return list(deltas_by_user)
+
+def set_guarantee_exposure_one_by_one(application_ids: List[str], share: float) -> List[str]:
+    """set_guarantee_exposure without transactions, one conditional write per guarantee"""
+    accepted_guarantors = db.guarantors.find(
+        {"application_id": {"$in": application_ids}, "status": GuarantorStatus.ACCEPTED.value},
+        {"_id": 0, "id": 1, "guarantor_user_id": 1, "guaranteed_amount": 1, "exposure": 1}
+    )
+    deltas_by_user = {}
+    for g in accepted_guarantors:
+        exposure = round(g["guaranteed_amount"] * share, 2)
+        current = g.get("exposure")
+        # Each write is conditional on the exposure it replaces, so overlapping
+        # updates of the same guarantee apply their stats delta only once
+        while exposure != (current or 0.0):
+            updated = db.guarantors.update_one(
+                {**by_id(g["id"]), "status": GuarantorStatus.ACCEPTED.value, "exposure": current},
+                {"$set": {"exposure": exposure}}
+            )
+            if updated.modified_count:
+                deltas = deltas_by_user.setdefault(g["guarantor_user_id"], {"guarantee_exposure": 0.0})
+                deltas["guarantee_exposure"] += exposure - (current or 0.0)
+                break
+            latest = db.guarantors.find_one(
+                {**by_id(g["id"]), "status": GuarantorStatus.ACCEPTED.value}, {"_id": 0, "exposure": 1}
+            )
+            if not latest:
+                break
+            current = latest.get("exposure")
+    increment_member_stats_bulk(deltas_by_user)
+    return list(deltas_by_user)
+
+def release_guarantee_exposure(application_ids: List[str]) -> List[str]:
+    """Clear the exposure of guarantees on loans that were rejected or repaid"""
+    return set_guarantee_exposure(application_ids, 0.0)
+
+def disbursed_share(application: dict, disbursed_amount: float) -> float:
+    """Part of the requested amount that was disbursed; guarantees cover at most all of it"""
+    return min(1.0, disbursed_amount / application["amount"]) if application["amount"] else 1.0
+
+def search_tokens(*texts: Optional[str]) -> List[str]:
+    """Lowercase, accent-folded word tokens of the given texts, deduplicated"""
+    tokens = []
+    for text in texts:
+        if not text:
+            continue
+        folded = unicodedata.normalize("NFKD", text)
+        folded = "".join(char for char in folded if not unicodedata.combining(char)).lower()
+        tokens.extend(re.findall(r"[a-z0-9]+", folded))
+    return list(dict.fromkeys(tokens))
+
+def user_search_document(user: dict) -> dict:
+    return {
+        "kind": "user",
+        "ref_id": user["id"],
+        "country": user.get("country"),
+        "title": user.get("full_name"),
+        "title_tokens": search_tokens(user.get("full_name")),
+        "tokens": search_tokens(user.get("full_name"), user.get("email"), user.get("country")),
+        "updated_at": datetime.utcnow()
+    }
+
+def application_search_document(application: dict, applicant: Optional[dict]) -> dict:
+    applicant = applicant or {}
+    return {
+        "kind": "application",
+        "ref_id": application["id"],
+        "country": applicant.get("country"),
+        "title": application.get("purpose"),
+        "title_tokens": search_tokens(application.get("purpose")),
+        "tokens": search_tokens(
+            application.get("purpose"), application.get("description"),
+            applicant.get("full_name"), applicant.get("country")
+        ),
+        "updated_at": datetime.utcnow()
+    }
+
+def index_search_documents(documents: List[dict]):
+    """Upsert entries in the search index, keyed by (kind, ref_id)"""
+    operations = [
+        ReplaceOne({"kind": document["kind"], "ref_id": document["ref_id"]}, document, upsert=True)
+        for document in documents
+    ]
+    if operations:
+        db.search_index.bulk_write(operations, ordered=False)
+
+def rebuild_search_index(batch_size: int = 1000) -> int:
+    """Re-index every user and application"""
+    indexed = 0
+    users = db.users.find({}, {"_id": 0, "id": 1, "full_name": 1, "email": 1, "country": 1})
+    batch = []
+    for user in users:
+        batch.append(user_search_document(user))
+        if len(batch) >= batch_size:
+            index_search_documents(batch)
+            indexed += len(batch)
+            batch = []
+    index_search_documents(batch)
+    indexed += len(batch)
+    
+    applications = db.finance_applications.find({}, {"_id": 0, "id": 1, "user_id": 1, "purpose": 1, "description": 1})
+    batch = []
+    for application in applications:
+        batch.append(application)
+        if len(batch) >= batch_size:
+            applicants = get_applicants(batch)
+            index_search_documents([application_search_document(app, applicants.get(app["user_id"])) for app in batch])
+            indexed += len(batch)
+            batch = []
+    applicants = get_applicants(batch)
+    index_search_documents([application_search_document(app, applicants.get(app["user_id"])) for app in batch])
+    indexed += len(batch)
+    
+    return indexed
+
+def search_score(document: dict, query_tokens: List[str]) -> float:
+    """Rank a match: title words beat other fields, whole words beat prefixes"""
+    title_tokens = set(document.get("title_tokens", []))
+    tokens = set(document["tokens"])
+    score = 0.0
+    for query_token in query_tokens:
+        if query_token in title_tokens:
+            score += 3
+        elif any(token.startswith(query_token) for token in title_tokens):
+            score += 2
+        elif query_token in tokens:
+            score += 1
+        else:
+            score += 0.5
+    return score
+
+def archive_union(name: str, pipeline: list = None) -> dict:
+    """Aggregation stage that appends the archived documents of a collection"""
+    return {"$unionWith": {"coll": ARCHIVE_COLLECTIONS[name], "pipeline": pipeline or []}}
+
+def collections_with_archive(name: str, include_archived: bool = False, database=None) -> list:
+    """A hot collection followed, when asked, by its archive"""
+    database = database if database is not None else db
+    return [database[name]] + ([database[ARCHIVE_COLLECTIONS[name]]] if include_archived else [])
+
+def find_with_archive(
+    name: str,
+    query: dict,
+    projection: dict = None,
+    sort: list = None,
+    limit: int = 0,
+    include_archived: bool = False,
+    database=None
+) -> List[dict]:
+    """Find in a hot collection and, when asked, its archive, merged in sort order.
+
+    Sort fields are always read so the merge can order by them, even when the
+    projection leaves them out.
+    """
+    collections = collections_with_archive(name, include_archived, database)
+    if projection and sort:
+        projection = including(projection, *[field for field, _ in sort])
+    documents = []
+    for collection in collections:
+        cursor = collection.find(query, projection)
+        if sort:
+            cursor = cursor.sort(sort)
+        if limit:
+            cursor = cursor.limit(limit)
+        documents.extend(cursor)
+    
+    if include_archived and sort:
+        for field, direction in reversed(sort):
+            # Missing values sort first, as they do in Mongo
+            documents.sort(
+                key=lambda document: (document.get(field) is not None, document.get(field)),
+                reverse=direction == DESCENDING
+            )
+    return documents[:limit] if limit else documents
+
+def find_one_with_archive(name: str, query: dict, projection: dict = None) -> Optional[dict]:
+    """Find one document, falling back to the archive"""
+    return db[name].find_one(query, projection) or db[ARCHIVE_COLLECTIONS[name]].find_one(query, projection)
+
+def find_applications_by_ids(application_ids, projection: dict) -> dict:
+    """Applications keyed by id, hot or archived, in at most two queries"""
+    return find_by_ids(collections_with_archive("finance_applications", True), application_ids, projection)
+
+def find_closed_application_ids(cutoff: datetime, batch_size: int = ARCHIVE_BATCH_SIZE):
+    """Yield batches of ids of applications closed before ``cutoff``.
+
+    Closed means rejected, or disbursed with every installment paid.
+    """
+    while True:
+        rejected = [
+            app["id"] for app in db.finance_applications.find(
+                {"status": ApplicationStatus.REJECTED.value, "$or": [
+                    {"updated_at": {"$lt": cutoff}},
+                    {"updated_at": {"$exists": False}, "created_at": {"$lt": cutoff}}
+                ]},
+                {"_id": 0, "id": 1}
+            ).limit(batch_size)
+        ]
+        if not rejected:
+            break
+        yield rejected
+    
+    last_id = None
+    while True:
+        query = {"status": ApplicationStatus.DISBURSED.value, "created_at": {"$lt": cutoff}}
+        if last_id is not None:
+            query["_id"] = {"$gt": last_id}
+        disbursed = list(db.finance_applications.find(query, {"_id": 1, "id": 1}).sort("_id", 1).limit(batch_size))
+        if not disbursed:
+            break
+        last_id = disbursed[-1]["_id"]
+        
+        repaid = repaid_application_ids([app["id"] for app in disbursed], paid_before=cutoff)
+        if repaid:
+            yield repaid
+
+def repaid_application_ids(application_ids: List[str], paid_before: datetime = None) -> List[str]:
+    """Those of the disbursed applications with every installment paid"""
+    repaid = {"open": 0}
+    if paid_before:
+        repaid["last_paid"] = {"$lt": paid_before}
+    return [
+        row["_id"] for row in aggregate_installments([
+            {"$match": {"application_id": {"$in": application_ids}}},
+            {"$group": {
+                "_id": "$application_id",
+                "open": {"$sum": {"$cond": [{"$eq": ["$status", PaymentStatus.PAID.value]}, 0, 1]}},
+                "last_paid": {"$max": "$paid_date"}
+            }},
+            {"$match": repaid}
+        ])
+    ]
+
+def archive_applications(application_ids: List[str]) -> dict:
+    """Move applications with their guarantors, history and schedules to the archive.
+
+    Documents are copied before they are deleted, so an interrupted run leaves
+    duplicates rather than gaps, and a rerun finishes the move.
+    """
+    now = datetime.utcnow()
+    moved = {}
+    for name, key in [
+        ("finance_applications", "id"),
+        ("guarantors", "application_id"),
+        ("approval_history", "application_id"),
+        (schedule_collection(), "application_id")
+    ]:
+        documents = list(db[name].find({key: {"$in": application_ids}}))
+        if documents:
+            db[ARCHIVE_COLLECTIONS[name]].bulk_write([
+                ReplaceOne({"_id": document["_id"]}, {**document, "archived_at": now}, upsert=True)
+                for document in documents
+            ], ordered=False)
+        moved[name] = documents
+    
+    # Children first, so a hot application never points at archived children
+    for name in ["guarantors", "approval_history", schedule_collection(), "finance_applications"]:
+        if moved[name]:
+            db[name].delete_many({"_id": {"$in": [document["_id"] for document in moved[name]]}})
+    
+    db.search_index.update_many(
+        {"kind": "application", "ref_id": {"$in": application_ids}},
+        {"$set": {"archived": True}}
+    )
+    
+    # Approval queue deltas older than the newest archived change must reload in full
+    change_seqs = [app.get("change_seq") or 0 for app in moved["finance_applications"]]
+    if change_seqs:
+        db.counters.update_one({"id": "archive_watermark"}, {"$max": {"seq": max(change_seqs)}}, upsert=True)
+    
+    return moved
+
+def run_archival(older_than_days: int = ARCHIVE_AFTER_DAYS, progress=None) -> dict:
+    """Archive every application closed more than ``older_than_days`` ago"""
+    cutoff = datetime.utcnow() - timedelta(days=older_than_days)
+    counts = {name: 0 for name in ["finance_applications", "guarantors", "approval_history", schedule_collection()]}
+    user_ids = set()
+    for application_ids in find_closed_application_ids(cutoff):
+        moved = archive_applications(application_ids)
+        for name, documents in moved.items():
+            counts[name] += len(documents)
+        user_ids.update(app["user_id"] for app in moved["finance_applications"])
+        user_ids.update(g["guarantor_user_id"] for g in moved["guarantors"])
+        if progress:
+            progress(counts["finance_applications"], None, "applications archived")
+    
+    if counts["finance_applications"]:
+        bump_versions(*[user_version(user_id) for user_id in user_ids], "data")
+    return counts
+
+def calculate_priority_score(user_id: str, config: SystemConfig = None) -> tuple[float, int]:
+    """Calculate priority score from the member's credit score, or previous finances without one"""
+    stats = get_member_stats(user_id)
+    previous_finances_count = stats["total_applications"]
+    config = config or get_system_config()
     priority_weight = config.priority_weight
     
-    if previous_finances_count == 0:
+    credit = stats.get("credit")
+    if credit and credit["version"] == CREDIT_SCORE_VERSION:
+        # Members with repayment history are ranked by how they repaid
+        priority_score = max(1, priority_weight * credit["score"] / 100)
+    elif previous_finances_count == 0:
         priority_score = priority_weight
     else:
         priority_score = max(1, priority_weight - (previous_finances_count * 10))
     
     return priority_score, previous_finances_count
 
-def check_guarantor_eligibility(user_id: str) -> tuple[bool, float]:
-    """Check if user is eligible to be a guarantor"""
-    config = get_system_config()
-    minimum_deposit_for_guarantor = config.minimum_deposit_for_guarantor
+def required_guarantee_capacity(config: SystemConfig, guaranteed_amount: float = 0.0) -> float:
+    """Free deposits a guarantor needs to back a guarantee of ``guaranteed_amount``"""
+    return max(guaranteed_amount, config.minimum_deposit_for_guarantor)
+
+def check_guarantor_eligibility(
+    user_id: str, stats: dict = None, config: SystemConfig = None, guaranteed_amount: float = 0.0
+) -> tuple[bool, float]:
+    """Check if user is eligible to be a guarantor, for a guarantee of ``guaranteed_amount`` when given"""
+    config = config or get_system_config()
     
-    total_deposits_result = db.deposits.aggregate([
-        {"$match": {"user_id": user_id, "status": "completed"}},
-        {"$group": {"_id": None, "total": {"$sum": "$amount"}}}
-    ])
-    total_deposits_list = list(total_deposits_result)
-    total_deposits = total_deposits_list[0]["total"] if total_deposits_list else 0
+    stats = stats or get_member_stats(user_id)
+    total_deposits = stats["total_deposits"]
     
-    is_eligible = total_deposits >= minimum_deposit_for_guarantor
+    # Deposits already backing live guarantees can't back another one
+    is_eligible = total_deposits - stats["guarantee_exposure"] >= required_guarantee_capacity(config, guaranteed_amount)
     return is_eligible, total_deposits
 
+def load_fund_pool_stripes(session=None) -> List[dict]:
+    return list(db.fund_pool_stripes.find({}, {"_id": 0}, session=session))
+
 def get_fund_pool() -> FundPool:
-    """Get or create fund pool record"""
-    fund_pool = db.fund_pool.find_one({"id": "fund_pool"})
-    if not fund_pool:
-        # Create initial fund pool
-        fund_pool_doc = {
-            "id": "fund_pool",
-            "total_deposits": 0.0,
-            "total_disbursed": 0.0,
-            "total_repaid": 0.0,
-            "available_balance": 0.0,
-            "total_receivables": 0.0,
-            "last_updated": datetime.utcnow(),
-            "updated_by": None
-        }
-        db.fund_pool.insert_one(fund_pool_doc)
-        fund_pool = fund_pool_doc
-    
-    return FundPool(**fund_pool)
+    """Fund pool totals, summed over the stripes"""
+    stripes = load_fund_pool_stripes()
+    if not stripes:
+        return FundPool()
+    
+    latest = max(stripes, key=lambda stripe: stripe["last_updated"])
+    return FundPool(
+        **{field: round(sum(stripe.get(field, 0.0) for stripe in stripes), 2) for field in FUND_POOL_TOTALS},
+        last_updated=latest["last_updated"],
+        updated_by=latest.get("updated_by")
+    )
+
+def fund_pool_stripe_update(
+    deposit_amount: float = 0.0,
+    disbursement_amount: float = 0.0,
+    repayment_amount: float = 0.0,
+    updated_by: str = None
+) -> dict:
+    """Build an atomic $inc update of one fund pool stripe"""
+    return {
+        "$inc": {
+            "total_deposits": deposit_amount,
+            "total_disbursed": disbursement_amount,
+            "total_repaid": repayment_amount,
+            "available_balance": deposit_amount + repayment_amount - disbursement_amount,
+            "total_receivables": disbursement_amount - repayment_amount
+        },
+        "$set": {"last_updated": datetime.utcnow(), "updated_by": updated_by}
+    }
+
+def publish_fund_pool():
+    """Advance the fund pool version and announce the new totals to listeners"""
+    bump_versions("fund_pool")
+    emit_event(fund_pool_totals_event)
 
 def update_fund_pool(
     deposit_amount: float = 0.0,
@@ -416,34 +1705,126 @@ def update_fund_pool(
     repayment_amount: float = 0.0,
     updated_by: str = None
 ):
-    """Update fund pool balances"""
-    current_pool = get_fund_pool()
-    
-    new_total_deposits = current_pool.total_deposits + deposit_amount
-    new_total_disbursed = current_pool.total_disbursed + disbursement_amount
-    new_total_repaid = current_pool.total_repaid + repayment_amount
-    
-    # Calculate available balance and receivables
-    new_available_balance = new_total_deposits + new_total_repaid - new_total_disbursed
-    new_total_receivables = new_total_disbursed - new_total_repaid
-    
-    update_data = {
-        "total_deposits": new_total_deposits,
-        "total_disbursed": new_total_disbursed,
-        "total_repaid": new_total_repaid,
-        "available_balance": new_available_balance,
-        "total_receivables": new_total_receivables,
-        "last_updated": datetime.utcnow(),
-        "updated_by": updated_by
-    }
-    
-    db.fund_pool.update_one(
-        {"id": "fund_pool"},
-        {"$set": update_data},
+    """Update fund pool balances on a randomly chosen stripe"""
+    db.fund_pool_stripes.update_one(
+        {"stripe": random.randrange(FUND_POOL_STRIPES)},
+        fund_pool_stripe_update(deposit_amount, disbursement_amount, repayment_amount, updated_by),
         upsert=True
     )
+    publish_fund_pool()
+
+def set_fund_pool_totals(totals: dict, updated_by: str = None):
+    """Bring the fund pool to ``totals``, gathered on stripe 0.
+
+    Every write is an $inc, so money movements that land meanwhile are kept.
+    Each other stripe is emptied into stripe 0 only while it still holds what
+    was read; one that changed stays as it is and is counted as read. Stripe 0
+    then takes the difference between ``totals`` and what the stripes held.
+    """
+    moved = {}
+    
+    def write(session):
+        moved.clear()
+        stamp = {"last_updated": datetime.utcnow(), "updated_by": updated_by}
+        stripes = load_fund_pool_stripes(session)
+        correction = {field: totals[field] - sum(stripe.get(field, 0.0) for stripe in stripes) for field in FUND_POOL_TOTALS}
+        for stripe in stripes:
+            read = {field: stripe[field] for field in FUND_POOL_TOTALS if field in stripe}
+            held = {field: amount for field, amount in read.items() if amount}
+            if stripe["stripe"] == 0 or not held:
+                continue
+            emptied = db.fund_pool_stripes.update_one(
+                {"stripe": stripe["stripe"], **read},
+                {"$inc": {field: -amount for field, amount in held.items()}, "$set": stamp},
+                session=session
+            )
+            if emptied.modified_count:
+                for field, amount in held.items():
+                    moved[field] = moved.get(field, 0.0) + amount
+        db.fund_pool_stripes.update_one(
+            {"stripe": 0},
+            {"$inc": {field: correction[field] + moved.get(field, 0.0) for field in FUND_POOL_TOTALS}, "$set": stamp},
+            upsert=True,
+            session=session
+        )
     
-    return get_fund_pool()
+    def rollback():
+        # Give back what was emptied out of the other stripes
+        if moved:
+            db.fund_pool_stripes.update_one({"stripe": 0}, {"$inc": moved}, upsert=True)
+    
+    run_in_transaction(write, rollback)
+
+def reserve_funds(amount: float, updated_by: str, session=None) -> List[tuple]:
+    """Take ``amount`` out of the available balance, stripe by stripe.
+
+    Each take is conditional on its stripe still holding that much, so
+    concurrent reservations can't overdraw the pool. The takes planned from
+    one read of the stripes go out in a single bulk_write. The reserved amount
+    is counted as disbursed straight away. Returns (stripe, amount) pairs to
+    pass to release_funds if the disbursement fails; raises a 400 when the
+    pool can't cover the amount.
+    """
+    reserved = []
+    remaining = amount
+    progressed = True
+    while remaining > 0.005 and progressed:
+        progressed = False
+        # Fullest stripes first, so most reservations touch a single stripe
+        takes = []
+        planned = remaining
+        for stripe in db.fund_pool_stripes.find(
+            {"available_balance": {"$gt": 0}}, {"_id": 0, "stripe": 1, "available_balance": 1}, session=session
+        ).sort("available_balance", DESCENDING):
+            take = min(planned, stripe["available_balance"])
+            takes.append((stripe["stripe"], take))
+            planned -= take
+            if planned <= 0.005:
+                break
+        if not takes:
+            break
+        
+        # A take whose stripe no longer holds enough matches nothing, and its
+        # upsert then hits the unique stripe index, so the error names it
+        lost = set()
+        try:
+            db.fund_pool_stripes.bulk_write([
+                UpdateOne(
+                    {"stripe": stripe, "available_balance": {"$gte": take}},
+                    fund_pool_stripe_update(disbursement_amount=take, updated_by=updated_by),
+                    upsert=True
+                )
+                for stripe, take in takes
+            ], ordered=False, session=session)
+        except BulkWriteError as exc:
+            lost = {error["index"] for error in exc.details.get("writeErrors", [])}
+            if any(error.get("code") != 11000 for error in exc.details.get("writeErrors", [])):
+                release_funds(reserved + [take for index, take in enumerate(takes) if index not in lost], updated_by, session)
+                raise
+        for index, take in enumerate(takes):
+            if index not in lost:
+                reserved.append(take)
+                remaining -= take[1]
+        # A take only misses when another write moved that stripe, so read again
+        progressed = True
+    
+    if remaining > 0.005:
+        release_funds(reserved, updated_by, session)
+        available = get_fund_pool().available_balance
+        raise HTTPException(
+            status_code=400,
+            detail=f"Insufficient funds. Available: {available}, Required: {amount}"
+        )
+    return reserved
+
+def release_funds(reserved: List[tuple], updated_by: str, session=None):
+    """Return reserved amounts to the stripes they were taken from"""
+    operations = [
+        UpdateOne({"stripe": stripe}, fund_pool_stripe_update(disbursement_amount=-take, updated_by=updated_by))
+        for stripe, take in reserved
+    ]
+    if operations:
+        db.fund_pool_stripes.bulk_write(operations, ordered=False, session=session)
 
 def generate_payment_schedule(
     application_id: str,
@@ -451,7 +1832,8 @@ def generate_payment_schedule(
     user_id: str,
     principal_amount: float,
     duration_months: int,
-    interest_rate: float = 0.05  # 5% annual interest rate
+    interest_rate: float = 0.05,  # 5% annual interest rate
+    session=None
 ) -> List[PaymentSchedule]:
     """Generate payment schedule for a disbursed loan"""
     
@@ -462,7 +1844,7 @@ def generate_payment_schedule(
     else:
         monthly_payment = principal_amount / duration_months
     
-    payment_schedules = []
+    installments = []
     remaining_principal = principal_amount
     
     for month in range(1, duration_months + 1):
@@ -478,8 +1860,8 @@ def generate_payment_schedule(
         # Calculate due date (first payment due 30 days after disbursement)
         due_date = datetime.utcnow() + timedelta(days=30 * month)
         
-        schedule = {
-            "id": str(uuid.uuid4()),
+        installments.append({
+            "id": installment_id(disbursement_id, month) if SCHEDULE_LAYOUT == "embedded" else str(uuid.uuid4()),
             "application_id": application_id,
             "disbursement_id": disbursement_id,
             "user_id": user_id,
@@ -492,38 +1874,731 @@ def generate_payment_schedule(
             "paid_date": None,
             "paid_amount": None,
             "late_fee": 0.0
-        }
-        
-        payment_schedules.append(PaymentSchedule(**schedule))
+        })
         remaining_principal -= principal_amount_this_month
-        
-        # Insert into database
-        db.payment_schedules.insert_one(schedule)
-    
-    return payment_schedules
-
-def check_guarantor_acceptance(application_id: str) -> tuple[bool, str]:
-    """Check if all guarantors have accepted the application"""
-    guarantors = list(db.guarantors.find({"application_id": application_id}))
     
-    if not guarantors:
-        return True, "No guarantors required"
-    
-    pending_guarantors = [g for g in guarantors if g["status"] == "pending"]
-    declined_guarantors = [g for g in guarantors if g["status"] == "declined"]
+    if SCHEDULE_LAYOUT == "embedded":
+        db.loan_schedules.insert_one(with_id(embed_installments(installments)), session=session)
+    else:
+        db.payment_schedules.insert_many([with_id(dict(installment)) for installment in installments], session=session)
     
-    if declined_guarantors:
-        return False, f"Guarantor(s) declined: {', '.join([g['guarantor_name'] for g in declined_guarantors])}"
+    return [PaymentSchedule(**installment) for installment in installments]
+
+def installment_id(schedule_id: str, installment_number: int) -> str:
+    """Id of an embedded installment, derived from its loan schedule"""
+    return f"{schedule_id}:{installment_number}"
+
+def embed_installments(installments: List[dict]) -> dict:
+    """Build the loan_schedules document for one disbursement's installments.
+
+    Installment ids are only stored when they differ from the derived id,
+    i.e. for installments migrated from the per-installment layout.
+    """
+    installments = sorted(installments, key=lambda installment: installment["installment_number"])
+    first = installments[0]
+    schedule = {
+        "id": first["disbursement_id"],
+        "application_id": first["application_id"],
+        "disbursement_id": first["disbursement_id"],
+        "user_id": first["user_id"],
+        "open": any(installment["status"] != PaymentStatus.PAID.value for installment in installments),
+        "installments": [
+            {
+                **({"id": installment["id"]}
+                   if installment["id"] != installment_id(first["disbursement_id"], installment["installment_number"])
+                   else {}),
+                **{field: installment.get(field) for field in EMBEDDED_INSTALLMENT_FIELDS}
+            }
+            for installment in installments
+        ]
+    }
+    if "archived_at" in first:
+        schedule["archived_at"] = first["archived_at"]
+    return schedule
+
+def embedded_installments(schedule: dict) -> List[dict]:
+    """Expand a loan_schedules document into per-installment documents"""
+    return [
+        {
+            "id": installment.get("id") or installment_id(schedule["id"], installment["installment_number"]),
+            "application_id": schedule["application_id"],
+            "disbursement_id": schedule["disbursement_id"],
+            "user_id": schedule["user_id"],
+            **{field: installment.get(field) for field in EMBEDDED_INSTALLMENT_FIELDS},
+            "loan_schedule_id": schedule["id"],
+            "position": position
+        }
+        for position, installment in enumerate(schedule["installments"])
+    ]
+
+def schedule_collection() -> str:
+    """Collection holding payment schedules in the configured layout"""
+    return SCHEDULE_COLLECTIONS[SCHEDULE_LAYOUT]
+
+def aggregate_installments(pipeline: list, include_archived: bool = False):
+    """Run ``pipeline`` over per-installment documents in either layout"""
+    name = schedule_collection()
+    stages = [archive_union(name)] if include_archived else []
+    if SCHEDULE_LAYOUT == "embedded":
+        stages += [
+            {"$unwind": "$installments"},
+            {"$project": {
+                "_id": 0, "application_id": 1, "disbursement_id": 1, "user_id": 1,
+                **{field: f"$installments.{field}" for field in EMBEDDED_INSTALLMENT_FIELDS}
+            }}
+        ]
+    return db[name].aggregate(stages + pipeline)
+
+def find_installments(query: dict, include_archived: bool = False) -> List[dict]:
+    """Installments of the schedules matching ``query``, by due date.
+
+    ``query`` may only use schedule-level fields (application_id, user_id, ...).
+    """
+    if SCHEDULE_LAYOUT == "embedded":
+        schedules = find_with_archive("loan_schedules", query, {"_id": 0}, include_archived=include_archived)
+        installments = [installment for schedule in schedules for installment in embedded_installments(schedule)]
+        return sorted(installments, key=lambda installment: (installment["due_date"], installment["installment_number"]))
+    return find_with_archive(
+        "payment_schedules", query, {"_id": 0}, sort=[("due_date", 1)], include_archived=include_archived
+    )
+
+def find_outstanding_installments(user_ids: List[str], session=None) -> List[dict]:
+    """Unpaid installments of the given members, oldest due first"""
+    if SCHEDULE_LAYOUT == "embedded":
+        installments = [
+            installment
+            for schedule in db.loan_schedules.find({"user_id": {"$in": user_ids}, "open": True}, {"_id": 0}, session=session)
+            for installment in embedded_installments(schedule)
+        ]
+        return sorted(installments, key=lambda installment: (installment["due_date"], installment["installment_number"]))
+    return list(db.payment_schedules.find(
+        {"user_id": {"$in": user_ids}, "status": {"$in": OUTSTANDING_PAYMENT_STATUSES}},
+        {"_id": 0, "id": 1, "application_id": 1, "user_id": 1, "installment_number": 1,
+         "amount": 1, "principal_amount": 1, "late_fee": 1, "paid_amount": 1, "paid_date": 1, "status": 1,
+         "due_date": 1},
+        session=session
+    ).sort([("due_date", ASCENDING), ("installment_number", ASCENDING)]))
+
+class PostingConflict(Exception):
+    """Installments or references changed between reading and writing a posting"""
+
+def installment_payment_updates(installments: List[dict], expected: dict, values: dict, open_by_schedule: dict) -> list:
+    """Writes setting installments' fields to ``values`` while they still hold ``expected``.
+
+    Both are keyed by installment id. In the embedded layout there is one
+    write per loan, which also sets its ``open`` flag.
+    """
+    if SCHEDULE_LAYOUT != "embedded":
+        return [
+            UpdateOne({**by_id(installment["id"]), **expected[installment["id"]]}, {"$set": values[installment["id"]]})
+            for installment in installments
+        ]
+    
+    filters = {}
+    changes = {}
+    for installment in installments:
+        prefix = f"installments.{installment['position']}"
+        schedule_id = installment["loan_schedule_id"]
+        filters.setdefault(schedule_id, by_id(schedule_id)).update({
+            f"{prefix}.{field}": value for field, value in expected[installment["id"]].items()
+        })
+        changes.setdefault(schedule_id, {}).update({
+            f"{prefix}.{field}": value for field, value in values[installment["id"]].items()
+        })
+    return [
+        UpdateOne(filters[schedule_id], {"$set": {**fields, "open": open_by_schedule[schedule_id]}})
+        for schedule_id, fields in changes.items()
+    ]
+
+def save_installment_payments(touched: List[dict], loaded: List[dict], originals: dict, attempt: str, session=None) -> int:
+    """Write paid amounts, dates and statuses of ``touched`` installments.
+
+    ``originals`` holds their payment fields as loaded; an installment whose
+    paid amount or status changed since raises PostingConflict. Each write is
+    stamped with ``attempt`` so restore_installment_payments undoes only its
+    own. In the embedded layout each installment is updated in place in its
+    loan's array, and the loan is closed once every loaded installment is paid.
+    """
+    open_by_schedule = {}
+    if SCHEDULE_LAYOUT == "embedded":
+        touched_schedules = {installment["loan_schedule_id"] for installment in touched}
+        for installment in loaded:
+            if installment["loan_schedule_id"] in touched_schedules:
+                open_by_schedule[installment["loan_schedule_id"]] = (
+                    open_by_schedule.get(installment["loan_schedule_id"], False)
+                    or installment["status"] != PaymentStatus.PAID.value
+                )
+    expected = {
+        installment["id"]: {field: originals[installment["id"]][field] for field in PAYMENT_CHECK_FIELDS}
+        for installment in touched
+    }
+    values = {
+        installment["id"]: {**{field: installment[field] for field in PAYMENT_FIELDS}, "payment_attempt": attempt}
+        for installment in touched
+    }
+    updates = installment_payment_updates(touched, expected, values, open_by_schedule)
+    if updates:
+        result = db[schedule_collection()].bulk_write(updates, ordered=False, session=session)
+        if result.modified_count < len(updates):
+            raise PostingConflict()
+    return len(touched)
+
+def restore_installment_payments(touched: List[dict], originals: dict, attempt: str):
+    """Undo the writes save_installment_payments made for ``attempt``"""
+    expected = {installment["id"]: {"payment_attempt": attempt} for installment in touched}
+    values = {installment["id"]: {**originals[installment["id"]], "payment_attempt": None} for installment in touched}
+    # Loans are only loaded while open
+    updates = installment_payment_updates(
+        touched, expected, values, {installment.get("loan_schedule_id"): True for installment in touched}
+    )
+    if updates:
+        db[schedule_collection()].bulk_write(updates, ordered=False)
+
+def check_guarantor_acceptance(application_id: str) -> tuple[bool, str]:
+    """Check if all guarantors have accepted the application"""
+    guarantors = list(db.guarantors.find({"application_id": application_id}))
+    return summarize_guarantor_acceptance(guarantors)
+
+def check_guarantor_acceptance_bulk(application_ids: List[str]) -> dict:
+    """Guarantor acceptance for many applications with one query"""
+    guarantors_by_application = {application_id: [] for application_id in application_ids}
+    for guarantor in db.guarantors.find({"application_id": {"$in": list(application_ids)}}):
+        guarantors_by_application[guarantor["application_id"]].append(guarantor)
+    return {
+        application_id: summarize_guarantor_acceptance(guarantors)
+        for application_id, guarantors in guarantors_by_application.items()
+    }
+
+def summarize_guarantor_acceptance(guarantors: List[dict]) -> tuple[bool, str]:
+    if not guarantors:
+        return True, "No guarantors required"
+    
+    pending_guarantors = [g for g in guarantors if g["status"] == "pending"]
+    declined_guarantors = [g for g in guarantors if g["status"] == "declined"]
+    
+    if declined_guarantors:
+        return False, f"Guarantor(s) declined: {', '.join([g['guarantor_name'] for g in declined_guarantors])}"
     
     if pending_guarantors:
         return False, f"Waiting for acceptance from: {', '.join([g['guarantor_name'] for g in pending_guarantors])}"
     
     return True, "All guarantors accepted"
 
+OUTSTANDING_PAYMENT_STATUSES = [
+    PaymentStatus.SCHEDULED.value,
+    PaymentStatus.PENDING.value,
+    PaymentStatus.OVERDUE.value,
+    PaymentStatus.PARTIAL.value
+]
+
+def allocate_repayment(schedules: List[dict], amount: float, paid_date: datetime) -> tuple[List[dict], float]:
+    """Allocate a payment across outstanding installments, oldest first.
+
+    Schedules must already be sorted by due date. They are updated in place so
+    later payments for the same member in a batch see the new balances.
+    Returns the allocations made and the amount left unallocated.
+    """
+    allocations = []
+    remaining = round(amount, 2)
+    
+    for schedule in schedules:
+        if remaining <= 0:
+            break
+        if schedule["status"] == PaymentStatus.PAID.value:
+            continue
+        
+        amount_due = round(schedule["amount"] + (schedule.get("late_fee") or 0.0), 2)
+        already_paid = schedule.get("paid_amount") or 0.0
+        outstanding = round(amount_due - already_paid, 2)
+        if outstanding <= 0:
+            continue
+        
+        applied = min(remaining, outstanding)
+        # Principal share of the installment amount covered by this payment
+        principal_share = schedule["principal_amount"] * (
+            min(already_paid + applied, schedule["amount"]) - min(already_paid, schedule["amount"])
+        ) / schedule["amount"]
+        schedule["paid_amount"] = round(already_paid + applied, 2)
+        schedule["paid_date"] = paid_date
+        schedule["status"] = PaymentStatus.PAID.value if applied >= outstanding else PaymentStatus.PARTIAL.value
+        remaining = round(remaining - applied, 2)
+        
+        allocations.append({
+            "schedule_id": schedule["id"],
+            "application_id": schedule["application_id"],
+            "installment_number": schedule["installment_number"],
+            "amount": round(applied, 2),
+            "principal_amount": round(principal_share, 2),
+            "status": schedule["status"]
+        })
+    
+    return allocations, remaining
+
+def plan_repayments(payments: List[dict], posted_by: str, source: str, now: datetime, session=None) -> dict:
+    """Read the members' outstanding installments and allocate ``payments`` in memory"""
+    # Skip references that were already posted or repeat within the batch
+    references = [p["reference"] for p in payments if p.get("reference")]
+    seen_references = set()
+    if references:
+        seen_references = {
+            posting["reference"] for posting in db.repayment_postings.find(
+                # The $type condition lets the partial reference index serve the lookup
+                {"reference": {"$in": references, "$type": "string"}}, {"_id": 0, "reference": 1}, session=session
+            )
+        }
+    
+    accepted_payments = []
+    duplicates = []
+    for payment in payments:
+        reference = payment.get("reference")
+        if reference and reference in seen_references:
+            duplicates.append({"line": payment.get("line"), "reference": reference})
+            continue
+        if reference:
+            seen_references.add(reference)
+        accepted_payments.append(payment)
+    
+    # Outstanding installments for every member in the batch, oldest first
+    user_ids = list({p["user_id"] for p in accepted_payments})
+    schedules_by_user = {}
+    schedules_by_id = {}
+    if user_ids:
+        for schedule in find_outstanding_installments(user_ids, session):
+            schedules_by_user.setdefault(schedule["user_id"], []).append(schedule)
+            schedules_by_id[schedule["id"]] = schedule
+    # Payment fields as loaded, which the writes are conditional on
+    originals = {
+        schedule_id: {field: schedule.get(field) for field in PAYMENT_FIELDS}
+        for schedule_id, schedule in schedules_by_id.items()
+    }
+    
+    touched_schedules = {}
+    principal_repaid_by_user = {}
+    posting_docs = []
+    total_allocated = 0.0
+    total_unallocated = 0.0
+    
+    for payment in accepted_payments:
+        member_schedules = schedules_by_user.get(payment["user_id"], [])
+        if payment.get("application_id"):
+            member_schedules = [s for s in member_schedules if s["application_id"] == payment["application_id"]]
+        
+        paid_date = payment.get("paid_date") or now
+        allocations, unallocated = allocate_repayment(member_schedules, payment["amount"], paid_date)
+        for allocation in allocations:
+            touched_schedules[allocation["schedule_id"]] = schedules_by_id[allocation["schedule_id"]]
+            principal_repaid_by_user[payment["user_id"]] = (
+                principal_repaid_by_user.get(payment["user_id"], 0.0) + allocation["principal_amount"]
+            )
+        
+        allocated = round(payment["amount"] - unallocated, 2)
+        total_allocated += allocated
+        total_unallocated += unallocated
+        
+        posting_docs.append({
+            "id": str(uuid.uuid4()),
+            "user_id": payment["user_id"],
+            "amount": payment["amount"],
+            "allocated_amount": allocated,
+            "unallocated_amount": unallocated,
+            "application_id": payment.get("application_id"),
+            "reference": payment.get("reference"),
+            "paid_date": paid_date,
+            "source": source,
+            "posted_by": posted_by,
+            "created_at": now,
+            "allocations": allocations,
+            "line": payment.get("line")
+        })
+    
+    return {
+        "postings": posting_docs,
+        "duplicates": duplicates,
+        "touched": list(touched_schedules.values()),
+        "loaded": list(schedules_by_id.values()),
+        "originals": originals,
+        "principal_repaid_by_user": principal_repaid_by_user,
+        "total_allocated": round(total_allocated, 2),
+        "total_unallocated": round(total_unallocated, 2)
+    }
+
+def repayment_chunks(payments: List[dict], size: int) -> List[List[dict]]:
+    """Split payments into chunks of about ``size``, keeping each member's payments together and in order"""
+    by_user = {}
+    for payment in payments:
+        by_user.setdefault(payment["user_id"], []).append(payment)
+    
+    chunks = [[]]
+    for member_payments in by_user.values():
+        if chunks[-1] and len(chunks[-1]) + len(member_payments) > size:
+            chunks.append([])
+        chunks[-1].extend(member_payments)
+    return [chunk for chunk in chunks if chunk]
+
+def write_repayments(payments: List[dict], posted_by: str, source: str, now: datetime) -> dict:
+    """Plan and write postings and installment payments in one transaction.
+
+    Writes are conditional on the balances that were read, and the unique
+    reference index stops concurrent imports of the same line. When either
+    check fails, the payments are read and allocated again, up to
+    REPAYMENT_POSTING_ATTEMPTS times, before PostingConflict is raised.
+    """
+    # What the last attempt wrote, for undoing it without a transaction
+    written = {}
+    
+    def write(session) -> dict:
+        written.clear()
+        attempt = str(uuid.uuid4())
+        plan = plan_repayments(payments, posted_by, source, now, session)
+        if plan["postings"]:
+            written["postings"] = [posting["id"] for posting in plan["postings"]]
+            try:
+                db.repayment_postings.insert_many(
+                    [with_id(dict(posting)) for posting in plan["postings"]], ordered=False, session=session
+                )
+            except BulkWriteError as exc:
+                if any(error.get("code") == 11000 for error in exc.details.get("writeErrors", [])):
+                    # Another import posted one of the references first
+                    raise PostingConflict()
+                raise
+        written["installments"] = (plan["touched"], plan["originals"], attempt)
+        plan["schedules_updated"] = save_installment_payments(
+            plan["touched"], plan["loaded"], plan["originals"], attempt, session
+        )
+        return plan
+    
+    def rollback():
+        if written.get("installments"):
+            restore_installment_payments(*written["installments"])
+        if written.get("postings"):
+            db.repayment_postings.delete_many(by_id({"$in": written["postings"]}))
+    
+    for _ in range(REPAYMENT_POSTING_ATTEMPTS):
+        try:
+            return run_in_transaction(write, rollback)
+        except PostingConflict:
+            continue
+    raise PostingConflict()
+
+def record_repayment_effects(plan: dict, posted_by: str):
+    """Rollups, fund pool, member stats, guarantor releases and versions for written postings"""
+    posting_docs = plan["postings"]
+    touched_schedules = plan["touched"]
+    if posting_docs:
+        countries = user_countries({posting["user_id"] for posting in posting_docs})
+        record_rollups([
+            (RollupMetric.REPAYMENTS.value, posting["paid_date"], countries.get(posting["user_id"]), posting["allocated_amount"])
+            for posting in posting_docs if posting["allocated_amount"] > 0
+        ])
+    
+    if plan["total_allocated"] > 0:
+        update_fund_pool(repayment_amount=plan["total_allocated"], updated_by=posted_by)
+    
+    increment_member_stats_bulk({
+        user_id: {"outstanding_principal": -round(principal, 2)}
+        for user_id, principal in plan["principal_repaid_by_user"].items() if principal > 0
+    })
+    
+    # Loans repaid in full release their guarantors
+    released_guarantor_ids = []
+    if touched_schedules:
+        repaid = repaid_application_ids(list({s["application_id"] for s in touched_schedules}))
+        if repaid:
+            released_guarantor_ids = release_guarantee_exposure(repaid)
+    
+    if posting_docs:
+        bump_versions(
+            *[user_version(posting["user_id"]) for posting in posting_docs],
+            *[user_version(guarantor_user_id) for guarantor_user_id in released_guarantor_ids],
+            "data",
+            "portfolio"
+        )
+
+def post_repayments(payments: List[dict], posted_by: str, source: str) -> dict:
+    """Post a batch of repayments.
+
+    Payments are written in chunks of about REPAYMENT_CHUNK_SIZE, each in its
+    own transaction. A chunk loads its members' outstanding installments with
+    a single query, allocates in memory and writes the touched schedules with
+    one bulk_write. When a chunk keeps conflicting with other postings, its
+    members are retried one by one, and only the payments of members that
+    still conflict are reported in ``conflicts``.
+    """
+    now = datetime.utcnow()
+    result = {
+        "postings": [], "duplicates": [], "conflicts": [],
+        "schedules_updated": 0, "total_allocated": 0.0, "total_unallocated": 0.0
+    }
+    
+    for chunk in repayment_chunks(payments, REPAYMENT_CHUNK_SIZE):
+        try:
+            plans = [write_repayments(chunk, posted_by, source, now)]
+        except PostingConflict:
+            # One contended loan shouldn't hold back the rest of the chunk
+            plans = []
+            for member_payments in repayment_chunks(chunk, 1):
+                try:
+                    plans.append(write_repayments(member_payments, posted_by, source, now))
+                except PostingConflict:
+                    result["conflicts"].extend(
+                        {"line": payment.get("line"), "user_id": payment["user_id"], "amount": payment["amount"]}
+                        for payment in member_payments
+                    )
+        
+        for plan in plans:
+            record_repayment_effects(plan, posted_by)
+            result["postings"].extend(plan["postings"])
+            result["duplicates"].extend(plan["duplicates"])
+            result["schedules_updated"] += plan["schedules_updated"]
+            result["total_allocated"] += plan["total_allocated"]
+            result["total_unallocated"] += plan["total_unallocated"]
+    
+    result["total_allocated"] = round(result["total_allocated"], 2)
+    result["total_unallocated"] = round(result["total_unallocated"], 2)
+    return result
+
+def parse_repayment_statement(content: bytes, filename: str) -> tuple[List[dict], List[dict]]:
+    """Parse a CSV or NDJSON bank statement into repayment rows.
+
+    Each row needs an amount and either a user_id or an email; application_id,
+    reference and paid_date are optional. Returns (rows, errors).
+    """
+    text = content.decode("utf-8-sig")
+    filename = (filename or "").lower()
+    is_ndjson = filename.endswith((".ndjson", ".jsonl", ".json")) or (
+        not filename.endswith(".csv") and text.lstrip().startswith("{")
+    )
+    
+    if is_ndjson:
+        raw_rows = []
+        for line_number, line in enumerate(text.splitlines(), start=1):
+            if not line.strip():
+                continue
+            try:
+                raw_rows.append((line_number, json.loads(line)))
+            except ValueError:
+                raw_rows.append((line_number, None))
+    else:
+        # Line 1 is the header row
+        raw_rows = list(enumerate(csv.DictReader(io.StringIO(text)), start=2))
+    
+    rows = []
+    errors = []
+    for line_number, raw in raw_rows:
+        if not isinstance(raw, dict):
+            errors.append({"line": line_number, "error": "Malformed line"})
+            continue
+        
+        user_id = (raw.get("user_id") or "").strip() or None
+        email = (raw.get("email") or "").strip() or None
+        if not user_id and not email:
+            errors.append({"line": line_number, "error": "Missing user_id or email"})
+            continue
+        
+        try:
+            amount = round(float(raw.get("amount")), 2)
+        except (TypeError, ValueError):
+            errors.append({"line": line_number, "error": "Invalid amount"})
+            continue
+        if amount <= 0:
+            errors.append({"line": line_number, "error": "Amount must be positive"})
+            continue
+        
+        paid_date = None
+        if raw.get("paid_date"):
+            try:
+                paid_date = datetime.fromisoformat(str(raw["paid_date"]).strip())
+            except ValueError:
+                errors.append({"line": line_number, "error": "Invalid paid_date"})
+                continue
+        
+        rows.append({
+            "line": line_number,
+            "user_id": user_id,
+            "email": email,
+            "amount": amount,
+            "application_id": (raw.get("application_id") or "").strip() or None,
+            "reference": str(raw.get("reference") or "").strip() or None,
+            "paid_date": paid_date
+        })
+    
+    return rows, errors
+
+def application_event(event_type: str, application: dict, **data) -> dict:
+    """Event about an application, visible to its applicant and to reviewers"""
+    applicant = get_user(db, application["user_id"], USER_COUNTRY)
+    return {
+        "type": event_type,
+        "data": {
+            "application_id": application["id"],
+            "user_id": application["user_id"],
+            "amount": application["amount"],
+            "status": application["status"],
+            **data
+        },
+        "user_ids": [application["user_id"]],
+        "roles": REVIEWER_ROLES,
+        "country": applicant["country"] if applicant else None
+    }
+
+def approval_event(history: dict, application: dict) -> dict:
+    return application_event(
+        "approval_action",
+        {**application, "status": history["new_status"]},
+        action=history["action"],
+        previous_status=history["previous_status"],
+        approver_name=history["approver_name"]
+    )
+
+def guarantor_event(guarantor: dict, application: dict) -> dict:
+    event = application_event(
+        "guarantor_response",
+        application,
+        guarantor_id=guarantor["id"],
+        guarantor_name=guarantor["guarantor_name"],
+        guarantor_status=guarantor["status"]
+    )
+    event["user_ids"].append(guarantor["guarantor_user_id"])
+    return event
+
+def disbursement_event(disbursement: dict) -> dict:
+    return {
+        "type": "disbursement",
+        "data": {
+            "application_id": disbursement["application_id"],
+            "user_id": disbursement["user_id"],
+            "amount": disbursement["disbursed_amount"],
+            "reference_number": disbursement.get("reference_number")
+        },
+        "user_ids": [disbursement["user_id"]],
+        "roles": FUND_MANAGER_ROLES
+    }
+
+def fund_pool_event(fund_pool: dict) -> dict:
+    return {
+        "type": "fund_pool_updated",
+        "data": {
+            key: fund_pool.get(key)
+            for key in ["total_deposits", "total_disbursed", "total_repaid", "available_balance", "total_receivables"]
+        },
+        "user_ids": [],
+        "roles": FUND_MANAGER_ROLES
+    }
+
+def fund_pool_totals_event() -> dict:
+    return fund_pool_event(get_fund_pool().model_dump())
+
+def job_event(job: dict) -> dict:
+    return {
+        "type": "job_updated",
+        "data": {key: job.get(key) for key in ["id", "type", "status", "progress", "error"]},
+        "user_ids": [job["submitted_by"]] if job.get("submitted_by") else [],
+        "roles": FUND_MANAGER_ROLES
+    }
+
+def emit_event(build_event, *args):
+    """Publish an event from a write path.
+
+    Skipped when change streams already deliver it or nobody is listening, so
+    the builder's lookups only run when needed.
+    """
+    if change_stream_state["enabled"] or not event_bus.has_subscribers():
+        return
+    event_bus.publish(build_event(*args))
+
+def event_visible_to(event: dict, user: dict) -> bool:
+    """Role and country filtering for streamed events"""
+    if event["type"] == "resync" or user["id"] in event.get("user_ids", []):
+        return True
+    if user["role"] not in event.get("roles", []):
+        return False
+    if user["role"] == UserRole.COUNTRY_COORDINATOR.value:
+        return event.get("country") == user["country"]
+    return True
+
+def change_to_event(change: dict) -> Optional[dict]:
+    """Translate a change stream document into a stream event"""
+    collection = change["ns"]["coll"]
+    operation = change["operationType"]
+    document = change.get("fullDocument")
+    if not document:
+        return None
+    
+    if collection == "finance_applications" and operation == "insert":
+        return application_event("application_created", document)
+    if collection == "approval_history" and operation == "insert":
+        application = get_application(db, document["application_id"], {"_id": 0})
+        return approval_event(document, application) if application else None
+    if collection == "guarantors" and operation == "update" and \
+       "status" in change["updateDescription"]["updatedFields"]:
+        application = get_application(db, document["application_id"], {"_id": 0})
+        return guarantor_event(document, application) if application else None
+    if collection == "disbursements" and operation == "insert":
+        return disbursement_event(document)
+    if collection == "fund_pool_stripes":
+        return fund_pool_totals_event()
+    if collection == "jobs":
+        return job_event(document)
+    return None
+
+def change_stream_pipeline() -> list:
+    return [{"$match": {
+        "ns.coll": {"$in": WATCHED_COLLECTIONS},
+        "operationType": {"$in": ["insert", "update", "replace"]}
+    }}]
+
+def run_change_stream(stream):
+    """Forward change stream events to the bus, resuming after transient errors"""
+    while not change_stream_state["stopping"]:
+        try:
+            for change in stream:
+                # Building events takes lookups, so skip them while nobody listens
+                if not event_bus.has_subscribers():
+                    continue
+                try:
+                    event = change_to_event(change)
+                except PyMongoError as exc:
+                    print(f"⚠️ Could not build event from change: {exc}")
+                    continue
+                if event:
+                    event_bus.publish(event)
+            return
+        except PyMongoError as exc:
+            if change_stream_state["stopping"]:
+                return
+            print(f"⚠️ Change stream interrupted, resuming: {exc}")
+            time.sleep(1)
+            stream = db.watch(
+                change_stream_pipeline(),
+                full_document="updateLookup",
+                resume_after=stream.resume_token
+            )
+            change_stream_state["stream"] = stream
+
+def start_change_stream_watcher():
+    """Use Mongo change streams for live events when the deployment supports them"""
+    try:
+        stream = db.watch(change_stream_pipeline(), full_document="updateLookup")
+    except OperationFailure:
+        # Standalone mongod: write paths publish to the in-process bus instead
+        print("ℹ️ Change streams unavailable, using in-process event bus")
+        return
+    
+    change_stream_state.update({"enabled": True, "stopping": False, "stream": stream})
+    threading.Thread(target=run_change_stream, args=(stream,), daemon=True).start()
+    print("✅ Live events use Mongo change streams")
+
+def stop_change_stream_watcher():
+    change_stream_state["stopping"] = True
+    change_stream_state["enabled"] = False
+    if change_stream_state["stream"] is not None:
+        change_stream_state["stream"].close()
+        change_stream_state["stream"] = None
+
 def create_admin_user():
     """Create default admin user if not exists"""
     admin_email = "admin@fundmanager.com"
-    admin_user = db.users.find_one({"email": admin_email})
+    admin_user = get_user_by_email(db, admin_email)
     
     if not admin_user:
         admin_id = str(uuid.uuid4())
@@ -542,7 +2617,8 @@ def create_admin_user():
             "is_active": True
         }
         
-        db.users.insert_one(admin_doc)
+        db.users.insert_one(with_id(admin_doc))
+        index_search_documents([user_search_document(admin_doc)])
         print(f"✅ Admin user created:")
         print(f"   Email: {admin_email}")
         print(f"   Password: {admin_password}")
@@ -582,18 +2658,436 @@ def migrate_existing_applications():
         
         if update_data:
             db.finance_applications.update_one(
-                {"id": app["id"]},
+                by_id(app["id"]),
                 {"$set": update_data}
             )
     
     print("✅ Migration completed for finance applications")
 
-# Create admin user and system config on startup
-create_admin_user()
-migrate_existing_applications()
+def ensure_indexes():
+    """Create indexes used by the hot query paths"""
+    db.users.create_index([("email", ASCENDING)])
+    db.users.create_index([("country", ASCENDING), ("role", ASCENDING)])
+    db.users.create_index([("role", ASCENDING), ("is_active", ASCENDING)])
+    db.users.create_index([("created_at", DESCENDING)])
+    db.deposits.create_index([("user_id", ASCENDING), ("created_at", DESCENDING)])
+    db.deposits.create_index([("created_at", DESCENDING)])
+    db.finance_applications.create_index([("user_id", ASCENDING), ("created_at", DESCENDING)])
+    db.finance_applications.create_index([("status", ASCENDING), ("priority_score", DESCENDING), ("created_at", ASCENDING)])
+    db.finance_applications.create_index([("priority_score", DESCENDING), ("created_at", ASCENDING)])
+    db.payment_schedules.create_index([("user_id", ASCENDING), ("status", ASCENDING), ("due_date", ASCENDING)])
+    ensure_repayment_reference_index()
+    db.repayment_postings.create_index([("user_id", ASCENDING), ("created_at", ASCENDING)])
+    db.member_stats.create_index([("user_id", ASCENDING)], unique=True)
+    db.member_stats.create_index([("guarantee_capacity", DESCENDING)])
+    db.finance_applications.create_index([("change_seq", ASCENDING)], sparse=True)
+    db.counters.create_index([("id", ASCENDING)], unique=True)
+    db.change_claims.create_index([("floor", ASCENDING)])
+    db.change_claims.create_index([("created_at", ASCENDING)], expireAfterSeconds=CHANGE_CLAIM_SECONDS)
+    db.fund_pool_stripes.create_index([("stripe", ASCENDING)], unique=True)
+    db.search_index.create_index([("kind", ASCENDING), ("ref_id", ASCENDING)], unique=True)
+    db.search_index.create_index([("tokens", ASCENDING), ("country", ASCENDING)])
+    db.guarantors.create_index([("application_id", ASCENDING)])
+    db.guarantors.create_index([("guarantor_user_id", ASCENDING), ("created_at", DESCENDING)])
+    db.guarantors.create_index([("created_at", DESCENDING)])
+    db.approval_history.create_index([("application_id", ASCENDING), ("created_at", ASCENDING)])
+    db.approval_history.create_index([("created_at", DESCENDING)])
+    db.payment_schedules.create_index([("application_id", ASCENDING)])
+    db.payment_schedules.create_index([("user_id", ASCENDING), ("due_date", ASCENDING)])
+    db.repayments.create_index([("user_id", ASCENDING), ("due_date", ASCENDING)])
+    db.finance_applications.create_index([("status", ASCENDING), ("updated_at", ASCENDING)])
+    db.daily_rollups.create_index([("metric", ASCENDING), ("day", ASCENDING), ("country", ASCENDING)], unique=True)
+    db.idempotency_keys.create_index([("id", ASCENDING)], unique=True)
+    db.idempotency_keys.create_index([("expires_at", ASCENDING)], expireAfterSeconds=0)
+    db.stream_tickets.create_index([("ticket_hash", ASCENDING)], unique=True)
+    db.stream_tickets.create_index([("expires_at", ASCENDING)], expireAfterSeconds=0)
+    job_runner.ensure_indexes()
+    db.daily_rollups.create_index([("country", ASCENDING), ("metric", ASCENDING), ("day", ASCENDING)])
+    db.archived_finance_applications.create_index([("user_id", ASCENDING), ("created_at", DESCENDING)])
+    db.archived_guarantors.create_index([("application_id", ASCENDING)])
+    db.archived_guarantors.create_index([("guarantor_user_id", ASCENDING), ("created_at", DESCENDING)])
+    db.archived_approval_history.create_index([("application_id", ASCENDING), ("created_at", ASCENDING)])
+    db.archived_approval_history.create_index([("created_at", DESCENDING)])
+    db.archived_payment_schedules.create_index([("application_id", ASCENDING)])
+    db.archived_payment_schedules.create_index([("user_id", ASCENDING), ("due_date", ASCENDING)])
+    db.loan_schedules.create_index([("application_id", ASCENDING)])
+    db.loan_schedules.create_index([("user_id", ASCENDING), ("open", ASCENDING)])
+    db.archived_loan_schedules.create_index([("application_id", ASCENDING)])
+    db.archived_loan_schedules.create_index([("user_id", ASCENDING)])
+    db.disbursements.create_index([("status", ASCENDING), ("disbursement_date", ASCENDING)])
+    ensure_disbursement_index()
+    db.disbursements.create_index([("disbursement_date", DESCENDING)])
+    db.report_cache.create_index([("id", ASCENDING)], unique=True)
+    db.report_cache.create_index([("created_at", ASCENDING)], expireAfterSeconds=7 * 24 * 3600)
+    ensure_id_indexes()
+
+def ensure_repayment_reference_index():
+    """Allow each bank reference to be posted once, replacing the sparse index of earlier deployments"""
+    index = db.repayment_postings.index_information().get("reference_1")
+    if index and not index.get("unique"):
+        db.repayment_postings.drop_index("reference_1")
+    try:
+        # Postings without a reference store null, so only string references are indexed
+        db.repayment_postings.create_index(
+            [("reference", ASCENDING)],
+            unique=True,
+            partialFilterExpression={"reference": {"$type": "string"}}
+        )
+    except OperationFailure as exc:
+        print(f"⚠️ Could not make repayment_postings.reference unique: {exc}")
+        db.repayment_postings.create_index([("reference", ASCENDING)], sparse=True)
+
+def ensure_disbursement_index():
+    """Allow one disbursement per application, replacing the plain index of earlier deployments"""
+    index = db.disbursements.index_information().get("application_id_1")
+    if index and not index.get("unique"):
+        db.disbursements.drop_index("application_id_1")
+    try:
+        db.disbursements.create_index([("application_id", ASCENDING)], unique=True)
+    except OperationFailure as exc:
+        # Applications disbursed twice before the index existed need cleaning up first
+        print(f"⚠️ Could not make disbursements.application_id unique: {exc}")
+        db.disbursements.create_index([("application_id", ASCENDING)])
+
+def ensure_id_indexes():
+    """Index uuid ids, or drop that index when the _id index serves id lookups"""
+    for name in ID_COLLECTIONS:
+        if repository.ID_STORAGE == "primary":
+            if "id_1" in db[name].index_information():
+                db[name].drop_index("id_1")
+        else:
+            db[name].create_index([("id", ASCENDING)], unique=True)
+
+def migrate_fund_pool_stripes():
+    """Create the fund pool stripes, moving in the single pool document of earlier deployments"""
+    legacy = db.fund_pool.find_one({"id": "fund_pool"}, {"_id": 0})
+    if legacy and db.fund_pool_stripes.estimated_document_count() == 0:
+        set_fund_pool_totals({field: legacy.get(field, 0.0) for field in FUND_POOL_TOTALS}, legacy.get("updated_by"))
+        print("✅ Fund pool moved to stripes")
+    if legacy:
+        db.fund_pool.delete_one({"id": "fund_pool"})
+    
+    # Pre-create the stripes so concurrent first writes don't race to insert them
+    db.fund_pool_stripes.bulk_write([
+        UpdateOne(
+            {"stripe": stripe},
+            {"$setOnInsert": {
+                **{field: 0.0 for field in FUND_POOL_TOTALS}, "last_updated": datetime.utcnow(), "updated_by": None
+            }},
+            upsert=True
+        )
+        for stripe in range(FUND_POOL_STRIPES)
+    ], ordered=False)
+
+def migrate_guarantee_exposure(batch_size: int = ARCHIVE_BATCH_SIZE) -> int:
+    """Record the exposure of guarantees that predate exposure tracking.
+
+    Returns the number of guarantees migrated.
+    """
+    migrated = 0
+    while True:
+        guarantees = list(db.guarantors.find(
+            {"exposure": {"$exists": False}},
+            {"_id": 1, "application_id": 1, "status": 1, "guaranteed_amount": 1}
+        ).limit(batch_size))
+        if not guarantees:
+            break
+        
+        applications = find_applications_by_ids(
+            [g["application_id"] for g in guarantees], {"_id": 0, "id": 1, "amount": 1, "status": 1}
+        )
+        disbursed_ids = [
+            application["id"] for application in applications.values()
+            if application["status"] == ApplicationStatus.DISBURSED.value
+        ]
+        disbursed_amounts = {
+            disbursement["application_id"]: disbursement["disbursed_amount"]
+            for disbursement in db.disbursements.find(
+                {"application_id": {"$in": disbursed_ids}}, {"_id": 0, "application_id": 1, "disbursed_amount": 1}
+            )
+        }
+        repaid = set(repaid_application_ids(disbursed_ids)) if disbursed_ids else set()
+        
+        operations = []
+        for g in guarantees:
+            application = applications.get(g["application_id"])
+            exposure = 0.0
+            if (g["status"] == GuarantorStatus.ACCEPTED.value and application
+                    and application["status"] != ApplicationStatus.REJECTED.value and application["id"] not in repaid):
+                share = disbursed_share(application, disbursed_amounts[application["id"]]) \
+                    if application["id"] in disbursed_amounts else 1.0
+                exposure = round(g["guaranteed_amount"] * share, 2)
+            operations.append(UpdateOne({"_id": g["_id"]}, {"$set": {"exposure": exposure}}))
+        db.guarantors.bulk_write(operations, ordered=False)
+        migrated += len(operations)
+    
+    if migrated:
+        print(f"✅ Recorded exposure for {migrated} guarantees")
+    return migrated
+
+def migrate_member_stats():
+    """Build member stats for deployments that predate them or guarantee capacity"""
+    if db.users.estimated_document_count() > 0 and (
+        db.member_stats.estimated_document_count() == 0
+        or db.member_stats.find_one({"guarantee_capacity": {"$exists": False}}, {"_id": 1})
+    ):
+        print("🔄 Building member stats...")
+        rebuilt = rebuild_member_stats()
+        print(f"✅ Member stats built for {rebuilt} users")
+
+def migrate_search_index():
+    """Build the search index for deployments that predate it"""
+    if db.search_index.count_documents({"kind": "user"}) < db.users.estimated_document_count():
+        print("🔄 Building search index...")
+        indexed = rebuild_search_index()
+        print(f"✅ Search index built for {indexed} records")
+
+def migrate_daily_rollups():
+    """Backfill daily rollups for deployments that predate them"""
+    if db.daily_rollups.estimated_document_count() == 0 and db.deposits.estimated_document_count() > 0:
+        print("🔄 Backfilling daily rollups...")
+        rebuilt = rebuild_daily_rollups()
+        print(f"✅ Daily rollups built: {rebuilt} rows")
+
+def migrate_schedule_layout(batch_size: int = ARCHIVE_BATCH_SIZE) -> int:
+    """Move payment schedules, hot and archived, into the configured layout.
+
+    Loans are converted a batch at a time. The new documents are written
+    before the old ones are deleted, so an interrupted run is finished by the
+    next one. Returns the number of loans moved.
+    """
+    moved = 0
+    for flat_name, embedded_name in [
+        ("payment_schedules", "loan_schedules"),
+        ("archived_payment_schedules", "archived_loan_schedules")
+    ]:
+        while SCHEDULE_LAYOUT == "embedded":
+            disbursement_ids = [
+                row["_id"] for row in db[flat_name].aggregate([
+                    {"$group": {"_id": "$disbursement_id"}},
+                    {"$limit": batch_size}
+                ])
+            ]
+            if not disbursement_ids:
+                break
+            installments_by_loan = {}
+            for installment in db[flat_name].find({"disbursement_id": {"$in": disbursement_ids}}, {"_id": 0}):
+                installments_by_loan.setdefault(installment["disbursement_id"], []).append(installment)
+            db[embedded_name].bulk_write([
+                ReplaceOne(by_id(disbursement_id), embed_installments(installments), upsert=True)
+                for disbursement_id, installments in installments_by_loan.items()
+            ], ordered=False)
+            db[flat_name].delete_many({"disbursement_id": {"$in": disbursement_ids}})
+            moved += len(disbursement_ids)
+        
+        while SCHEDULE_LAYOUT == "installments":
+            schedules = list(db[embedded_name].find({}, {"_id": 0}).limit(batch_size))
+            if not schedules:
+                break
+            db[flat_name].bulk_write([
+                ReplaceOne(
+                    by_id(installment["id"]),
+                    {
+                        **{key: value for key, value in installment.items() if key not in ["loan_schedule_id", "position"]},
+                        **({"archived_at": schedule["archived_at"]} if "archived_at" in schedule else {})
+                    },
+                    upsert=True
+                )
+                for schedule in schedules
+                for installment in embedded_installments(schedule)
+            ], ordered=False)
+            db[embedded_name].delete_many(by_id({"$in": [schedule["id"] for schedule in schedules]}))
+            moved += len(schedules)
+    
+    if moved:
+        print(f"✅ Moved {moved} payment schedules to the {SCHEDULE_LAYOUT} layout")
+    return moved
+
+# Unique indexes on ID_COLLECTIONS besides id: collection -> (index name, function creating it)
+UNIQUE_SECONDARY_INDEXES = {
+    "disbursements": ("application_id_1", ensure_disbursement_index),
+    "repayment_postings": ("reference_1", ensure_repayment_reference_index)
+}
+
+def migrate_id_storage(batch_size: int = ARCHIVE_BATCH_SIZE) -> int:
+    """Give documents created before primary id storage their uuid as _id.
+
+    An _id cannot change in place, so each document is copied under its new
+    _id before the original is deleted. Both steps are idempotent, so a run
+    that was interrupted anywhere is finished by the next one, including
+    recreating the unique indexes it dropped. Documents keep their `id` field,
+    which every projection and response model reads, so switching back to
+    "field" mode needs no migration. Returns the documents moved.
+    """
+    if repository.ID_STORAGE != "primary":
+        return 0
+    
+    # A copy and its original briefly share their unique secondary keys, so
+    # those indexes are dropped while documents move
+    for name, (index_name, _) in UNIQUE_SECONDARY_INDEXES.items():
+        if legacy_id_document(name) and index_name in db[name].index_information():
+            db[name].drop_index(index_name)
+    
+    moved = 0
+    for name in ID_COLLECTIONS:
+        while True:
+            documents = list(db[name].find({"_id": {"$type": "objectId"}}).limit(batch_size))
+            if not documents:
+                break
+            db[name].bulk_write([
+                ReplaceOne({"_id": document["id"]}, {**document, "_id": document["id"]}, upsert=True)
+                for document in documents
+            ], ordered=False)
+            db[name].delete_many({"_id": {"$in": [document["_id"] for document in documents]}})
+            moved += len(documents)
+    
+    # Also restores indexes dropped by an earlier run that didn't finish
+    for _, ensure_index in UNIQUE_SECONDARY_INDEXES.values():
+        ensure_index()
+    
+    if moved:
+        print(f"✅ Moved {moved} documents to uuid _ids")
+    return moved
+
+def legacy_id_document(name: str) -> Optional[dict]:
+    return db[name].find_one({"_id": {"$type": "objectId"}}, {"_id": 1})
+
+def require_id_storage_migrated():
+    """Refuse to serve with primary id storage until every document has moved.
+
+    Workers that skip the startup tasks would otherwise look up documents by
+    _id while some still carry an ObjectId there.
+    """
+    if repository.ID_STORAGE != "primary":
+        return
+    pending = [name for name in ID_COLLECTIONS if legacy_id_document(name)]
+    if pending:
+        raise RuntimeError(
+            f"ID_STORAGE=primary but {', '.join(pending)} still have ObjectId _ids; "
+            "start one instance with RUN_STARTUP_TASKS enabled to finish the migration"
+        )
+
+def run_startup_tasks():
+    """Create admin user, indexes, migrations and system config"""
+    create_admin_user()
+    ensure_indexes()
+    migrate_id_storage()
+    migrate_schedule_layout()
+    migrate_fund_pool_stripes()
+    migrate_guarantee_exposure()
+    migrate_member_stats()
+    migrate_existing_applications()
+    migrate_search_index()
+    migrate_daily_rollups()
+    
+    # Initialize system configuration
+    get_system_config()
+    
+    # Invalidate ETags handed out by earlier deployments
+    bump_versions("epoch")
+
+def recalculate_fund_pool_totals(updated_by: str) -> FundPool:
+    """Recalculate fund pool based on actual data"""
+    
+    # Calculate total deposits
+    total_deposits_result = db.deposits.aggregate([
+        {"$match": {"status": "completed"}},
+        {"$group": {"_id": None, "total": {"$sum": "$amount"}}}
+    ])
+    total_deposits_list = list(total_deposits_result)
+    total_deposits = total_deposits_list[0]["total"] if total_deposits_list else 0
+    
+    # Calculate total disbursed
+    total_disbursed_result = db.disbursements.aggregate([
+        {"$match": {"status": "disbursed"}},
+        {"$group": {"_id": None, "total": {"$sum": "$disbursed_amount"}}}
+    ])
+    total_disbursed_list = list(total_disbursed_result)
+    total_disbursed = total_disbursed_list[0]["total"] if total_disbursed_list else 0
+    
+    # Calculate total repaid
+    total_repaid_result = aggregate_installments([
+        {"$match": {"status": {"$in": ["paid", "partial"]}}},
+        {"$group": {"_id": None, "total": {"$sum": "$paid_amount"}}}
+    ], include_archived=True)
+    total_repaid_list = list(total_repaid_result)
+    total_repaid = total_repaid_list[0]["total"] if total_repaid_list else 0
+    
+    # Update fund pool with calculated values
+    available_balance = total_deposits + total_repaid - total_disbursed
+    total_receivables = total_disbursed - total_repaid
+    
+    set_fund_pool_totals({
+        "total_deposits": total_deposits,
+        "total_disbursed": total_disbursed,
+        "total_repaid": total_repaid,
+        "available_balance": available_balance,
+        "total_receivables": total_receivables
+    }, updated_by)
+    publish_fund_pool()
+    return get_fund_pool()
+
+def run_archival_job(params: dict, progress) -> dict:
+    return run_archival(params.get("older_than_days", ARCHIVE_AFTER_DAYS), progress=progress)
+
+def recalculate_fund_pool_job(params: dict, progress) -> dict:
+    return recalculate_fund_pool_totals(params.get("requested_by")).model_dump()
 
-# Initialize system configuration
-get_system_config()
+def rebuild_member_stats_job(params: dict, progress) -> dict:
+    rebuilt = rebuild_member_stats()
+    bump_versions("epoch")
+    return {"users": rebuilt}
+
+def rescore_members_job(params: dict, progress) -> dict:
+    return {"members": rescore_members()}
+
+def rebuild_daily_rollups_job(params: dict, progress) -> dict:
+    rebuilt = rebuild_daily_rollups()
+    bump_versions("data")
+    return {"rows": rebuilt}
+
+def rebuild_search_index_job(params: dict, progress) -> dict:
+    return {"records": rebuild_search_index()}
+
+def portfolio_report_job(params: dict) -> dict:
+    """Runs in a job process, which connects to Mongo on start"""
+    as_of = datetime.strptime(params["as_of"], "%Y-%m-%d").date() if params.get("as_of") else None
+    return get_portfolio_report(read_db("export"), as_of, read_versions(["portfolio"])["portfolio"], cache_database=db)
+
+JOB_TYPES = [
+    JobType("recalculate_fund_pool", recalculate_fund_pool_job, singleton=True),
+    JobType("rebuild_member_stats", rebuild_member_stats_job, singleton=True),
+    JobType("rescore_members", rescore_members_job, singleton=True),
+    JobType("rebuild_daily_rollups", rebuild_daily_rollups_job, singleton=True),
+    JobType("rebuild_search_index", rebuild_search_index_job, singleton=True),
+    JobType("archive", run_archival_job, singleton=True),
+    JobType("portfolio_report", portfolio_report_job, executor=PROCESS)
+]
+
+# Who may submit each job type
+JOB_ROLES = {
+    "portfolio_report": [UserRole.FUND_ADMIN, UserRole.GENERAL_ADMIN]
+}
+
+job_runner = JobRunner(
+    lambda: db,
+    JOB_TYPES,
+    thread_workers=JOB_THREAD_WORKERS,
+    process_workers=JOB_PROCESS_WORKERS,
+    lease_seconds=JOB_LEASE_SECONDS,
+    max_attempts=JOB_MAX_ATTEMPTS,
+    on_update=lambda job: emit_event(job_event, job),
+    process_initializer=connect_mongo
+)
+
+def submit_job(job_type: str, params: dict, current_user: dict) -> JSONResponse:
+    """Queue a job and answer 202 with where to poll it"""
+    job = job_runner.submit(job_type, {**params, "requested_by": current_user["id"]}, submitted_by=current_user["id"])
+    return JSONResponse(
+        status_code=202,
+        content=jsonable_encoder(job),
+        headers={"Location": f"/api/admin/jobs/{job['id']}"}
+    )
 
 # API Routes
 
@@ -604,7 +3098,7 @@ async def health():
 @app.post("/api/auth/register")
 async def register(user: UserRegister):
     # Check if user exists
-    if db.users.find_one({"email": user.email}):
+    if get_user_by_email(db, user.email):
         raise HTTPException(status_code=400, detail="Email already registered")
     
     # Create user
@@ -623,7 +3117,9 @@ async def register(user: UserRegister):
         "is_active": True
     }
     
-    db.users.insert_one(user_doc)
+    db.users.insert_one(with_id(user_doc))
+    index_search_documents([user_search_document(user_doc)])
+    bump_versions("data")
     
     # Create access token
     access_token = create_access_token(data={"sub": user_id})
@@ -637,7 +3133,7 @@ async def register(user: UserRegister):
 @app.post("/api/auth/login")
 async def login(user: UserLogin):
     # Find user
-    user_doc = db.users.find_one({"email": user.email})
+    user_doc = get_user_by_email(db, user.email, None)
     if not user_doc or not check_password_hash(user_doc["password_hash"], user.password):
         raise HTTPException(status_code=401, detail="Invalid credentials")
     
@@ -657,10 +3153,79 @@ async def login(user: UserLogin):
 async def get_current_user_profile(current_user = Depends(get_current_user)):
     return User(**{k: v for k, v in current_user.items() if k != "password_hash"})
 
+def stream_ticket_hash(ticket: str) -> str:
+    return hashlib.sha256(ticket.encode()).hexdigest()
+
+@app.post("/api/events/ticket")
+async def create_stream_ticket(current_user = Depends(get_current_user)):
+    """Issue a short-lived, single-use ticket for opening the event stream"""
+    ticket = secrets.token_urlsafe(32)
+    db.stream_tickets.insert_one({
+        "ticket_hash": stream_ticket_hash(ticket),
+        "user_id": current_user["id"],
+        "expires_at": datetime.utcnow() + timedelta(seconds=STREAM_TICKET_SECONDS)
+    })
+    return {"ticket": ticket, "expires_in": STREAM_TICKET_SECONDS}
+
+def get_stream_user(
+    ticket: Optional[str] = None,
+    credentials: Optional[HTTPAuthorizationCredentials] = Depends(optional_security)
+):
+    """Authenticate by bearer header or by a stream ticket, since EventSource cannot set headers.
+
+    The access token itself is never accepted in the URL, where proxies and
+    browser history would keep it.
+    """
+    if credentials:
+        return get_current_user(decode_access_token(credentials.credentials))
+    if not ticket:
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    # Deleting the ticket as it is read makes it good for one connection
+    redeemed = db.stream_tickets.find_one_and_delete({
+        "ticket_hash": stream_ticket_hash(ticket),
+        "expires_at": {"$gt": datetime.utcnow()}
+    })
+    if not redeemed:
+        raise HTTPException(status_code=401, detail="Invalid or expired stream ticket")
+    return get_current_user(redeemed["user_id"])
+
+@app.get("/api/events/stream")
+async def stream_events(request: Request, current_user = Depends(get_stream_user)):
+    """Server-sent events for workflow and fund pool changes visible to the current user"""
+    queue = event_bus.subscribe()
+    
+    async def event_source():
+        try:
+            yield "retry: 5000\n\n"
+            while not await request.is_disconnected():
+                try:
+                    event = await asyncio.wait_for(queue.get(), timeout=SSE_KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                if event_visible_to(event, current_user):
+                    yield f"event: {event['type']}\ndata: {json.dumps(event['data'], default=str)}\n\n"
+        finally:
+            event_bus.unsubscribe(queue)
+    
+    return StreamingResponse(
+        event_source(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 # System Configuration endpoints
 @app.get("/api/admin/system-config")
-async def get_system_configuration(current_user = Depends(require_role([UserRole.GENERAL_ADMIN]))):
+async def get_system_configuration(
+    request: Request,
+    response: Response,
+    current_user = Depends(require_role([UserRole.GENERAL_ADMIN]))
+):
     """Get current system configuration"""
+    not_modified = check_etag(request, response, "system-config", ["system_config"])
+    if not_modified:
+        return not_modified
+    
     config = get_system_config()
     return config
 
@@ -703,6 +3268,7 @@ async def update_system_configuration(
         {"$set": update_data},
         upsert=True
     )
+    bump_versions("system_config", "data")
     
     # Return updated configuration
     updated_config = get_system_config()
@@ -710,7 +3276,16 @@ async def update_system_configuration(
 
 # Member endpoints
 @app.post("/api/deposits")
-async def create_deposit(deposit: DepositCreate, current_user = Depends(get_current_user)):
+async def create_deposit(request: Request, deposit: DepositCreate, current_user = Depends(get_current_user)):
+    """Record a deposit. Send an ``Idempotency-Key`` header to make retries safe."""
+    return await idempotent(
+        request,
+        f"deposits:{current_user['id']}",
+        deposit,
+        lambda: record_deposit(deposit, current_user)
+    )
+
+def record_deposit(deposit: DepositCreate, current_user: dict) -> Deposit:
     deposit_id = str(uuid.uuid4())
     deposit_doc = {
         "id": deposit_id,
@@ -721,7 +3296,10 @@ async def create_deposit(deposit: DepositCreate, current_user = Depends(get_curr
         "created_at": datetime.utcnow()
     }
     
-    db.deposits.insert_one(deposit_doc)
+    db.deposits.insert_one(with_id(deposit_doc))
+    increment_member_stats(current_user["id"], {"total_deposits": deposit.amount, "deposit_count": 1})
+    record_rollups([(RollupMetric.DEPOSITS.value, deposit_doc["created_at"], current_user.get("country"), deposit.amount)])
+    bump_versions(user_version(current_user["id"]), "data")
     
     # Update fund pool
     update_fund_pool(
@@ -732,31 +3310,43 @@ async def create_deposit(deposit: DepositCreate, current_user = Depends(get_curr
     return Deposit(**deposit_doc)
 
 @app.get("/api/deposits")
-async def get_user_deposits(current_user = Depends(get_current_user)):
+async def get_user_deposits(request: Request, response: Response, current_user = Depends(get_current_user)):
+    not_modified = check_etag(request, response, f"deposits-{current_user['id']}", [user_version(current_user["id"])])
+    if not_modified:
+        return not_modified
+    
     deposits = list(db.deposits.find({"user_id": current_user["id"]}, {"_id": 0}).sort("created_at", -1))
     return [Deposit(**deposit) for deposit in deposits]
 
 @app.get("/api/guarantors/eligible")
-async def get_eligible_guarantors(current_user = Depends(get_current_user)):
-    """Get list of users eligible to be guarantors"""
-    eligible_guarantors = []
-    all_members = list(db.users.find({"role": "member", "is_active": True}, {"password_hash": 0}))
+async def get_eligible_guarantors(guaranteed_amount: float = 0.0, current_user = Depends(get_current_user)):
+    """Get list of users eligible to guarantee ``guaranteed_amount``"""
+    config = get_system_config()
     
-    for member in all_members:
-        if member["id"] == current_user["id"]:  # Can't guarantee for yourself
-            continue
-            
-        is_eligible, total_deposits = check_guarantor_eligibility(member["id"])
-        if is_eligible:
-            eligible_guarantors.append({
-                "id": member["id"],
-                "full_name": member["full_name"],
-                "email": member["email"],
-                "country": member["country"],
-                "total_deposits": total_deposits
-            })
+    # Same rule as check_guarantor_eligibility, answered from the guarantee_capacity index
+    candidates = list(db.member_stats.find(
+        {
+            "guarantee_capacity": {"$gte": required_guarantee_capacity(config, guaranteed_amount)},
+            "user_id": {"$ne": current_user["id"]}  # Can't guarantee for yourself
+        },
+        {"_id": 0, "user_id": 1, "total_deposits": 1, "guarantee_exposure": 1, "guarantee_capacity": 1}
+    ).sort("guarantee_capacity", DESCENDING))
+    members = users_by_ids(
+        db, [stats["user_id"] for stats in candidates], USER_CONTACT, role="member", is_active=True
+    )
     
-    return eligible_guarantors
+    return [
+        {
+            "id": stats["user_id"],
+            "full_name": members[stats["user_id"]]["full_name"],
+            "email": members[stats["user_id"]]["email"],
+            "country": members[stats["user_id"]]["country"],
+            "total_deposits": stats["total_deposits"],
+            "guarantee_exposure": stats.get("guarantee_exposure", 0.0),
+            "available_to_guarantee": stats["guarantee_capacity"]
+        }
+        for stats in candidates if stats["user_id"] in members
+    ]
 
 @app.post("/api/finance-applications")
 async def create_finance_application(application: FinanceApplicationCreate, current_user = Depends(get_current_user)):
@@ -779,7 +3369,7 @@ async def create_finance_application(application: FinanceApplicationCreate, curr
         )
     
     # Calculate priority score
-    priority_score, previous_finances_count = calculate_priority_score(current_user["id"])
+    priority_score, previous_finances_count = calculate_priority_score(current_user["id"], config)
     
     # Determine if higher approval is required
     required_approval_level = determine_required_approval_level(application.amount, current_user["country"])
@@ -787,17 +3377,20 @@ async def create_finance_application(application: FinanceApplicationCreate, curr
     
     # Validate guarantors
     guarantor_records = []
+    guaranteed_amount = application.amount / len(application.guarantors) if application.guarantors else 0.0
     for guarantor_user_id in application.guarantors:
         # Check if guarantor exists and is eligible
-        guarantor = db.users.find_one({"id": guarantor_user_id, "is_active": True})
+        guarantor = get_user(db, guarantor_user_id, USER_CONTACT, is_active=True)
         if not guarantor:
             raise HTTPException(status_code=400, detail=f"Guarantor user not found: {guarantor_user_id}")
         
-        is_eligible, total_deposits = check_guarantor_eligibility(guarantor_user_id)
+        is_eligible, total_deposits = check_guarantor_eligibility(
+            guarantor_user_id, config=config, guaranteed_amount=guaranteed_amount
+        )
         if not is_eligible:
             raise HTTPException(
                 status_code=400, 
-                detail=f"User {guarantor['full_name']} is not eligible to be a guarantor. Minimum deposit required: ${config.minimum_deposit_for_guarantor}"
+                detail=f"User {guarantor['full_name']} is not eligible to be a guarantor. Deposits not already guaranteeing other loans must be at least ${required_guarantee_capacity(config, guaranteed_amount)}"
             )
         
         # Create guarantor record
@@ -809,12 +3402,13 @@ async def create_finance_application(application: FinanceApplicationCreate, curr
             "guarantor_name": guarantor["full_name"],
             "guarantor_email": guarantor["email"],
             "status": GuarantorStatus.PENDING.value,
-            "guaranteed_amount": application.amount / len(application.guarantors),
+            "guaranteed_amount": guaranteed_amount,
+            "exposure": 0.0,
             "created_at": datetime.utcnow(),
             "responded_at": None
         }
         
-        db.guarantors.insert_one(guarantor_doc)
+        db.guarantors.insert_one(with_id(guarantor_doc))
         guarantor_records.append(GuarantorResponse(**guarantor_doc))
     
     # Set initial status based on approval requirements
@@ -841,7 +3435,17 @@ async def create_finance_application(application: FinanceApplicationCreate, curr
         "requires_higher_approval": requires_higher_approval
     }
     
-    db.finance_applications.insert_one(app_doc)
+    with application_changes() as change_seq:
+        app_doc.update(application_change_fields(change_seq))
+        db.finance_applications.insert_one(with_id(app_doc))
+    index_search_documents([application_search_document(app_doc, current_user)])
+    increment_member_stats(current_user["id"], application_status_deltas(None, initial_status))
+    bump_versions(
+        user_version(current_user["id"]),
+        *[user_version(guarantor_user_id) for guarantor_user_id in application.guarantors],
+        "data"
+    )
+    emit_event(application_event, "application_created", app_doc)
     
     # Return application with guarantors
     app_response = FinanceApplication(**app_doc)
@@ -850,32 +3454,47 @@ async def create_finance_application(application: FinanceApplicationCreate, curr
     return app_response
 
 @app.get("/api/finance-applications")
-async def get_user_applications(current_user = Depends(get_current_user)):
-    applications = list(db.finance_applications.find({"user_id": current_user["id"]}, {"_id": 0}).sort("created_at", -1))
-    
-    # Add guarantors and approval history to each application
-    for app in applications:
-        guarantors = list(db.guarantors.find({"application_id": app["id"]}, {"_id": 0}))
-        app["guarantors"] = [GuarantorResponse(**g) for g in guarantors]
-        
-        approval_history = list(db.approval_history.find({"application_id": app["id"]}, {"_id": 0}).sort("created_at", 1))
-        app["approval_history"] = [ApprovalHistory(**h) for h in approval_history]
-    
-    return [FinanceApplication(**app) for app in applications]
+async def get_user_applications(
+    include_archived: bool = False,
+    fields: Optional[str] = None,
+    expand: Optional[str] = None,
+    current_user = Depends(get_current_user)
+):
+    """The member's applications.
+
+    ``fields`` (comma-separated) returns only those fields; ``expand`` picks
+    the relations to include from guarantors and approval_history (default both).
+    """
+    fields = parse_field_list(fields, APPLICATION_FIELDS, "fields")
+    expand = parse_field_list(expand, APPLICATION_EXPANSIONS, "expand") if expand is not None else APPLICATION_EXPANSIONS
+    
+    applications = find_with_archive(
+        "finance_applications", {"user_id": current_user["id"]}, application_projection(fields),
+        sort=[("created_at", -1)], include_archived=include_archived
+    )
+    expand_applications(applications, expand, include_archived)
+    return render_applications(applications, fields, expand)
 
 @app.get("/api/guarantor-requests")
-async def get_guarantor_requests(current_user = Depends(get_current_user)):
+async def get_guarantor_requests(include_archived: bool = False, current_user = Depends(get_current_user)):
     """Get guarantor requests for current user"""
-    guarantor_requests = list(db.guarantors.find(
+    guarantor_requests = find_with_archive(
+        "guarantors",
         {"guarantor_user_id": current_user["id"]}, 
-        {"_id": 0}  # Exclude MongoDB _id field
-    ).sort("created_at", -1))
+        {"_id": 0},  # Exclude MongoDB _id field
+        sort=[("created_at", -1)],
+        include_archived=include_archived
+    )
     
     # Add application details to each request
+    applications = find_applications_by_ids(
+        [request["application_id"] for request in guarantor_requests], APPLICATION_SUMMARY
+    )
+    applicants = find_by_ids([db.users], [app["user_id"] for app in applications.values()], USER_CONTACT)
     for request in guarantor_requests:
-        application = db.finance_applications.find_one({"id": request["application_id"]}, {"_id": 0})
+        application = applications.get(request["application_id"])
         if application:
-            applicant = db.users.find_one({"id": application["user_id"]}, {"password_hash": 0, "_id": 0})
+            applicant = applicants.get(application["user_id"])
             request["application_details"] = {
                 "id": application["id"],
                 "amount": application["amount"],
@@ -902,7 +3521,7 @@ async def respond_to_guarantor_request(
     
     # Find guarantor request
     guarantor_request = db.guarantors.find_one({
-        "id": guarantor_id,
+        **by_id(guarantor_id),
         "guarantor_user_id": current_user["id"]
     })
     
@@ -912,16 +3531,55 @@ async def respond_to_guarantor_request(
     if guarantor_request["status"] != "pending":
         raise HTTPException(status_code=400, detail="Guarantor request already responded to")
     
-    # Update guarantor status
-    db.guarantors.update_one(
-        {"id": guarantor_id},
+    application = get_application(
+        db, guarantor_request["application_id"], {"_id": 0, "id": 1, "user_id": 1, "amount": 1, "status": 1}
+    )
+    
+    # Accepted guarantees count towards the guarantor's exposure unless the loan was rejected
+    exposure = 0.0
+    if response["status"] == "accepted" and application and application["status"] != ApplicationStatus.REJECTED.value:
+        exposure = guarantor_request["guaranteed_amount"]
+    
+    # Take the exposure out of the guarantor's capacity first; the condition is
+    # check_guarantor_eligibility's and stops accepted guarantees from adding up
+    # to more than their free deposits
+    if exposure:
+        required = required_guarantee_capacity(get_system_config(), exposure)
+        reserved = db.member_stats.update_one(
+            {"user_id": current_user["id"], "guarantee_capacity": {"$gte": required}},
+            member_stats_update({"guarantee_exposure": exposure})
+        )
+        if not reserved.modified_count:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Deposits not already guaranteeing other loans must be at least ${required} to accept"
+            )
+    
+    # Update guarantor status; only one response to a pending request wins
+    responded = db.guarantors.update_one(
+        {**by_id(guarantor_id), "status": GuarantorStatus.PENDING.value},
         {
             "$set": {
                 "status": response["status"],
-                "responded_at": datetime.utcnow()
+                "responded_at": datetime.utcnow(),
+                "exposure": exposure
             }
         }
     )
+    if not responded.modified_count:
+        if exposure:
+            increment_member_stats(current_user["id"], {"guarantee_exposure": -exposure})
+        raise HTTPException(status_code=400, detail="Guarantor request already responded to")
+    
+    touch_application(guarantor_request["application_id"])
+    
+    bump_versions(
+        user_version(current_user["id"]),
+        *([user_version(application["user_id"])] if application else []),
+        "data"
+    )
+    if application:
+        emit_event(guarantor_event, {**guarantor_request, "status": response["status"]}, application)
     
     return {"message": f"Guarantor request {response['status']} successfully"}
 
@@ -930,18 +3588,36 @@ async def get_user_repayments(current_user = Depends(get_current_user)):
     repayments = list(db.repayments.find({"user_id": current_user["id"]}, {"_id": 0}).sort("due_date", 1))
     return [Repayment(**repayment) for repayment in repayments]
 
-@app.get("/api/dashboard")
-async def get_user_dashboard(current_user = Depends(get_current_user)):
+@app.get("/api/dashboard", dependencies=[Depends(route_class("dashboards"))])
+def get_user_dashboard(request: Request, response: Response, current_user = Depends(get_current_user)):
     user_role = UserRole(current_user["role"])
     
+    etag_scope = f"dashboard-{current_user['id']}-{user_role.value}"
+    
+    # Members only see their own data, read from the primary
     if user_role == UserRole.MEMBER:
-        return await get_member_dashboard(current_user)
-    elif user_role == UserRole.COUNTRY_COORDINATOR:
-        return await get_country_coordinator_dashboard(current_user)
-    elif user_role == UserRole.FUND_ADMIN:
-        return await get_fund_admin_dashboard(current_user)
-    elif user_role == UserRole.GENERAL_ADMIN:
-        return await get_general_admin_dashboard(current_user)
+        not_modified = check_etag(request, response, etag_scope, [user_version(current_user["id"]), "system_config"])
+        if not_modified:
+            return not_modified
+        return get_member_dashboard(current_user)
+    
+    # Staff dashboards summarize everything and read from the analytics profile. The
+    # causal session makes the secondary catch up to the versions behind the ETag.
+    with client.start_session(causal_consistency=True) as session:
+        not_modified = check_etag(
+            request, response, etag_scope,
+            [user_version(current_user["id"]), "system_config", "data"],
+            session=session
+        )
+        if not_modified:
+            return not_modified
+        
+        if user_role == UserRole.COUNTRY_COORDINATOR:
+            return get_country_coordinator_dashboard(current_user, session)
+        elif user_role == UserRole.FUND_ADMIN:
+            return get_fund_admin_dashboard(current_user, session)
+        elif user_role == UserRole.GENERAL_ADMIN:
+            return get_general_admin_dashboard(current_user, session)
 
 # Approval Workflow endpoints
 @app.put("/api/admin/applications/{application_id}/approve")
@@ -953,12 +3629,12 @@ async def approve_application(
     """Approve or reject a finance application"""
     
     # Find the application
-    application = db.finance_applications.find_one({"id": application_id})
+    application = get_application(db, application_id)
     if not application:
         raise HTTPException(status_code=404, detail="Application not found")
     
     # Get applicant details
-    applicant = db.users.find_one({"id": application["user_id"]})
+    applicant = get_user(db, application["user_id"], USER_COUNTRY)
     if not applicant:
         raise HTTPException(status_code=404, detail="Applicant not found")
     
@@ -975,23 +3651,11 @@ async def approve_application(
     
     # Determine new status based on action
     previous_status = ApplicationStatus(application["status"])
-    
-    if approval_request.action == ApprovalAction.APPROVE:
-        # Check if this approval is sufficient or needs escalation
-        approval_amount = approval_request.recommended_amount or application["amount"]
-        required_level = determine_required_approval_level(approval_amount)
-        
-        if (current_user["role"] == "country_coordinator" and required_level in ["fund_admin", "general_admin"]) or \
-           (current_user["role"] == "fund_admin" and required_level == "general_admin"):
-            new_status = ApplicationStatus.REQUIRES_HIGHER_APPROVAL
-        else:
-            new_status = ApplicationStatus.APPROVED
-    elif approval_request.action == ApprovalAction.REJECT:
-        new_status = ApplicationStatus.REJECTED
-    elif approval_request.action == ApprovalAction.REQUEST_MORE_INFO:
-        new_status = ApplicationStatus.UNDER_REVIEW
-    elif approval_request.action == ApprovalAction.ESCALATE:
-        new_status = ApplicationStatus.REQUIRES_HIGHER_APPROVAL
+    new_status = decide_application_status(
+        approval_request.action,
+        approval_request.recommended_amount or application["amount"],
+        current_user["role"]
+    )
     
     # Create approval history record
     approval_history_id = str(uuid.uuid4())
@@ -1010,7 +3674,7 @@ async def approve_application(
         "created_at": datetime.utcnow()
     }
     
-    db.approval_history.insert_one(approval_history)
+    db.approval_history.insert_one(with_id(approval_history))
     
     # Update application
     update_data = {
@@ -1026,13 +3690,28 @@ async def approve_application(
     if approval_request.recommended_amount:
         update_data["approved_amount"] = approval_request.recommended_amount
     
-    db.finance_applications.update_one(
-        {"id": application_id},
-        {"$set": update_data}
+    with application_changes() as change_seq:
+        update_data.update(application_change_fields(change_seq))
+        db.finance_applications.update_one(
+            by_id(application_id),
+            {"$set": update_data}
+        )
+    increment_member_stats(application["user_id"], application_status_deltas(previous_status.value, new_status.value))
+    
+    # Rejected loans release the exposure of guarantors who had accepted
+    released_guarantor_ids = []
+    if new_status == ApplicationStatus.REJECTED and previous_status != ApplicationStatus.REJECTED:
+        released_guarantor_ids = release_guarantee_exposure([application_id])
+    
+    bump_versions(
+        user_version(application["user_id"]),
+        *[user_version(guarantor_user_id) for guarantor_user_id in released_guarantor_ids],
+        "data"
     )
+    emit_event(approval_event, approval_history, application)
     
     # Return updated application with history
-    updated_application = db.finance_applications.find_one({"id": application_id})
+    updated_application = get_application(db, application_id)
     
     # Ensure all fields exist
     if "priority_score" not in updated_application or updated_application["priority_score"] is None:
@@ -1057,93 +3736,383 @@ async def approve_application(
     
     return FinanceApplication(**updated_application)
 
-@app.get("/api/admin/approval-queue")
-async def get_approval_queue(current_user = Depends(require_role([UserRole.COUNTRY_COORDINATOR, UserRole.FUND_ADMIN, UserRole.GENERAL_ADMIN]))):
-    """Get applications pending approval for the current user's role"""
+@app.post("/api/admin/applications/bulk-decision")
+async def bulk_decide_applications(
+    decision_request: BulkDecisionRequest,
+    current_user = Depends(require_role([UserRole.COUNTRY_COORDINATOR, UserRole.FUND_ADMIN, UserRole.GENERAL_ADMIN]))
+):
+    """Approve, reject, escalate or return many applications in one call"""
+    config = get_system_config()
+    application_ids = [item.application_id for item in decision_request.items]
+    applications = applications_by_ids(db, application_ids, {"_id": 0, "id": 1, "user_id": 1, "amount": 1, "status": 1})
+    applicants = get_applicants(list(applications.values()))
+    
+    now = datetime.utcnow()
+    results = []
+    decided = []
+    seen_ids = set()
+    
+    for item in decision_request.items:
+        application = applications.get(item.application_id)
+        if item.application_id in seen_ids:
+            results.append({"application_id": item.application_id, "ok": False, "error": "Duplicate item"})
+            continue
+        seen_ids.add(item.application_id)
+        if not application:
+            results.append({"application_id": item.application_id, "ok": False, "error": "Application not found"})
+            continue
+        
+        applicant = applicants.get(application["user_id"])
+        if not applicant:
+            results.append({"application_id": item.application_id, "ok": False, "error": "Applicant not found"})
+            continue
+        
+        approval_amount = item.recommended_amount or application["amount"]
+        can_approve, reason = can_approve_application(
+            current_user["role"], approval_amount, applicant["country"], current_user["country"], config
+        )
+        if not can_approve and item.action == ApprovalAction.APPROVE:
+            results.append({"application_id": item.application_id, "ok": False, "error": reason})
+            continue
+        
+        new_status = decide_application_status(item.action, approval_amount, current_user["role"], config)
+        decided.append((item, application, new_status, len(results)))
+        results.append({"application_id": item.application_id, "ok": True, "status": new_status.value})
+    
+    if decided:
+        # Tag this batch's writes so the ones that landed can be found afterwards
+        review_batch = str(uuid.uuid4())
+        application_updates = []
+        for item, application, new_status, _ in decided:
+            update_data = {
+                "status": new_status.value,
+                "reviewed_at": now,
+                "reviewed_by": current_user["id"],
+                "review_notes": item.review_notes,
+                "review_batch": review_batch
+            }
+            if item.conditions:
+                update_data["conditions"] = item.conditions
+            if item.recommended_amount:
+                update_data["approved_amount"] = item.recommended_amount
+            # Only decide applications still in the status this batch checked
+            application_updates.append(UpdateOne(
+                {**by_id(application["id"]), "status": application["status"]},
+                {"$set": update_data}
+            ))
+        
+        result = db.finance_applications.bulk_write(application_updates, ordered=False)
+        if result.modified_count < len(decided):
+            landed_ids = {
+                app["id"] for app in find_applications(
+                    db,
+                    {**by_id({"$in": [application["id"] for _, application, _, _ in decided]}), "review_batch": review_batch},
+                    {"_id": 0, "id": 1}
+                )
+            }
+            landed = []
+            for decision in decided:
+                if decision[1]["id"] in landed_ids:
+                    landed.append(decision)
+                else:
+                    results[decision[3]] = {
+                        "application_id": decision[0].application_id,
+                        "ok": False,
+                        "error": "Application changed while deciding; please retry"
+                    }
+            decided = landed
+    
+    if decided:
+        # Change sequence numbers are only reserved for the decisions that landed
+        with application_changes(len(decided)) as first_seq:
+            db.finance_applications.bulk_write([
+                UpdateOne(
+                    {**by_id(application["id"]), "review_batch": review_batch},
+                    {
+                        "$max": {"change_seq": first_seq + offset},
+                        "$set": {"updated_at": now},
+                        "$unset": {"review_batch": ""}
+                    }
+                )
+                for offset, (_, application, _, _) in enumerate(decided)
+            ], ordered=False)
+        
+        history_docs = []
+        stats_deltas = {}
+        rejected_ids = []
+        for item, application, new_status, _ in decided:
+            history_docs.append({
+                "id": str(uuid.uuid4()),
+                "application_id": item.application_id,
+                "approver_id": current_user["id"],
+                "approver_name": current_user["full_name"],
+                "approver_role": current_user["role"],
+                "action": item.action.value,
+                "review_notes": item.review_notes,
+                "conditions": item.conditions,
+                "recommended_amount": item.recommended_amount,
+                "previous_status": application["status"],
+                "new_status": new_status.value,
+                "created_at": now
+            })
+            
+            deltas = stats_deltas.setdefault(application["user_id"], {})
+            for field, delta in application_status_deltas(application["status"], new_status.value).items():
+                deltas[field] = deltas.get(field, 0) + delta
+            
+            if new_status == ApplicationStatus.REJECTED and application["status"] != ApplicationStatus.REJECTED.value:
+                rejected_ids.append(application["id"])
+        
+        db.approval_history.insert_many([with_id(history) for history in history_docs], ordered=False)
+        increment_member_stats_bulk(stats_deltas)
+        released_guarantor_ids = release_guarantee_exposure(rejected_ids) if rejected_ids else []
+        
+        bump_versions(
+            *[user_version(user_id) for user_id in stats_deltas],
+            *[user_version(guarantor_user_id) for guarantor_user_id in released_guarantor_ids],
+            "data"
+        )
+        for history, (item, application, new_status, _) in zip(history_docs, decided):
+            emit_event(approval_event, history, application)
+    
+    return {
+        "processed": len(results),
+        "succeeded": len(decided),
+        "failed": len(results) - len(decided),
+        "results": results
+    }
+
+APPROVAL_QUEUE_STATUSES = {
+    "country_coordinator": ["pending", "under_review"],
+    "fund_admin": ["pending", "under_review", "requires_higher_approval"],
+    "general_admin": ["pending", "under_review", "requires_higher_approval"]
+}
+
+def approval_queue_scope(config: SystemConfig, current_user: dict) -> str:
+    """Fingerprint of everything besides the applications that decides queue membership"""
+    # Mongo keeps milliseconds, so a config created by this request matches its stored copy
+    scope = f"{config.updated_at.isoformat(timespec='milliseconds')}|{current_user['role']}|{current_user['country']}"
+    return hashlib.sha1(scope.encode()).hexdigest()[:12]
+
+def in_approval_queue(application: dict, applicant_country: str, current_user: dict, approval_limit: float) -> bool:
+    """Python mirror of the approval queue query for a single application"""
+    user_role = current_user["role"]
+    if application["status"] not in APPROVAL_QUEUE_STATUSES[user_role]:
+        return False
+    if user_role != "general_admin" and application["amount"] > approval_limit:
+        return False
+    if user_role == "country_coordinator" and applicant_country != current_user["country"]:
+        return False
+    return True
+
+def fill_application_defaults(app: dict) -> dict:
+    """Fill fields that applications created by older releases may lack"""
+    if "priority_score" not in app or app["priority_score"] is None:
+        app["priority_score"] = 0
+    if "previous_finances_count" not in app:
+        app["previous_finances_count"] = 0
+    if "review_notes" not in app:
+        app["review_notes"] = None
+    if "conditions" not in app:
+        app["conditions"] = None
+    if "approved_amount" not in app:
+        app["approved_amount"] = None
+    if "requires_higher_approval" not in app:
+        app["requires_higher_approval"] = False
+    return app
+
+def add_review_details(app: dict, applicant: Optional[dict], current_user: dict) -> dict:
+    """Add applicant and approval details for a reviewer"""
+    if applicant:
+        app["applicant_name"] = applicant["full_name"]
+        app["applicant_email"] = applicant["email"]
+        app["applicant_country"] = applicant["country"]
+    
+    app["required_approval_level"] = determine_required_approval_level(app["amount"])
+    
+    # Check if current user can approve
+    can_approve, reason = can_approve_application(
+        current_user["role"], 
+        app["amount"], 
+        applicant["country"] if applicant else "", 
+        current_user["country"]
+    )
+    app["can_approve"] = can_approve
+    app["approval_restriction"] = reason if not can_approve else None
+    return app
+
+def enrich_queue_application(app: dict, applicant: Optional[dict], current_user: dict) -> FinanceApplication:
+    """Queue entry with approval details; guarantors and history must already be expanded"""
+    return FinanceApplication(**add_review_details(fill_application_defaults(app), applicant, current_user))
+
+def expand_applications(applications: List[dict], expand: List[str], include_archived: bool = False) -> List[dict]:
+    """Attach guarantors and approval history with one query per relation"""
+    application_ids = [app["id"] for app in applications]
+    if "guarantors" in expand:
+        guarantors = find_grouped(
+            collections_with_archive("guarantors", include_archived), "application_id", application_ids, {"_id": 0}
+        )
+        for app in applications:
+            app["guarantors"] = [GuarantorResponse(**g) for g in guarantors[app["id"]]]
+    if "approval_history" in expand:
+        history = find_grouped(
+            collections_with_archive("approval_history", include_archived), "application_id", application_ids,
+            {"_id": 0}, sort_by="created_at"
+        )
+        for app in applications:
+            app["approval_history"] = [ApprovalHistory(**h) for h in history[app["id"]]]
+    return applications
+
+def parse_field_list(value: Optional[str], allowed: List[str], parameter: str) -> Optional[List[str]]:
+    """Split a comma-separated query parameter, rejecting unknown names"""
+    if value is None:
+        return None
+    names = list(dict.fromkeys(name.strip() for name in value.split(",") if name.strip()))
+    unknown = [name for name in names if name not in allowed]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown {parameter}: {', '.join(unknown)}")
+    return names
+
+def application_projection(fields: Optional[List[str]]) -> dict:
+    """Stored application fields needed to render ``fields`` (everything when None)"""
+    if fields is None:
+        return {"_id": 0}
+    stored = [field for field in fields if field in APPLICATION_FIELDS]
+    stored += [source for field in fields for source in REVIEW_FIELD_SOURCES.get(field, [])]
+    return fields_projection(list(dict.fromkeys(stored)))
+
+def render_applications(applications: List[dict], fields: Optional[List[str]], expand: List[str]) -> list:
+    """Full models, or only the requested fields plus expanded relations"""
+    if fields is None:
+        return [FinanceApplication(**fill_application_defaults(app)) for app in applications]
+    return [select_fields(app, list(dict.fromkeys(["id", *fields, *expand]))) for app in applications]
+
+def get_applicants(applications: List[dict]) -> dict:
+    """Load the applicants of many applications with one query"""
+    user_ids = list({app["user_id"] for app in applications})
+    return users_by_ids(db, user_ids, USER_CONTACT)
+
+@app.get("/api/admin/approval-queue", dependencies=[Depends(route_class("admin_lists"))])
+def get_approval_queue(
+    response: Response,
+    since: Optional[str] = None,
+    current_user = Depends(require_role([UserRole.COUNTRY_COORDINATOR, UserRole.FUND_ADMIN, UserRole.GENERAL_ADMIN]))
+):
+    """Get applications pending approval for the current user's role
+
+    Every response carries an X-Change-Token header. Passing it back as
+    ``since`` returns only the applications that entered, changed in or left
+    the queue since that token, as {change_token, full, upserted, removed}.
+    The token stops below writes still in flight, so an application can be
+    reported again; clients apply deltas by id.
+    """
     
     user_role = current_user["role"]
+    config = get_system_config()
     approval_limit = get_approval_limit(user_role)
     
+    # Read the token before querying so writes racing with this request show up
+    # in the next delta
+    change_seq = landed_application_sequence()
+    scope = approval_queue_scope(config, current_user)
+    change_token = f"{change_seq}-{scope}"
+    response.headers["X-Change-Token"] = change_token
+    
+    if since is not None:
+        try:
+            since_seq, since_scope = since.split("-", 1)
+            since_seq = int(since_seq)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid change token")
+        
+        # A config or reviewer change can move any application in or out, and an
+        # archived application can no longer be reported as removed, so both
+        # fall through to a full reload
+        if since_scope == scope and since_seq >= current_sequence("archive_watermark"):
+            changed = find_applications(db, {"change_seq": {"$gt": since_seq}}, {"_id": 0}, sort=[("change_seq", 1)])
+            applicants = get_applicants(changed)
+            
+            queued = []
+            removed = []
+            for app in changed:
+                applicant = applicants.get(app["user_id"])
+                applicant_country = applicant["country"] if applicant else ""
+                if in_approval_queue(app, applicant_country, current_user, approval_limit):
+                    queued.append(app)
+                else:
+                    removed.append(app["id"])
+            upserted = [
+                enrich_queue_application(app, applicants.get(app["user_id"]), current_user)
+                for app in expand_applications(queued, APPLICATION_EXPANSIONS)
+            ]
+            
+            return {"change_token": change_token, "full": False, "upserted": upserted, "removed": removed}
+    
     # Build query based on role
     if user_role == "country_coordinator":
         # Country coordinators see applications from their country that they can approve
-        country_users = [user["id"] for user in db.users.find({"country": current_user["country"]})]
+        country_users = country_user_ids(db, current_user["country"])
         query = {
             "user_id": {"$in": country_users},
-            "status": {"$in": ["pending", "under_review"]},
+            "status": {"$in": APPROVAL_QUEUE_STATUSES[user_role]},
             "amount": {"$lte": approval_limit}
         }
     elif user_role == "fund_admin":
         # Fund admins see applications requiring their level of approval
         query = {
-            "status": {"$in": ["pending", "under_review", "requires_higher_approval"]},
+            "status": {"$in": APPROVAL_QUEUE_STATUSES[user_role]},
             "amount": {"$lte": approval_limit}
         }
     else:  # general_admin
         # General admins see all applications requiring approval
         query = {
-            "status": {"$in": ["pending", "under_review", "requires_higher_approval"]}
+            "status": {"$in": APPROVAL_QUEUE_STATUSES[user_role]}
         }
     
-    applications = list(db.finance_applications.find(query).sort([("priority_score", -1), ("created_at", 1)]))
+    applications = find_applications(db, query, {"_id": 0}, sort=[("priority_score", -1), ("created_at", 1)])
+    applicants = get_applicants(applications)
+    expand_applications(applications, APPLICATION_EXPANSIONS)
+    queue = [enrich_queue_application(app, applicants.get(app["user_id"]), current_user) for app in applications]
     
-    # Add additional information to each application
-    for app in applications:
-        # Ensure all fields exist
-        if "priority_score" not in app or app["priority_score"] is None:
-            app["priority_score"] = 0
-        if "previous_finances_count" not in app:
-            app["previous_finances_count"] = 0
-        if "review_notes" not in app:
-            app["review_notes"] = None
-        if "conditions" not in app:
-            app["conditions"] = None
-        if "approved_amount" not in app:
-            app["approved_amount"] = None
-        if "requires_higher_approval" not in app:
-            app["requires_higher_approval"] = False
-        
-        # Add applicant info
-        applicant = db.users.find_one({"id": app["user_id"]}, {"password_hash": 0})
-        if applicant:
-            app["applicant_name"] = applicant["full_name"]
-            app["applicant_email"] = applicant["email"]
-            app["applicant_country"] = applicant["country"]
-        
-        # Add guarantors
-        guarantors = list(db.guarantors.find({"application_id": app["id"]}))
-        app["guarantors"] = [GuarantorResponse(**g) for g in guarantors]
-        
-        # Add approval history
-        approval_history = list(db.approval_history.find({"application_id": app["id"]}).sort("created_at", 1))
-        app["approval_history"] = [ApprovalHistory(**h) for h in approval_history]
-        
-        # Add required approval level
-        app["required_approval_level"] = determine_required_approval_level(app["amount"])
-        
-        # Check if current user can approve
-        can_approve, reason = can_approve_application(
-            user_role, 
-            app["amount"], 
-            applicant["country"] if applicant else "", 
-            current_user["country"]
-        )
-        app["can_approve"] = can_approve
-        app["approval_restriction"] = reason if not can_approve else None
-    
-    return [FinanceApplication(**app) for app in applications]
+    if since is not None:
+        return {"change_token": change_token, "full": True, "upserted": queue, "removed": []}
+    return queue
 
 # Disbursement and Payment Schedule endpoints
 @app.post("/api/admin/applications/{application_id}/disburse")
 async def disburse_application(
+    request: Request,
     application_id: str,
     disbursement_request: DisbursementRequest,
+    background_tasks: BackgroundTasks,
     current_user = Depends(require_role([UserRole.FUND_ADMIN, UserRole.GENERAL_ADMIN]))
 ):
-    """Disburse funds for an approved application"""
-    
+    """Disburse funds for an approved application. Send an ``Idempotency-Key`` header to make retries safe."""
+    return await idempotent(
+        request,
+        f"disburse:{current_user['id']}",
+        {"application_id": application_id, **disbursement_request.model_dump()},
+        lambda: disburse(application_id, disbursement_request, current_user, background_tasks)
+    )
+
+def disburse(
+    application_id: str,
+    disbursement_request: DisbursementRequest,
+    current_user: dict,
+    background_tasks: Optional[BackgroundTasks] = None
+) -> dict:
+    """Write a disbursement, its payment schedule and the fund reservation together.
+
+    The disbursement insert, the approved -> disbursed status change, the
+    reservation and the schedule run in one transaction. The unique index on
+    disbursements.application_id and the status condition stop concurrent
+    disbursements of the same application, and the reservation stops them
+    from overdrawing the pool. Stats, rollups and guarantee exposure follow
+    the commit. Events and version bumps run after the response is sent when
+    ``background_tasks`` is given.
+    """
     # Find the application
-    application = db.finance_applications.find_one({"id": application_id})
+    application = get_application(db, application_id)
     if not application:
         raise HTTPException(status_code=404, detail="Application not found")
     
@@ -1151,26 +4120,13 @@ async def disburse_application(
     if application["status"] != "approved":
         raise HTTPException(status_code=400, detail="Application is not approved for disbursement")
     
-    # Check if already disbursed
-    existing_disbursement = db.disbursements.find_one({"application_id": application_id})
-    if existing_disbursement:
-        raise HTTPException(status_code=400, detail="Application has already been disbursed")
-    
     # Check guarantor acceptance
     guarantors_accepted, message = check_guarantor_acceptance(application_id)
     if not guarantors_accepted:
         raise HTTPException(status_code=400, detail=f"Cannot disburse: {message}")
     
     # Get approved amount (use approved_amount if set, otherwise use requested amount)
-    disbursement_amount = application.get("approved_amount", application["amount"])
-    
-    # Check fund availability
-    fund_pool = get_fund_pool()
-    if fund_pool.available_balance < disbursement_amount:
-        raise HTTPException(
-            status_code=400, 
-            detail=f"Insufficient funds. Available: {fund_pool.available_balance}, Required: {disbursement_amount}"
-        )
+    disbursement_amount = application.get("approved_amount") or application["amount"]
     
     # Create disbursement record
     disbursement_id = str(uuid.uuid4())
@@ -1187,29 +4143,84 @@ async def disburse_application(
         "notes": disbursement_request.notes,
         "reference_number": disbursement_request.reference_number or f"DISB-{disbursement_id[:8].upper()}"
     }
+    # What the last attempt wrote, for undoing it without a transaction
+    written = {}
     
-    db.disbursements.insert_one(disbursement_doc)
+    def write(session) -> List[PaymentSchedule]:
+        written.clear()
+        db.disbursements.insert_one(with_id(dict(disbursement_doc)), session=session)
+        written["disbursement"] = True
+        
+        # Only an application that is still approved moves on
+        updated = db.finance_applications.update_one(
+            {**by_id(application_id), "status": ApplicationStatus.APPROVED.value},
+            {"$set": {"status": ApplicationStatus.DISBURSED.value, **application_change_fields(change_seq)}},
+            session=session
+        )
+        if not updated.modified_count:
+            raise HTTPException(status_code=400, detail="Application is not approved for disbursement")
+        written["status"] = True
+        
+        written["reserved"] = reserve_funds(disbursement_amount, current_user["id"], session)
+        written["schedule"] = True
+        return generate_payment_schedule(
+            application_id=application_id,
+            disbursement_id=disbursement_id,
+            user_id=application["user_id"],
+            principal_amount=disbursement_amount,
+            duration_months=application["requested_duration_months"],
+            session=session
+        )
     
-    # Update application status
-    db.finance_applications.update_one(
-        {"id": application_id},
-        {"$set": {"status": ApplicationStatus.DISBURSED.value}}
-    )
+    def rollback():
+        if written.get("schedule"):
+            db[SCHEDULE_COLLECTIONS[SCHEDULE_LAYOUT]].delete_many({"disbursement_id": disbursement_id})
+        if written.get("reserved"):
+            release_funds(written["reserved"], current_user["id"])
+        if written.get("status"):
+            with application_changes() as undo_seq:
+                db.finance_applications.update_one(
+                    {**by_id(application_id), "status": ApplicationStatus.DISBURSED.value},
+                    {"$set": {"status": ApplicationStatus.APPROVED.value, **application_change_fields(undo_seq)}}
+                )
+        if written.get("disbursement"):
+            db.disbursements.delete_one(by_id(disbursement_id))
     
-    # Update fund pool
-    update_fund_pool(
-        disbursement_amount=disbursement_amount,
-        updated_by=current_user["id"]
-    )
+    try:
+        with application_changes() as change_seq:
+            payment_schedules = run_in_transaction(write, rollback)
+    except DuplicateKeyError:
+        raise HTTPException(status_code=400, detail="Application has already been disbursed")
     
-    # Generate payment schedule
-    payment_schedules = generate_payment_schedule(
-        application_id=application_id,
-        disbursement_id=disbursement_id,
-        user_id=application["user_id"],
-        principal_amount=disbursement_amount,
-        duration_months=application["requested_duration_months"]
-    )
+    applicant = get_user(db, application["user_id"], USER_COUNTRY)
+    record_rollups([(
+        RollupMetric.DISBURSEMENTS.value,
+        disbursement_doc["disbursement_date"],
+        applicant.get("country") if applicant else None,
+        disbursement_amount
+    )])
+    increment_member_stats(application["user_id"], {
+        **application_status_deltas(application["status"], ApplicationStatus.DISBURSED.value),
+        "outstanding_principal": disbursement_amount
+    })
+    # Guarantees cover the disbursed amount, not the requested one
+    guarantor_ids = set_guarantee_exposure([application_id], disbursed_share(application, disbursement_amount))
+    
+    def announce():
+        emit_event(disbursement_event, disbursement_doc)
+        # The reservation already moved the funds
+        publish_fund_pool()
+        bump_versions(
+            user_version(application["user_id"]),
+            *[user_version(guarantor_user_id) for guarantor_user_id in guarantor_ids],
+            "data",
+            "portfolio"
+        )
+    
+    if background_tasks is None:
+        announce()
+    else:
+        background_tasks.add_task(announce)
     
     return {
         "disbursement": Disbursement(**disbursement_doc),
@@ -1217,147 +4228,415 @@ async def disburse_application(
         "fund_pool": get_fund_pool()
     }
 
-@app.get("/api/admin/disbursements")
-async def get_disbursements(current_user = Depends(require_role([UserRole.FUND_ADMIN, UserRole.GENERAL_ADMIN]))):
+@app.get("/api/admin/disbursements", dependencies=[Depends(route_class("admin_lists"))])
+def get_disbursements(current_user = Depends(require_role([UserRole.FUND_ADMIN, UserRole.GENERAL_ADMIN]))):
     """Get all disbursements"""
     disbursements = list(db.disbursements.find({}, {"_id": 0}).sort("disbursement_date", -1))
-    
-    # Add application details
-    for disbursement in disbursements:
-        application = db.finance_applications.find_one({"id": disbursement["application_id"]}, {"_id": 0})
-        if application:
-            applicant = db.users.find_one({"id": application["user_id"]}, {"password_hash": 0, "_id": 0})
-            disbursement["application_details"] = {
-                "purpose": application["purpose"],
-                "applicant_name": applicant["full_name"] if applicant else "Unknown"
-            }
-    
     return [Disbursement(**d) for d in disbursements]
 
-@app.get("/api/admin/ready-for-disbursement")
-async def get_ready_for_disbursement(current_user = Depends(require_role([UserRole.FUND_ADMIN, UserRole.GENERAL_ADMIN]))):
-    """Get applications ready for disbursement"""
-    
-    # Find approved applications that haven't been disbursed yet
-    approved_applications = list(db.finance_applications.find({"status": "approved"}))
-    ready_applications = []
+def plan_disbursements(amounts: List[float], budget: float, strategy: str = "greedy") -> List[int]:
+    """Pick which candidates to fund within the budget. Returns their indexes.
+
+    Candidates must already be in priority order. ``greedy`` walks that order
+    and funds every loan that still fits. ``optimal`` solves the 0/1 knapsack
+    that disburses as much of the budget as possible, preferring earlier
+    candidates on ties. The knapsack rounds amounts up to budget cells, so
+    loans that still fit the exact leftover budget are then added in order.
+    """
+    if budget <= 0:
+        return []
+    
+    if strategy == PlanStrategy.GREEDY.value:
+        selected = []
+        remaining = budget
+        for index, amount in enumerate(amounts):
+            if amount <= remaining:
+                selected.append(index)
+                remaining -= amount
+        return selected
+    
+    step = max(1.0, budget / PLAN_MAX_BUDGET_CELLS)
+    cells = int(budget // step)
+    eligible = [index for index, amount in enumerate(amounts) if 0 < amount <= budget]
+    weights = [math.ceil(amounts[index] / step - 1e-9) for index in eligible]
+    
+    # best[c] is the largest total amount that fits in c cells. Items go in
+    # priority order and only replace a solution they strictly improve, so
+    # backtracking from the last item keeps the higher priority loans on ties.
+    best = np.zeros(cells + 1)
+    taken = []
+    for index, weight in zip(eligible, weights):
+        improved = np.zeros(cells + 1, dtype=bool)
+        if weight <= cells:
+            candidate = best[:cells + 1 - weight] + amounts[index]
+            improved[weight:] = candidate > best[weight:] + 1e-9
+            best[weight:] = np.where(improved[weight:], candidate, best[weight:])
+        taken.append(np.packbits(improved))
+    
+    selected = set()
+    cell = int(np.argmax(best))
+    for position in reversed(range(len(eligible))):
+        if (taken[position][cell >> 3] >> (7 - (cell & 7))) & 1:
+            selected.add(eligible[position])
+            cell -= weights[position]
+    
+    remaining = budget - sum(amounts[index] for index in selected)
+    for index in eligible:
+        if index not in selected and amounts[index] <= remaining:
+            selected.add(index)
+            remaining -= amounts[index]
+    return sorted(selected)
+
+def get_disbursement_candidates() -> List[dict]:
+    """Approved, undisbursed applications in priority order, with guarantor status"""
+    approved_applications = find_applications(
+        db, {"status": "approved"}, {"_id": 0}, sort=[("priority_score", -1), ("created_at", 1)]
+    )
+    application_ids = [app["id"] for app in approved_applications]
+    disbursed_ids = {
+        disbursement["application_id"]
+        for disbursement in db.disbursements.find({"application_id": {"$in": application_ids}}, {"application_id": 1})
+    }
+    candidates = [app for app in approved_applications if app["id"] not in disbursed_ids]
+    acceptance = check_guarantor_acceptance_bulk([app["id"] for app in candidates])
+    applicants = get_applicants(candidates)
     
-    for app in approved_applications:
-        # Check if already disbursed
-        existing_disbursement = db.disbursements.find_one({"application_id": app["id"]})
-        if existing_disbursement:
-            continue
-        
-        # Check guarantor acceptance
-        guarantors_accepted, message = check_guarantor_acceptance(app["id"])
-        
-        # Add application info
-        applicant = db.users.find_one({"id": app["user_id"]}, {"password_hash": 0})
+    for app in candidates:
+        guarantors_accepted, message = acceptance[app["id"]]
+        applicant = applicants.get(app["user_id"])
         app["applicant_name"] = applicant["full_name"] if applicant else "Unknown"
         app["applicant_country"] = applicant["country"] if applicant else "Unknown"
         app["guarantors_status"] = "All Accepted" if guarantors_accepted else message
         app["ready_for_disbursement"] = guarantors_accepted
-        app["disbursement_amount"] = app.get("approved_amount", app["amount"])
-        
-        ready_applications.append(app)
+        app["disbursement_amount"] = app.get("approved_amount") or app["amount"]
     
-    return ready_applications
+    return candidates
+
+@app.get("/api/admin/ready-for-disbursement", dependencies=[Depends(route_class("admin_lists"))])
+def get_ready_for_disbursement(current_user = Depends(require_role([UserRole.FUND_ADMIN, UserRole.GENERAL_ADMIN]))):
+    """Get applications ready for disbursement"""
+    return get_disbursement_candidates()
+
+@app.get("/api/admin/disbursement-plan", dependencies=[Depends(route_class("exports"))])
+def get_disbursement_plan(
+    strategy: PlanStrategy = PlanStrategy.GREEDY,
+    reserve_floor: float = 0.0,
+    current_user = Depends(require_role([UserRole.FUND_ADMIN, UserRole.GENERAL_ADMIN]))
+):
+    """Which ready applications the available balance can cover, and the shortfall for the rest"""
+    if reserve_floor < 0:
+        raise HTTPException(status_code=400, detail="reserve_floor cannot be negative")
+    
+    candidates = get_disbursement_candidates()
+    ready = [app for app in candidates if app["ready_for_disbursement"]]
+    fund_pool = get_fund_pool()
+    budget = max(0.0, fund_pool.available_balance - reserve_floor)
+    
+    selected = set(plan_disbursements([app["disbursement_amount"] for app in ready], budget, strategy.value))
+    funded_total = round(sum(ready[index]["disbursement_amount"] for index in selected), 2)
+    remaining_budget = round(budget - funded_total, 2)
+    
+    def plan_entry(app):
+        return {
+            "application_id": app["id"],
+            "applicant_name": app["applicant_name"],
+            "applicant_country": app["applicant_country"],
+            "amount": app["disbursement_amount"],
+            "priority_score": app.get("priority_score") or 0,
+            "created_at": app["created_at"]
+        }
+    
+    funded = [plan_entry(app) for index, app in enumerate(ready) if index in selected]
+    unfunded = [
+        {**plan_entry(app), "shortfall": round(max(0.0, app["disbursement_amount"] - remaining_budget), 2)}
+        for index, app in enumerate(ready) if index not in selected
+    ]
+    unfunded_total = round(sum(entry["amount"] for entry in unfunded), 2)
+    
+    return {
+        "strategy": strategy.value,
+        "available_balance": fund_pool.available_balance,
+        "reserve_floor": reserve_floor,
+        "budget": round(budget, 2),
+        "funded": funded,
+        "funded_total": funded_total,
+        "remaining_budget": remaining_budget,
+        "unfunded": unfunded,
+        "unfunded_total": unfunded_total,
+        "shortfall": round(max(0.0, unfunded_total - remaining_budget), 2),
+        "blocked": [
+            {"application_id": app["id"], "amount": app["disbursement_amount"], "reason": app["guarantors_status"]}
+            for app in candidates if not app["ready_for_disbursement"]
+        ]
+    }
 
 @app.get("/api/payment-schedules")
-async def get_payment_schedules(current_user = Depends(get_current_user)):
+async def get_payment_schedules(
+    request: Request,
+    response: Response,
+    include_archived: bool = False,
+    current_user = Depends(get_current_user)
+):
     """Get payment schedules for current user"""
-    schedules = list(db.payment_schedules.find({"user_id": current_user["id"]}, {"_id": 0}).sort("due_date", 1))
-    
-    # Add application details
-    for schedule in schedules:
-        application = db.finance_applications.find_one({"id": schedule["application_id"]}, {"_id": 0})
-        if application:
-            schedule["application_purpose"] = application["purpose"]
+    etag_scope = f"payment-schedules-{current_user['id']}" + ("-archived" if include_archived else "")
+    not_modified = check_etag(request, response, etag_scope, [user_version(current_user["id"])])
+    if not_modified:
+        return not_modified
     
+    schedules = find_installments({"user_id": current_user["id"]}, include_archived=include_archived)
     return [PaymentSchedule(**s) for s in schedules]
 
+@app.post("/api/admin/repayments")
+async def create_repayment(
+    repayment: RepaymentCreate,
+    current_user = Depends(require_role([UserRole.FUND_ADMIN, UserRole.GENERAL_ADMIN]))
+):
+    """Record a repayment against a member's outstanding installments"""
+    member = get_user(db, repayment.user_id, USER_ID)
+    if not member:
+        raise HTTPException(status_code=404, detail="User not found")
+    
+    result = post_repayments(
+        [repayment.model_dump()],
+        posted_by=current_user["id"],
+        source="manual"
+    )
+    if result["conflicts"]:
+        raise HTTPException(status_code=409, detail="Installments changed while posting the repayment; please retry")
+    if result["duplicates"]:
+        raise HTTPException(status_code=400, detail="Repayment reference has already been posted")
+    
+    return {
+        "repayment": RepaymentPosting(**result["postings"][0]),
+        "fund_pool": get_fund_pool()
+    }
+
+@app.post("/api/admin/repayments/import")
+def import_repayment_statement(
+    file: UploadFile = File(...),
+    current_user = Depends(require_role([UserRole.FUND_ADMIN, UserRole.GENERAL_ADMIN]))
+):
+    """Post a CSV or NDJSON bank statement of repayments in chunked transactions"""
+    # Declared sync so large statement files are processed in the threadpool
+    rows, errors = parse_repayment_statement(file.file.read(), file.filename)
+    lines_received = len(rows) + len(errors)
+    
+    # Resolve members by id or email with a single query
+    user_ids = list({row["user_id"] for row in rows if row["user_id"]})
+    emails = list({row["email"] for row in rows if row["email"] and not row["user_id"]})
+    known_user_ids = set()
+    user_ids_by_email = {}
+    for member in find_users(
+        db, {"$or": [by_id({"$in": user_ids}), {"email": {"$in": emails}}]}, {"_id": 0, "id": 1, "email": 1}
+    ):
+        known_user_ids.add(member["id"])
+        user_ids_by_email[member["email"]] = member["id"]
+    
+    payments = []
+    for row in rows:
+        user_id = row["user_id"] or user_ids_by_email.get(row["email"])
+        if user_id not in known_user_ids:
+            errors.append({"line": row["line"], "error": "Member not found"})
+            continue
+        payments.append({**row, "user_id": user_id})
+    
+    result = post_repayments(payments, posted_by=current_user["id"], source="statement")
+    
+    return {
+        "lines_received": lines_received,
+        "posted": len(result["postings"]),
+        "schedules_updated": result["schedules_updated"],
+        "total_allocated": result["total_allocated"],
+        "total_unallocated": result["total_unallocated"],
+        "unallocated": [
+            {"line": p["line"], "user_id": p["user_id"], "amount": p["unallocated_amount"]}
+            for p in result["postings"] if p["unallocated_amount"] > 0
+        ],
+        "duplicates": result["duplicates"],
+        # Lines whose loans kept changing underneath; posting them again is safe
+        "conflicts": result["conflicts"],
+        "errors": sorted(errors, key=lambda e: e["line"]),
+        "fund_pool": get_fund_pool()
+    }
+
 @app.get("/api/admin/fund-pool")
-async def get_fund_pool_status(current_user = Depends(require_role([UserRole.FUND_ADMIN, UserRole.GENERAL_ADMIN]))):
+async def get_fund_pool_status(
+    request: Request,
+    response: Response,
+    current_user = Depends(require_role([UserRole.FUND_ADMIN, UserRole.GENERAL_ADMIN]))
+):
     """Get current fund pool status"""
+    not_modified = check_etag(request, response, "fund-pool", ["fund_pool"])
+    if not_modified:
+        return not_modified
+    
     return get_fund_pool()
 
 @app.post("/api/admin/fund-pool/recalculate")
-async def recalculate_fund_pool(current_user = Depends(require_role([UserRole.GENERAL_ADMIN]))):
+def recalculate_fund_pool(
+    background: bool = False,
+    current_user = Depends(require_role([UserRole.GENERAL_ADMIN]))
+):
     """Recalculate fund pool based on actual data"""
-    
-    # Calculate total deposits
-    total_deposits_result = db.deposits.aggregate([
-        {"$match": {"status": "completed"}},
-        {"$group": {"_id": None, "total": {"$sum": "$amount"}}}
-    ])
-    total_deposits_list = list(total_deposits_result)
-    total_deposits = total_deposits_list[0]["total"] if total_deposits_list else 0
-    
-    # Calculate total disbursed
-    total_disbursed_result = db.disbursements.aggregate([
-        {"$match": {"status": "disbursed"}},
-        {"$group": {"_id": None, "total": {"$sum": "$disbursed_amount"}}}
-    ])
-    total_disbursed_list = list(total_disbursed_result)
-    total_disbursed = total_disbursed_list[0]["total"] if total_disbursed_list else 0
-    
-    # Calculate total repaid
-    total_repaid_result = db.payment_schedules.aggregate([
-        {"$match": {"status": "paid"}},
-        {"$group": {"_id": None, "total": {"$sum": "$paid_amount"}}}
-    ])
-    total_repaid_list = list(total_repaid_result)
-    total_repaid = total_repaid_list[0]["total"] if total_repaid_list else 0
-    
-    # Update fund pool with calculated values
-    available_balance = total_deposits + total_repaid - total_disbursed
-    total_receivables = total_disbursed - total_repaid
-    
-    update_data = {
-        "total_deposits": total_deposits,
-        "total_disbursed": total_disbursed,
-        "total_repaid": total_repaid,
-        "available_balance": available_balance,
-        "total_receivables": total_receivables,
-        "last_updated": datetime.utcnow(),
-        "updated_by": current_user["id"]
+    if background:
+        return submit_job("recalculate_fund_pool", {}, current_user)
+    return recalculate_fund_pool_totals(current_user["id"])
+
+@app.post("/api/admin/archive/run")
+def run_archive(
+    older_than_days: int = ARCHIVE_AFTER_DAYS,
+    background: bool = False,
+    current_user = Depends(require_role([UserRole.GENERAL_ADMIN]))
+):
+    """Move loans closed more than ``older_than_days`` ago into the archive collections"""
+    if older_than_days < 1:
+        raise HTTPException(status_code=400, detail="older_than_days must be at least 1")
+    if background:
+        return submit_job("archive", {"older_than_days": older_than_days}, current_user)
+    
+    archived = run_archival(older_than_days)
+    return {"message": "Archival completed", "older_than_days": older_than_days, "archived": archived}
+
+@app.post("/api/admin/rollups/rebuild")
+def rebuild_rollups_endpoint(
+    background: bool = False,
+    current_user = Depends(require_role([UserRole.GENERAL_ADMIN]))
+):
+    """Recompute the daily money movement rollups from deposits, disbursements and repayments"""
+    if background:
+        return submit_job("rebuild_daily_rollups", {}, current_user)
+    rebuilt = rebuild_daily_rollups()
+    bump_versions("data")
+    return {"message": "Daily rollups rebuilt", "rows": rebuilt}
+
+@app.get("/api/admin/reports/money-movement", dependencies=[Depends(route_class("exports"))])
+def get_money_movement_report(
+    start: date,
+    end: date,
+    metric: Optional[RollupMetric] = None,
+    granularity: ReportGranularity = ReportGranularity.MONTH,
+    country: Optional[str] = None,
+    current_user = Depends(require_role([UserRole.COUNTRY_COORDINATOR, UserRole.FUND_ADMIN, UserRole.GENERAL_ADMIN]))
+):
+    """Deposits, disbursements and repayments per country and period, from the daily rollups.
+
+    ``start`` and ``end`` are inclusive UTC dates. Country coordinators only see their own country.
+    """
+    if start > end:
+        raise HTTPException(status_code=400, detail="start must not be after end")
+    if current_user["role"] == UserRole.COUNTRY_COORDINATOR.value:
+        country = current_user["country"]
+    
+    metrics = [metric.value] if metric else [m.value for m in RollupMetric]
+    query = {
+        "metric": {"$in": metrics},
+        "day": {"$gte": datetime.combine(start, datetime.min.time()), "$lte": datetime.combine(end, datetime.min.time())}
     }
+    if country:
+        query["country"] = country
+    
+    rows = {}
+    totals = {m: 0.0 for m in metrics}
+    for rollup in read_db("analytics").daily_rollups.find(query, {"_id": 0, "metric": 1, "day": 1, "country": 1, "total": 1, "count": 1}):
+        key = (rollup_period(rollup["day"], granularity.value), rollup["country"], rollup["metric"])
+        row = rows.setdefault(key, {
+            "period": key[0], "country": key[1], "metric": key[2], "total": 0.0, "count": 0
+        })
+        row["total"] += rollup["total"]
+        row["count"] += rollup["count"]
+        totals[rollup["metric"]] += rollup["total"]
+    
+    for row in rows.values():
+        row["total"] = round(row["total"], 2)
     
-    db.fund_pool.update_one(
-        {"id": "fund_pool"},
-        {"$set": update_data},
-        upsert=True
-    )
-    
-    return get_fund_pool()
+    return {
+        "start": start,
+        "end": end,
+        "granularity": granularity.value,
+        "country": country,
+        "rows": [rows[key] for key in sorted(rows)],
+        "totals": {m: round(total, 2) for m, total in totals.items()}
+    }
+
+@app.post("/api/admin/member-stats/rebuild")
+def rebuild_member_stats_endpoint(
+    background: bool = False,
+    current_user = Depends(require_role([UserRole.GENERAL_ADMIN]))
+):
+    """Rebuild per-member stats from deposits, applications, loans and guarantees"""
+    if background:
+        return submit_job("rebuild_member_stats", {}, current_user)
+    rebuilt = rebuild_member_stats()
+    bump_versions("epoch")
+    return {"message": "Member stats rebuilt", "users": rebuilt}
+
+@app.post("/api/admin/credit-scores/rebuild")
+def rescore_members_endpoint(
+    background: bool = False,
+    current_user = Depends(require_role([UserRole.GENERAL_ADMIN]))
+):
+    """Recompute member credit scores from repayment history"""
+    if background:
+        return submit_job("rescore_members", {}, current_user)
+    return {"message": "Credit scores rebuilt", "members": rescore_members()}
+
+@app.post("/api/admin/jobs")
+def create_job(
+    job_request: JobCreate,
+    current_user = Depends(require_role([UserRole.FUND_ADMIN, UserRole.GENERAL_ADMIN]))
+):
+    """Queue a background job; poll GET /api/admin/jobs/{id} or watch job_updated events"""
+    if job_request.type not in job_runner.job_types:
+        raise HTTPException(status_code=400, detail=f"Unknown job type: {job_request.type}")
+    allowed_roles = JOB_ROLES.get(job_request.type, [UserRole.GENERAL_ADMIN])
+    if UserRole(current_user["role"]) not in allowed_roles:
+        raise HTTPException(status_code=403, detail="Not enough permissions")
+    
+    return submit_job(job_request.type, job_request.params, current_user)
+
+@app.get("/api/admin/jobs")
+def list_jobs(
+    job_status: Optional[str] = Query(default=None, alias="status"),
+    type: Optional[str] = None,
+    limit: int = 50,
+    current_user = Depends(require_role([UserRole.FUND_ADMIN, UserRole.GENERAL_ADMIN]))
+):
+    """Most recent jobs first"""
+    query = {}
+    if job_status:
+        query["status"] = job_status
+    if type:
+        query["type"] = type
+    return list(db.jobs.find(query, {"_id": 0}).sort("created_at", -1).limit(min(max(limit, 1), 200)))
+
+@app.get("/api/admin/jobs/{job_id}")
+def get_job(job_id: str, current_user = Depends(require_role([UserRole.FUND_ADMIN, UserRole.GENERAL_ADMIN]))):
+    job = job_runner.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
 
 # Dashboard functions (updated with approval workflow data)
-async def get_member_dashboard(current_user):
+def get_member_dashboard(current_user):
     config = get_system_config()
+    stats = get_member_stats(current_user["id"])
     
     # Calculate dashboard metrics
-    total_deposits = db.deposits.aggregate([
-        {"$match": {"user_id": current_user["id"]}},
-        {"$group": {"_id": None, "total": {"$sum": "$amount"}}}
-    ])
-    total_deposits = list(total_deposits)
-    total_deposits = total_deposits[0]["total"] if total_deposits else 0
+    total_deposits = stats["total_deposits"]
     
     # Check guarantor eligibility
-    is_eligible_guarantor, _ = check_guarantor_eligibility(current_user["id"])
+    is_eligible_guarantor, _ = check_guarantor_eligibility(current_user["id"], stats, config)
     
     # Total applications
-    total_applications = db.finance_applications.count_documents({"user_id": current_user["id"]})
+    total_applications = stats["total_applications"]
     
     # Applications by status
-    pending_applications = db.finance_applications.count_documents({
-        "user_id": current_user["id"], 
-        "status": {"$in": ["pending", "under_review", "requires_higher_approval"]}
-    })
-    approved_applications = db.finance_applications.count_documents({
-        "user_id": current_user["id"], 
-        "status": "approved"
-    })
+    application_counts = stats["application_counts"]
+    pending_applications = sum(
+        application_counts.get(pending_status, 0)
+        for pending_status in ["pending", "under_review", "requires_higher_approval"]
+    )
+    approved_applications = application_counts.get("approved", 0)
     
     # Pending guarantor requests
     pending_guarantor_requests = db.guarantors.count_documents({
@@ -1375,7 +4654,7 @@ async def get_member_dashboard(current_user):
     
     # Recent activity
     recent_deposits = list(db.deposits.find({"user_id": current_user["id"]}).sort("created_at", -1).limit(3))
-    recent_applications = list(db.finance_applications.find({"user_id": current_user["id"]}).sort("created_at", -1).limit(3))
+    recent_applications = find_applications(db, {"user_id": current_user["id"]}, sort=[("created_at", -1)], limit=3)
     
     return {
         "role": "member",
@@ -1384,6 +4663,8 @@ async def get_member_dashboard(current_user):
         "pending_applications": pending_applications,
         "approved_applications": approved_applications,
         "pending_repayments": pending_repayments,
+        "outstanding_principal": stats["outstanding_principal"],
+        "guarantee_exposure": stats["guarantee_exposure"],
         "is_eligible_guarantor": is_eligible_guarantor,
         "minimum_deposit_for_guarantor": config.minimum_deposit_for_guarantor,
         "pending_guarantor_requests": pending_guarantor_requests,
@@ -1391,32 +4672,32 @@ async def get_member_dashboard(current_user):
         "recent_applications": [FinanceApplication(**app) for app in recent_applications]
     }
 
-async def get_country_coordinator_dashboard(current_user):
+def get_country_coordinator_dashboard(current_user, session=None):
     country = current_user["country"]
     config = get_system_config()
+    rdb = read_db("analytics")
     
     # Country statistics
-    country_members = db.users.count_documents({"country": country, "role": "member"})
+    country_members = rdb.users.count_documents({"country": country, "role": "member"}, session=session)
     
     # Applications requiring approval at this level
-    country_users = [user["id"] for user in db.users.find({"country": country})]
-    pending_approval = db.finance_applications.count_documents({
+    country_users = country_user_ids(rdb, country, session)
+    pending_approval = rdb.finance_applications.count_documents({
         "user_id": {"$in": country_users},
         "status": {"$in": ["pending", "under_review"]},
         "amount": {"$lte": config.country_coordinator_limit}
-    })
+    }, session=session)
     
     # Applications requiring higher approval
-    needs_escalation = db.finance_applications.count_documents({
+    needs_escalation = rdb.finance_applications.count_documents({
         "user_id": {"$in": country_users},
         "status": "requires_higher_approval"
-    })
+    }, session=session)
     
-    total_deposits_in_country = db.deposits.aggregate([
-        {"$lookup": {"from": "users", "localField": "user_id", "foreignField": "id", "as": "user"}},
-        {"$match": {"user.country": country}},
-        {"$group": {"_id": None, "total": {"$sum": "$amount"}}}
-    ])
+    total_deposits_in_country = rdb.daily_rollups.aggregate([
+        {"$match": {"metric": RollupMetric.DEPOSITS.value, "country": country}},
+        {"$group": {"_id": None, "total": {"$sum": "$total"}}}
+    ], session=session)
     total_deposits_in_country = list(total_deposits_in_country)
     total_deposits_in_country = total_deposits_in_country[0]["total"] if total_deposits_in_country else 0
     
@@ -1430,39 +4711,42 @@ async def get_country_coordinator_dashboard(current_user):
         "approval_limit": config.country_coordinator_limit
     }
 
-async def get_fund_admin_dashboard(current_user):
+def get_fund_admin_dashboard(current_user, session=None):
     config = get_system_config()
+    rdb = read_db("analytics")
     
     # System-wide statistics
-    total_members = db.users.count_documents({"role": "member"})
-    total_applications = db.finance_applications.count_documents({})
+    total_members = rdb.users.count_documents({"role": "member"}, session=session)
+    total_applications = rdb.finance_applications.count_documents({}, session=session) + \
+        rdb[ARCHIVE_COLLECTIONS["finance_applications"]].count_documents({}, session=session)
     
     # Applications requiring fund admin approval
-    pending_approval = db.finance_applications.count_documents({
+    pending_approval = rdb.finance_applications.count_documents({
         "status": {"$in": ["pending", "under_review", "requires_higher_approval"]},
         "amount": {"$lte": config.fund_admin_limit}
-    })
+    }, session=session)
     
     # High-value applications
-    high_value_applications = db.finance_applications.count_documents({
+    high_value_applications = rdb.finance_applications.count_documents({
         "status": {"$in": ["pending", "under_review", "requires_higher_approval"]},
         "amount": {"$gt": config.country_coordinator_limit}
-    })
+    }, session=session)
     
     # Approved applications ready for disbursement
-    ready_for_disbursement = db.finance_applications.count_documents({"status": "approved"})
+    ready_for_disbursement = rdb.finance_applications.count_documents({"status": "approved"}, session=session)
     
-    total_fund_value = db.deposits.aggregate([
+    total_fund_value = rdb.deposits.aggregate([
         {"$group": {"_id": None, "total": {"$sum": "$amount"}}}
-    ])
+    ], session=session)
     total_fund_value = list(total_fund_value)
     total_fund_value = total_fund_value[0]["total"] if total_fund_value else 0
     
     # Disbursement statistics
-    disbursed_amount = db.finance_applications.aggregate([
+    disbursed_amount = rdb.finance_applications.aggregate([
+        archive_union("finance_applications"),
         {"$match": {"status": "disbursed"}},
         {"$group": {"_id": None, "total": {"$sum": "$amount"}}}
-    ])
+    ], session=session)
     disbursed_amount = list(disbursed_amount)
     disbursed_amount = disbursed_amount[0]["total"] if disbursed_amount else 0
     
@@ -1478,62 +4762,69 @@ async def get_fund_admin_dashboard(current_user):
         "approval_limit": config.fund_admin_limit
     }
 
-async def get_general_admin_dashboard(current_user):
+def get_general_admin_dashboard(current_user, session=None):
     config = get_system_config()
+    rdb = read_db("analytics")
     
     # Complete system overview
-    total_users = db.users.count_documents({})
-    role_distribution = list(db.users.aggregate([
+    total_users = rdb.users.count_documents({}, session=session)
+    role_distribution = list(rdb.users.aggregate([
         {"$group": {"_id": "$role", "count": {"$sum": 1}}}
-    ]))
+    ], session=session))
     
-    country_distribution = list(db.users.aggregate([
+    country_distribution = list(rdb.users.aggregate([
         {"$group": {"_id": "$country", "count": {"$sum": 1}}},
         {"$sort": {"count": -1}},
         {"$limit": 10}
-    ]))
+    ], session=session))
     
     # Financial overview
-    total_deposits = db.deposits.aggregate([
+    total_deposits = rdb.deposits.aggregate([
         {"$group": {"_id": None, "total": {"$sum": "$amount"}}}
-    ])
+    ], session=session)
     total_deposits = list(total_deposits)
     total_deposits = total_deposits[0]["total"] if total_deposits else 0
     
     # Application status overview
-    application_stats = list(db.finance_applications.aggregate([
+    application_stats = list(rdb.finance_applications.aggregate([
+        archive_union("finance_applications"),
         {"$group": {"_id": "$status", "count": {"$sum": 1}, "total_amount": {"$sum": "$amount"}}}
-    ]))
+    ], session=session))
     
     # Approval workflow statistics
-    approval_stats = list(db.approval_history.aggregate([
+    approval_stats = list(rdb.approval_history.aggregate([
+        archive_union("approval_history"),
         {"$group": {"_id": "$action", "count": {"$sum": 1}}}
-    ]))
+    ], session=session))
     
     # Applications requiring general admin approval
-    pending_high_value = db.finance_applications.count_documents({
+    pending_high_value = rdb.finance_applications.count_documents({
         "status": {"$in": ["requires_higher_approval"]},
         "amount": {"$gt": config.fund_admin_limit}
-    })
+    }, session=session)
     
     # Priority system statistics
-    priority_stats = list(db.finance_applications.aggregate([
+    priority_stats = list(rdb.finance_applications.aggregate([
+        archive_union("finance_applications"),
         {"$group": {
             "_id": None,
             "avg_priority": {"$avg": "$priority_score"},
             "max_priority": {"$max": "$priority_score"},
             "min_priority": {"$min": "$priority_score"}
         }}
-    ]))
+    ], session=session))
     
     # Guarantor statistics
-    guarantor_stats = list(db.guarantors.aggregate([
+    guarantor_stats = list(rdb.guarantors.aggregate([
+        archive_union("guarantors"),
         {"$group": {"_id": "$status", "count": {"$sum": 1}}}
-    ]))
+    ], session=session))
     
     # Recent system activity
-    recent_users = list(db.users.find({}, {"password_hash": 0}).sort("created_at", -1).limit(5))
-    recent_applications = list(db.finance_applications.find({}).sort([("priority_score", -1), ("created_at", -1)]).limit(5))
+    recent_users = find_users(rdb, {}, USER_PROFILE, sort=[("created_at", -1)], limit=5, session=session)
+    recent_applications = find_applications(
+        rdb, {}, sort=[("priority_score", -1), ("created_at", -1)], limit=5, session=session
+    )
     
     # Ensure all fields exist in recent applications
     for app in recent_applications:
@@ -1567,125 +4858,248 @@ async def get_general_admin_dashboard(current_user):
     }
 
 # Admin endpoints (updated for approval workflow)
-@app.get("/api/admin/users")
-async def get_all_users(current_user = Depends(require_role([UserRole.GENERAL_ADMIN, UserRole.FUND_ADMIN]))):
-    users = list(db.users.find({}, {"password_hash": 0}).sort("created_at", -1))
+@app.get("/api/admin/users", dependencies=[Depends(route_class("admin_lists"))])
+def get_all_users(current_user = Depends(require_role([UserRole.GENERAL_ADMIN, UserRole.FUND_ADMIN]))):
+    users = find_users(db, {}, USER_PROFILE, sort=[("created_at", -1)])
+    config = get_system_config()
+    stats_map = get_member_stats_map([user["id"] for user in users])
     
     # Add guarantor eligibility to each user
     for user in users:
-        is_eligible, total_deposits = check_guarantor_eligibility(user["id"])
+        is_eligible, total_deposits = check_guarantor_eligibility(user["id"], stats_map[user["id"]], config)
         user["is_eligible_guarantor"] = is_eligible
         user["total_deposits"] = total_deposits
     
     return [User(**{**user, "is_eligible_guarantor": user["is_eligible_guarantor"], "total_deposits": user["total_deposits"]}) for user in users]
 
+@app.get("/api/admin/search", dependencies=[Depends(route_class("admin_lists"))])
+def search(
+    q: str,
+    kind: SearchKind = SearchKind.ALL,
+    page: int = 1,
+    page_size: int = 20,
+    include_archived: bool = False,
+    current_user = Depends(require_role([UserRole.COUNTRY_COORDINATOR, UserRole.FUND_ADMIN, UserRole.GENERAL_ADMIN]))
+):
+    """Ranked prefix search over members and applications.
+
+    Every query word must match the start of a word in the name, email or
+    country of a member, or the purpose, description or applicant of an
+    application. Country coordinators only see their own country.
+    """
+    if page < 1 or page_size < 1 or page_size > SEARCH_MAX_PAGE_SIZE:
+        raise HTTPException(status_code=400, detail=f"page must be >= 1 and page_size between 1 and {SEARCH_MAX_PAGE_SIZE}")
+    
+    query_tokens = search_tokens(q)[:SEARCH_MAX_QUERY_TOKENS]
+    if not query_tokens:
+        raise HTTPException(status_code=400, detail="Search query must contain letters or digits")
+    
+    # Anchored prefix regexes on the multikey tokens field use the index bounds
+    query = {"$and": [{"tokens": re.compile(f"^{re.escape(token)}")} for token in query_tokens]}
+    if kind != SearchKind.ALL:
+        query["kind"] = "user" if kind == SearchKind.USERS else "application"
+    if current_user["role"] == UserRole.COUNTRY_COORDINATOR.value:
+        query["country"] = current_user["country"]
+    if not include_archived:
+        query["archived"] = {"$ne": True}
+    
+    matches = list(db.search_index.find(query, {"_id": 0, "updated_at": 0}).limit(SEARCH_CANDIDATE_LIMIT))
+    for match in matches:
+        match["score"] = search_score(match, query_tokens)
+    matches.sort(key=lambda match: (-match["score"], match["kind"], (match.get("title") or "").lower()))
+    page_matches = matches[(page - 1) * page_size:page * page_size]
+    
+    user_ids = [match["ref_id"] for match in page_matches if match["kind"] == "user"]
+    application_ids = [match["ref_id"] for match in page_matches if match["kind"] == "application"]
+    users = users_by_ids(db, user_ids, {"_id": 0, "id": 1, "full_name": 1, "email": 1, "country": 1, "role": 1})
+    applications = {
+        app["id"]: app
+        for app in find_with_archive(
+            "finance_applications",
+            by_id({"$in": application_ids}),
+            {"_id": 0, "id": 1, "user_id": 1, "amount": 1, "status": 1, "purpose": 1, "created_at": 1},
+            include_archived=include_archived
+        )
+    }
+    applicants = get_applicants(list(applications.values()))
+    
+    results = []
+    for match in page_matches:
+        if match["kind"] == "user":
+            item = users.get(match["ref_id"])
+        else:
+            item = applications.get(match["ref_id"])
+            if item:
+                applicant = applicants.get(item["user_id"])
+                item["applicant_name"] = applicant["full_name"] if applicant else "Unknown"
+        if item:
+            results.append({"kind": match["kind"], "id": match["ref_id"], "score": match["score"], "item": item})
+    
+    return {
+        "query": q,
+        "total": len(matches),
+        "truncated": len(matches) >= SEARCH_CANDIDATE_LIMIT,
+        "page": page,
+        "page_size": page_size,
+        "results": results
+    }
+
 @app.put("/api/admin/users/role")
 async def update_user_role(role_update: UserRoleUpdate, current_user = Depends(require_role([UserRole.GENERAL_ADMIN]))):
     # Check if target user exists
-    target_user = db.users.find_one({"id": role_update.user_id})
+    target_user = get_user(db, role_update.user_id, USER_ID)
     if not target_user:
         raise HTTPException(status_code=404, detail="User not found")
     
     # Update user role
     db.users.update_one(
-        {"id": role_update.user_id},
+        by_id(role_update.user_id),
         {"$set": {"role": role_update.new_role.value}}
     )
+    bump_versions(user_version(role_update.user_id), "data")
     
     # Return updated user
-    updated_user = db.users.find_one({"id": role_update.user_id}, {"password_hash": 0})
+    updated_user = get_user(db, role_update.user_id)
     return User(**updated_user)
 
-@app.get("/api/admin/applications")
-async def get_all_applications(current_user = Depends(require_role([UserRole.COUNTRY_COORDINATOR, UserRole.FUND_ADMIN, UserRole.GENERAL_ADMIN]))):
+@app.get("/api/admin/applications", dependencies=[Depends(route_class("admin_lists"))])
+def get_all_applications(
+    include_archived: bool = False,
+    fields: Optional[str] = None,
+    expand: Optional[str] = None,
+    current_user = Depends(require_role([UserRole.COUNTRY_COORDINATOR, UserRole.FUND_ADMIN, UserRole.GENERAL_ADMIN]))
+):
+    """Applications by priority.
+
+    ``fields`` (comma-separated) returns only those fields, including the
+    reviewer details (applicant_name, can_approve, ...); ``expand`` picks the
+    relations to include from guarantors and approval_history (default both).
+    """
+    fields = parse_field_list(fields, APPLICATION_FIELDS + REVIEW_FIELDS, "fields")
+    expand = parse_field_list(expand, APPLICATION_EXPANSIONS, "expand") if expand is not None else APPLICATION_EXPANSIONS
     user_role = UserRole(current_user["role"])
     
     if user_role == UserRole.COUNTRY_COORDINATOR:
         # Only applications from same country, sorted by priority
-        country_users = [user["id"] for user in db.users.find({"country": current_user["country"]})]
-        applications = list(db.finance_applications.find({"user_id": {"$in": country_users}}).sort([("priority_score", -1), ("created_at", 1)]))
+        country_users = country_user_ids(db, current_user["country"])
+        query = {"user_id": {"$in": country_users}}
     else:
         # Fund admins and general admins see all applications, sorted by priority
-        applications = list(db.finance_applications.find({}).sort([("priority_score", -1), ("created_at", 1)]))
+        query = {}
+    applications = find_with_archive(
+        "finance_applications", query, application_projection(fields),
+        sort=[("priority_score", -1), ("created_at", 1)], include_archived=include_archived
+    )
+    expand_applications(applications, expand, include_archived)
     
-    # Add guarantors, approval history, and other information to each application
-    for app in applications:
-        # Ensure all required fields exist
-        if "priority_score" not in app or app["priority_score"] is None:
-            app["priority_score"] = 0
-        if "previous_finances_count" not in app:
-            app["previous_finances_count"] = 0
-        if "review_notes" not in app:
-            app["review_notes"] = None
-        if "conditions" not in app:
-            app["conditions"] = None
-        if "approved_amount" not in app:
-            app["approved_amount"] = None
-        if "requires_higher_approval" not in app:
-            app["requires_higher_approval"] = False
-            
-        guarantors = list(db.guarantors.find({"application_id": app["id"]}))
-        app["guarantors"] = [GuarantorResponse(**g) for g in guarantors]
-        
-        # Add approval history
-        approval_history = list(db.approval_history.find({"application_id": app["id"]}).sort("created_at", 1))
-        app["approval_history"] = [ApprovalHistory(**h) for h in approval_history]
-        
-        # Add applicant info
-        applicant = db.users.find_one({"id": app["user_id"]}, {"password_hash": 0})
-        if applicant:
-            app["applicant_name"] = applicant["full_name"]
-            app["applicant_email"] = applicant["email"]
-            app["applicant_country"] = applicant["country"]
-        
-        # Add required approval level
-        app["required_approval_level"] = determine_required_approval_level(app["amount"])
-        
-        # Check if current user can approve
-        can_approve, reason = can_approve_application(
-            current_user["role"], 
-            app["amount"], 
-            applicant["country"] if applicant else "", 
-            current_user["country"]
-        )
-        app["can_approve"] = can_approve
-        app["approval_restriction"] = reason if not can_approve else None
+    # Reviewer details are only computed when asked for
+    if fields is not None and set(fields) & set(REVIEW_FIELDS):
+        applicants = get_applicants(applications)
+        for app in applications:
+            add_review_details(app, applicants.get(app["user_id"]), current_user)
     
-    return [FinanceApplication(**app) for app in applications]
+    return render_applications(applications, fields, expand)
 
-@app.get("/api/admin/deposits")
-async def get_all_deposits(current_user = Depends(require_role([UserRole.FUND_ADMIN, UserRole.GENERAL_ADMIN]))):
-    deposits = list(db.deposits.find({}).sort("created_at", -1))
-    
-    # Add user info to deposits
-    for deposit in deposits:
-        user = db.users.find_one({"id": deposit["user_id"]}, {"password_hash": 0})
-        if user:
-            deposit["user_name"] = user["full_name"]
-            deposit["user_email"] = user["email"]
-    
+@app.get("/api/admin/deposits", dependencies=[Depends(route_class("admin_lists"))])
+def get_all_deposits(current_user = Depends(require_role([UserRole.FUND_ADMIN, UserRole.GENERAL_ADMIN]))):
+    deposits = list(db.deposits.find({}, {"_id": 0}).sort("created_at", -1))
     return [Deposit(**deposit) for deposit in deposits]
 
-@app.get("/api/admin/guarantors")
-async def get_all_guarantors(current_user = Depends(require_role([UserRole.FUND_ADMIN, UserRole.GENERAL_ADMIN]))):
+@app.get("/api/admin/guarantors", dependencies=[Depends(route_class("admin_lists"))])
+def get_all_guarantors(
+    include_archived: bool = False,
+    current_user = Depends(require_role([UserRole.FUND_ADMIN, UserRole.GENERAL_ADMIN]))
+):
     """Get all guarantor relationships"""
-    guarantors = list(db.guarantors.find({}).sort("created_at", -1))
-    
-    # Add application details
-    for guarantor in guarantors:
-        application = db.finance_applications.find_one({"id": guarantor["application_id"]})
-        if application:
-            guarantor["application_amount"] = application["amount"]
-            guarantor["application_purpose"] = application["purpose"]
-    
+    guarantors = find_with_archive("guarantors", {}, sort=[("created_at", -1)], include_archived=include_archived)
     return [GuarantorResponse(**guarantor) for guarantor in guarantors]
 
-@app.get("/api/admin/approval-history")
-async def get_approval_history(current_user = Depends(require_role([UserRole.FUND_ADMIN, UserRole.GENERAL_ADMIN]))):
+@app.get("/api/admin/approval-history", dependencies=[Depends(route_class("admin_lists"))])
+def get_approval_history(
+    include_archived: bool = False,
+    current_user = Depends(require_role([UserRole.FUND_ADMIN, UserRole.GENERAL_ADMIN]))
+):
     """Get approval history for all applications"""
-    history = list(db.approval_history.find({}).sort("created_at", -1).limit(100))
+    history = find_with_archive(
+        "approval_history", {}, sort=[("created_at", -1)], limit=100,
+        include_archived=include_archived, database=read_db("analytics")
+    )
     return [ApprovalHistory(**h) for h in history]
 
+@app.get("/api/admin/portfolio", dependencies=[Depends(route_class("exports"))])
+def get_portfolio(
+    as_of: Optional[date] = None,
+    current_user = Depends(require_role([UserRole.FUND_ADMIN, UserRole.GENERAL_ADMIN]))
+):
+    """Loan book analytics: outstanding principal, aging, PAR and per-country figures.
+
+    Reports are cached per as-of date until the next disbursement or repayment.
+    """
+    if as_of and as_of > datetime.utcnow().date():
+        raise HTTPException(status_code=400, detail="as_of cannot be in the future")
+    
+    # The causal session makes the export secondary catch up to the version read here
+    with client.start_session(causal_consistency=True) as session:
+        version = read_versions(["portfolio"], session)["portfolio"]
+        return get_portfolio_report(read_db("export"), as_of, version, session=session, cache_database=db)
+
+@app.get("/api/admin/liquidity-forecast", dependencies=[Depends(route_class("exports"))])
+def get_liquidity_forecast(
+    granularity: ForecastGranularity = ForecastGranularity.DAILY,
+    periods: Optional[int] = None,
+    current_user = Depends(require_role([UserRole.FUND_ADMIN, UserRole.GENERAL_ADMIN]))
+):
+    """Project the available balance from scheduled repayments and approved/pending loans.
+
+    Forecasts are cached for the day until the fund pool or any application,
+    deposit or repayment changes.
+    """
+    default_periods, max_periods = FORECAST_PERIODS[granularity]
+    periods = periods or default_periods
+    if periods < 1 or periods > max_periods:
+        raise HTTPException(
+            status_code=400,
+            detail=f"periods must be between 1 and {max_periods} for {granularity.value} forecasts"
+        )
+    
+    with client.start_session(causal_consistency=True) as session:
+        versions = read_versions(["data", "fund_pool"], session)
+        fund_pool = get_fund_pool()
+        today = datetime.utcnow().date()
+        cache_key = (
+            f"liquidity:{today.isoformat()}:{granularity.value}:{periods}:"
+            f"{versions['data']}:{versions['fund_pool']}"
+        )
+        # The cache is written, so it lives on the primary; only the build reads from analytics
+        return cached_report(
+            db,
+            cache_key,
+            lambda: build_liquidity_forecast(
+                read_db("analytics"),
+                fund_pool.available_balance,
+                OUTSTANDING_PAYMENT_STATUSES,
+                granularity.value,
+                periods,
+                start=today,
+                session=session
+            ),
+            session=session
+        )
+
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8001)
\ No newline at end of file
+    
+    if WEB_CONCURRENCY > 1:
+        # Run the one-time setup once here so workers don't race on it
+        connect_mongo()
+        run_startup_tasks()
+        close_mongo()
+        os.environ['RUN_STARTUP_TASKS'] = 'false'
+    
+    uvicorn.run(
+        "server:app" if WEB_CONCURRENCY > 1 else app,
+        host="0.0.0.0",
+        port=PORT,
+        workers=WEB_CONCURRENCY,
+        timeout_graceful_shutdown=GRACEFUL_SHUTDOWN_SECONDS
+    )
\ No newline at end of file
@@ -1,4 +1,4 @@
-import React, { useState, useEffect } from 'react';
+import React, { useState, useEffect, useRef } from 'react';
 import './App.css';
 
 const API_URL = process.env.REACT_APP_BACKEND_URL;
@@ -68,6 +68,81 @@ function App() {
     }
   }, [token]);
 
+  // Live updates: apply what an event carries, and refetch only the on-screen
+  // resource it names
+  const activeTabRef = useRef(activeTab);
+  useEffect(() => {
+    activeTabRef.current = activeTab;
+  }, [activeTab]);
+
+  useEffect(() => {
+    if (!token || !user) return;
+
+    const refetchOnTab = (fetchers) => {
+      const fetchTab = fetchers[activeTabRef.current];
+      if (fetchTab) fetchTab();
+    };
+    const applicationFetchers = {
+      dashboard: fetchDashboard,
+      applications: fetchApplications,
+      'guarantor-requests': fetchGuarantorRequests,
+      'approval-queue': fetchApprovalQueue,
+      'manage-applications': fetchAdminData
+    };
+    const disbursementFetchers = {
+      dashboard: fetchDashboard,
+      applications: fetchApplications,
+      disbursements: () => {
+        fetchDisbursements();
+        fetchReadyForDisbursement();
+      },
+      'payment-schedules': fetchPaymentSchedules
+    };
+    const handlers = {
+      application_created: () => refetchOnTab(applicationFetchers),
+      approval_action: () => refetchOnTab(applicationFetchers),
+      guarantor_response: () => refetchOnTab(applicationFetchers),
+      disbursement: () => refetchOnTab(disbursementFetchers),
+      // The event carries the new totals
+      fund_pool_updated: (totals) => setFundPool((current) => ({ ...current, ...totals })),
+      // Events were dropped, so reload what is on screen
+      resync: () => refetchOnTab({
+        ...applicationFetchers,
+        ...disbursementFetchers,
+        'fund-pool': fetchFundPool
+      })
+    };
+
+    // The access token stays out of the URL: each connection redeems a
+    // short-lived, single-use ticket, and a new one is fetched to reconnect
+    let source = null;
+    let reconnect = null;
+    let stopped = false;
+    const connect = async () => {
+      try {
+        const { ticket } = await api('/api/events/ticket', { method: 'POST' });
+        if (stopped) return;
+        source = new EventSource(`${API_URL}/api/events/stream?ticket=${encodeURIComponent(ticket)}`);
+        Object.entries(handlers).forEach(([type, handle]) =>
+          source.addEventListener(type, (event) => handle(JSON.parse(event.data || '{}')))
+        );
+        source.onerror = () => {
+          source.close();
+          if (!stopped) reconnect = setTimeout(connect, 5000);
+        };
+      } catch (error) {
+        if (!stopped) reconnect = setTimeout(connect, 5000);
+      }
+    };
+    connect();
+
+    return () => {
+      stopped = true;
+      clearTimeout(reconnect);
+      if (source) source.close();
+    };
+  }, [token, user?.id]);
+
   const api = async (endpoint, options = {}) => {
     const config = {
       headers: {
@@ -169,7 +244,9 @@ function App() {
 
   const fetchEligibleGuarantors = async () => {
     try {
-      const guarantorsData = await api('/api/guarantors/eligible');
+      // Each guarantor backs an equal share of the requested amount
+      const guaranteedAmount = (parseFloat(applicationForm.amount) || 0) / Math.max(1, applicationForm.guarantors.length);
+      const guarantorsData = await api(`/api/guarantors/eligible?guaranteed_amount=${guaranteedAmount}`);
       setEligibleGuarantors(guarantorsData);
     } catch (error) {
       console.error('Failed to fetch eligible guarantors:', error);
@@ -0,0 +1,27 @@
+import os
+import sys
+
+import pytest
+from pymongo.errors import PyMongoError
+
+# Point the server at a throwaway database and fail fast when mongod is absent
+os.environ.setdefault("DB_NAME", "fund_management_test")
+os.environ.setdefault("MONGO_SERVER_SELECTION_TIMEOUT_MS", "2000")
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "backend"))
+
+import server  # noqa: E402
+
+
+@pytest.fixture(scope="session")
+def mongo():
+    """Connect the server module to MONGO_URL, skipping when no mongod is reachable"""
+    server.connect_mongo()
+    try:
+        server.client.admin.command("ping")
+    except PyMongoError:
+        server.close_mongo()
+        pytest.skip(f"MongoDB not reachable at {server.MONGO_URL}")
+    server.client.drop_database(server.DB_NAME)
+    yield server.db
+    server.client.drop_database(server.DB_NAME)
+    server.close_mongo()
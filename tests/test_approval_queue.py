@@ -0,0 +1,96 @@
+"""Approval queue change tokens and delta sync"""
+import asyncio
+from datetime import datetime
+
+import pytest
+from fastapi import HTTPException, Response
+
+import server
+
+ADMIN = {"id": "admin", "role": "general_admin", "country": "X"}
+
+
+@pytest.fixture
+def queue(mongo):
+    for name in ["finance_applications", "guarantors", "approval_history", "users"]:
+        mongo[name].delete_many({})
+        mongo[server.ARCHIVE_COLLECTIONS.get(name, name)].delete_many({})
+    mongo.counters.delete_many({"id": {"$in": ["finance_applications", "archive_watermark"]}})
+    mongo.change_claims.delete_many({})
+    mongo.users.insert_one(server.with_id({"id": "u1", "full_name": "Member", "email": "u1@example.com", "country": "X"}))
+    return mongo
+
+
+def write_application(mongo, application_id, status="pending", change_seq=None):
+    if change_seq is None:
+        with server.application_changes() as change_seq:
+            return write_application(mongo, application_id, status, change_seq)
+    mongo.finance_applications.update_one(
+        server.by_id(application_id),
+        {"$set": {
+            **server.with_id({"id": application_id}),
+            "user_id": "u1", "amount": 500.0, "purpose": "stock", "description": None, "requested_duration_months": 6,
+            "reviewed_at": None, "reviewed_by": None,
+            "status": status, "created_at": datetime(2024, 1, 1),
+            **server.application_change_fields(change_seq)
+        }},
+        upsert=True
+    )
+
+
+def poll(since=None):
+    response = Response()
+    result = server.get_approval_queue(response, since=since, current_user=ADMIN)
+    return response.headers["X-Change-Token"], result
+
+
+def test_deltas_report_changes_since_the_token(queue):
+    write_application(queue, "a1")
+    write_application(queue, "a2")
+    token, full = poll()
+
+    write_application(queue, "a1", status="approved")
+    write_application(queue, "a3")
+    next_token, delta = poll(token)
+
+    assert [app.id for app in full] == ["a1", "a2"]
+    assert delta["full"] is False
+    assert delta["change_token"] == next_token != token
+    assert "a3" in [app.id for app in delta["upserted"]]
+    assert "a1" in delta["removed"]
+
+
+def test_writes_that_land_after_a_later_token_are_not_missed(queue):
+    # A slow write takes its number, then many others take later ones and land
+    with server.application_changes() as in_flight:
+        for number in range(150):
+            write_application(queue, f"fast{number}")
+        token, _ = poll()
+        write_application(queue, "slow", change_seq=in_flight)
+
+    _, delta = poll(token)
+
+    assert "slow" in [app.id for app in delta["upserted"]]
+
+
+def test_tokens_ignore_claims_of_crashed_writers(queue):
+    write_application(queue, "a1")
+    queue.change_claims.insert_one({"floor": 0, "created_at": datetime(2024, 1, 1)})
+
+    token, _ = poll()
+
+    assert token.split("-", 1)[0] == str(server.current_sequence("finance_applications"))
+
+
+def test_scope_changes_fall_back_to_a_full_reload(queue):
+    write_application(queue, "a1")
+    token, _ = poll()
+    seq, _ = token.split("-", 1)
+
+    _, reload = poll(f"{seq}-otherscope")
+
+    assert reload["full"] is True
+    assert [app.id for app in reload["upserted"]] == ["a1"]
+    with pytest.raises(HTTPException) as error:
+        poll("not-a-token")
+    assert error.value.status_code == 400
@@ -0,0 +1,55 @@
+"""Hot/cold archival of closed loans"""
+from datetime import datetime, timedelta
+
+import pytest
+
+import server
+
+OLD = datetime.utcnow() - timedelta(days=400)
+
+
+@pytest.fixture
+def closed_loans(mongo):
+    for name in ["finance_applications", "guarantors", "approval_history", "payment_schedules", "counters"]:
+        mongo[name].delete_many({})
+        mongo[server.ARCHIVE_COLLECTIONS.get(name, name)].delete_many({})
+
+    mongo.finance_applications.insert_many([
+        {"id": "rejected", "user_id": "u1", "status": "rejected", "created_at": OLD, "updated_at": OLD, "change_seq": 7},
+        {"id": "repaid", "user_id": "u1", "status": "disbursed", "created_at": OLD, "updated_at": OLD},
+        {"id": "repaying", "user_id": "u1", "status": "disbursed", "created_at": OLD, "updated_at": OLD},
+        {"id": "recent", "user_id": "u1", "status": "rejected", "created_at": OLD, "updated_at": datetime.utcnow()},
+    ])
+    mongo.guarantors.insert_one({"id": "g1", "application_id": "rejected", "guarantor_user_id": "u2", "created_at": OLD})
+    mongo.approval_history.insert_one({"id": "h1", "application_id": "rejected", "created_at": OLD})
+    mongo.payment_schedules.insert_many([
+        {"id": "s1", "application_id": "repaid", "status": "paid", "paid_date": OLD},
+        {"id": "s2", "application_id": "repaid", "status": "paid", "paid_date": OLD},
+        {"id": "s3", "application_id": "repaying", "status": "paid", "paid_date": OLD},
+        {"id": "s4", "application_id": "repaying", "status": "pending"},
+    ])
+    return mongo
+
+
+def test_closed_loans_move_with_their_children(closed_loans):
+    counts = server.run_archival(older_than_days=180)
+
+    assert counts == {"finance_applications": 2, "guarantors": 1, "approval_history": 1, "payment_schedules": 2}
+    assert sorted(app["id"] for app in closed_loans.finance_applications.find()) == ["recent", "repaying"]
+    assert sorted(app["id"] for app in closed_loans.archived_finance_applications.find()) == ["rejected", "repaid"]
+    assert closed_loans.guarantors.count_documents({}) == 0
+    assert closed_loans.archived_payment_schedules.count_documents({"application_id": "repaid"}) == 2
+    assert server.current_sequence("archive_watermark") == 7
+
+
+def test_archive_is_only_read_when_asked(closed_loans):
+    server.run_archival(older_than_days=180)
+
+    hot = server.find_with_archive("finance_applications", {"user_id": "u1"})
+    everything = server.find_with_archive(
+        "finance_applications", {"user_id": "u1"}, sort=[("updated_at", -1)], include_archived=True
+    )
+
+    assert len(hot) == 2
+    assert [app["id"] for app in everything][0] == "recent"
+    assert len(everything) == 4
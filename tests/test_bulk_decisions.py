@@ -0,0 +1,67 @@
+"""Bulk approval decisions"""
+import asyncio
+from datetime import datetime
+
+import pytest
+
+import server
+
+ADMIN = {"id": "admin", "full_name": "Admin", "role": "general_admin", "country": "X"}
+
+
+@pytest.fixture
+def applications(mongo):
+    for name in ["finance_applications", "approval_history", "users", "member_stats", "guarantors", "system_config"]:
+        mongo[name].delete_many({})
+        mongo[server.ARCHIVE_COLLECTIONS.get(name, name)].delete_many({})
+    mongo.users.insert_one(server.with_id({"id": "u1", "full_name": "Member", "email": "u1@example.com", "country": "X"}))
+    mongo.finance_applications.insert_many([server.with_id(document) for document in [
+        {"id": "a1", "user_id": "u1", "amount": 500.0, "status": "pending", "created_at": datetime(2024, 1, 1)},
+        {"id": "a2", "user_id": "u1", "amount": 500.0, "status": "pending", "created_at": datetime(2024, 1, 2)},
+    ]])
+    server.rebuild_member_stats()
+    return mongo
+
+
+def decide(*items):
+    request = server.BulkDecisionRequest(items=[
+        server.BulkDecisionItem(application_id=application_id, action=action) for application_id, action in items
+    ])
+    return asyncio.run(server.bulk_decide_applications(request, ADMIN))
+
+
+def test_each_item_reports_its_own_outcome(applications):
+    result = decide(("a1", "approve"), ("a2", "reject"), ("a1", "reject"), ("missing", "approve"))
+
+    assert [(r["application_id"], r["ok"]) for r in result["results"]] == [
+        ("a1", True), ("a2", True), ("a1", False), ("missing", False)
+    ]
+    assert (result["succeeded"], result["failed"]) == (2, 2)
+    assert {app["id"]: app["status"] for app in applications.finance_applications.find()} == {
+        "a1": "approved", "a2": "rejected"
+    }
+    assert applications.approval_history.count_documents({}) == 2
+
+
+def test_applications_decided_underneath_are_reported_as_conflicts(applications, monkeypatch):
+    get_applicants = server.get_applicants
+
+    def decided_by_another_reviewer(loaded):
+        # Another reviewer rejects a2 after this batch read it as pending
+        applications.finance_applications.update_one(server.by_id("a2"), {"$set": {"status": "rejected"}})
+        return get_applicants(loaded)
+
+    monkeypatch.setattr(server, "get_applicants", decided_by_another_reviewer)
+    before = server.current_sequence("finance_applications")
+    result = decide(("a1", "approve"), ("a2", "approve"))
+
+    assert [r["ok"] for r in result["results"]] == [True, False]
+    assert (result["succeeded"], result["failed"]) == (1, 1)
+    assert applications.finance_applications.find_one(server.by_id("a2"))["status"] == "rejected"
+    assert [h["application_id"] for h in applications.approval_history.find()] == ["a1"]
+
+    assert server.get_member_stats("u1")["application_counts"]["approved"] == 1
+    # Only the decision that landed took a change sequence number
+    a1 = applications.finance_applications.find_one(server.by_id("a1"))
+    assert a1["change_seq"] == server.current_sequence("finance_applications") == before + 1
+    assert "review_batch" not in a1
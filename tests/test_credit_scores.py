@@ -0,0 +1,76 @@
+"""Member credit scores from repayment history"""
+from datetime import datetime
+
+import pandas as pd
+import pytest
+
+import server
+from scoring import CREDIT_SCORE_VERSION, compute_credit_scores
+
+AS_OF = datetime(2024, 6, 30, 23, 59, 59)
+
+
+def installment(user_id, due, amount=100.0, paid=0.0, paid_date=None):
+    return {
+        "id": f"{user_id}-{due}",
+        "application_id": f"loan-{user_id}",
+        "user_id": user_id,
+        "due_date": datetime.fromisoformat(due),
+        "amount": amount,
+        "paid_amount": paid,
+        "paid_date": datetime.fromisoformat(paid_date) if paid_date else None,
+        "status": "paid" if paid >= amount else "pending"
+    }
+
+
+HISTORY = [
+    # u1 always pays on time; the July installment is not due yet
+    installment("u1", "2024-04-01", paid=100, paid_date="2024-03-30"),
+    installment("u1", "2024-05-01", paid=100, paid_date="2024-05-01"),
+    installment("u1", "2024-07-01"),
+    # u2 paid one installment 20 days late and still owes half of the next
+    installment("u2", "2024-05-01", paid=100, paid_date="2024-05-21"),
+    installment("u2", "2024-06-01", paid=50, paid_date="2024-06-01"),
+    # u3 has not paid for more than 90 days; the payment after the as-of date is ignored
+    installment("u3", "2024-03-01", paid=100, paid_date="2024-07-02"),
+]
+
+
+def test_scores_reflect_repayment_behaviour():
+    scores = compute_credit_scores(pd.DataFrame(HISTORY), AS_OF)
+
+    assert scores.loc["u1"].to_dict() == {
+        "installments_due": 2, "on_time_ratio": 1.0, "average_days_late": 0.0, "defaults": 0, "score": 100.0
+    }
+    assert scores.loc["u2", "on_time_ratio"] == 0.0
+    assert scores.loc["u2", "average_days_late"] == pytest.approx((20 + 29) / 2)
+    assert scores.loc["u2", "score"] == pytest.approx(40 * (1 - 24.5 / 60), abs=0.05)
+    assert scores.loc["u3", "defaults"] == 1
+    assert scores.loc["u3", "score"] == 0.0
+
+
+def test_members_without_due_installments_are_not_scored():
+    scores = compute_credit_scores(pd.DataFrame([installment("u1", "2024-07-01")]), AS_OF)
+
+    assert scores.empty
+    assert compute_credit_scores(pd.DataFrame(), AS_OF).empty
+
+
+def test_priority_reads_the_stored_score(mongo):
+    for name in ["users", "member_stats", "finance_applications", "payment_schedules"]:
+        mongo[name].delete_many({})
+        mongo[server.ARCHIVE_COLLECTIONS.get(name, name)].delete_many({})
+    mongo.users.insert_one(server.with_id({"id": "u1"}))
+    mongo.payment_schedules.insert_many([server.with_id(row) for row in HISTORY[:2]])
+    config = server.SystemConfig(priority_weight=80.0)
+    server.increment_member_stats("u1", {"total_applications": 1})
+    before, _ = server.calculate_priority_score("u1", config)
+
+    assert server.rescore_members() == 1
+    # Rebuilding member stats keeps the scores
+    server.rebuild_member_stats()
+    credit = server.get_member_stats("u1")["credit"]
+
+    assert (credit["score"], credit["version"]) == (100.0, CREDIT_SCORE_VERSION)
+    assert before == 70.0
+    assert server.calculate_priority_score("u1", config) == (80.0, 0)
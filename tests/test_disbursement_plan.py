@@ -0,0 +1,54 @@
+"""Disbursement capacity planning"""
+import random
+
+import server
+
+
+def test_greedy_funds_in_priority_order_and_skips_what_does_not_fit():
+    assert server.plan_disbursements([600, 500, 300, 100], 1000, "greedy") == [0, 2, 3]
+
+
+def test_optimal_uses_more_of_the_budget():
+    amounts = [600, 500, 500]
+
+    assert server.plan_disbursements(amounts, 1000, "greedy") == [0]
+    assert server.plan_disbursements(amounts, 1000, "optimal") == [1, 2]
+
+
+def test_optimal_prefers_higher_priority_on_ties():
+    assert server.plan_disbursements([50, 50, 50], 100, "optimal") == [0, 1]
+
+
+def test_nothing_is_funded_without_budget():
+    assert server.plan_disbursements([10, 20], 0, "optimal") == []
+    assert server.plan_disbursements([10, 20], -5, "greedy") == []
+
+
+def test_optimal_plan_stays_within_a_coarse_budget():
+    rng = random.Random(7)
+    amounts = [round(rng.uniform(100, 5000), 2) for _ in range(3000)]
+    budget = 1_000_000.0
+
+    selected = server.plan_disbursements(amounts, budget, "optimal")
+    greedy = server.plan_disbursements(amounts, budget, "greedy")
+
+    assert sum(amounts[index] for index in selected) <= budget
+    assert len(set(selected)) == len(selected)
+    assert sum(amounts[index] for index in selected) >= sum(amounts[index] for index in greedy) - budget * 0.01
+
+
+def test_loans_left_out_by_rounding_are_funded_from_the_leftover_budget(monkeypatch):
+    # 100-unit cells round the 40 loan up to a full cell that the 950 loan leaves no room for
+    monkeypatch.setattr(server, "PLAN_MAX_BUDGET_CELLS", 10)
+    monkeypatch.setattr(server, "get_fund_pool", lambda: server.FundPool(available_balance=1000.0))
+    monkeypatch.setattr(server, "get_disbursement_candidates", lambda: [
+        {"id": f"a{amount}", "applicant_name": "Member", "applicant_country": "X", "disbursement_amount": float(amount),
+         "priority_score": 50, "created_at": None, "ready_for_disbursement": True, "guarantors_status": "accepted"}
+        for amount in (950, 40, 80)
+    ])
+
+    plan = server.get_disbursement_plan(server.PlanStrategy.OPTIMAL, 0.0, current_user=None)
+
+    assert [entry["application_id"] for entry in plan["funded"]] == ["a950", "a40"]
+    assert plan["remaining_budget"] == 10.0
+    assert [(entry["application_id"], entry["shortfall"]) for entry in plan["unfunded"]] == [("a80", 70.0)]
@@ -0,0 +1,78 @@
+"""Version-based ETags on polled reads"""
+import asyncio
+
+import pytest
+from fastapi import Request, Response
+
+import server
+
+MEMBER = {"id": "u1", "full_name": "Member", "email": "u1@example.com", "country": "X", "role": "member"}
+
+
+def request(etag=None):
+    headers = [(b"if-none-match", etag.encode())] if etag else []
+    return Request({"type": "http", "method": "GET", "path": "/", "headers": headers})
+
+
+def get_deposits(etag=None):
+    response = Response()
+    result = asyncio.run(server.get_user_deposits(request(etag), response, MEMBER))
+    return response.headers.get("ETag"), result
+
+
+@pytest.fixture
+def counters(mongo):
+    for name in ["counters", "deposits", "member_stats"]:
+        mongo[name].delete_many({})
+    return mongo
+
+
+def test_a_matching_etag_returns_304(counters):
+    response = Response()
+    assert server.check_etag(request(), response, "pool", ["fund_pool"]) is None
+    etag = response.headers["ETag"]
+
+    not_modified = server.check_etag(request(f'W/"other", {etag}'), Response(), "pool", ["fund_pool"])
+
+    assert not_modified.status_code == 304
+    assert not_modified.headers["ETag"] == etag
+    assert server.check_etag(request(etag), Response(), "other-scope", ["fund_pool"]) is None
+
+
+def test_bumped_versions_invalidate_etags(counters):
+    response = Response()
+    server.check_etag(request(), response, "pool", ["fund_pool"])
+    etag = response.headers["ETag"]
+
+    server.bump_versions("user:u1")
+    assert server.check_etag(request(etag), Response(), "pool", ["fund_pool"]).status_code == 304
+
+    for name in ["fund_pool", "epoch"]:
+        # A name repeated in one call is only advanced once
+        server.bump_versions(name, name)
+        response = Response()
+        assert server.check_etag(request(etag), response, "pool", ["fund_pool"]) is None
+        etag = response.headers["ETag"]
+    assert etag.endswith('-1-1"')
+
+
+def test_member_reads_change_with_their_writes(counters):
+    etag, deposits = get_deposits()
+    assert deposits == []
+    assert get_deposits(etag)[1].status_code == 304
+
+    server.record_deposit(server.DepositCreate(amount=25.0), MEMBER)
+    new_etag, deposits = get_deposits(etag)
+
+    assert new_etag != etag
+    assert [deposit.amount for deposit in deposits] == [25.0]
+
+
+def test_hot_versions_are_striped_and_summed(counters):
+    # Counter of a deployment that predates striping
+    counters.counters.insert_one({"id": "fund_pool", "seq": 7})
+    for _ in range(40):
+        server.bump_versions("fund_pool", "user:u1")
+
+    assert counters.counters.count_documents({"id": {"$regex": "^fund_pool#"}}) > 1
+    assert server.read_versions(["fund_pool", "user:u1", "data"]) == {"fund_pool": 47, "user:u1": 40, "data": 0}
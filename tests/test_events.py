@@ -0,0 +1,99 @@
+"""Streamed workflow events"""
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+import server
+
+MEMBER = {"id": "u1", "role": "member", "country": "X"}
+OTHER_MEMBER = {"id": "u2", "role": "member", "country": "X"}
+COORDINATOR = {"id": "c1", "role": "country_coordinator", "country": "X"}
+OTHER_COORDINATOR = {"id": "c2", "role": "country_coordinator", "country": "Y"}
+FUND_ADMIN = {"id": "f1", "role": "fund_admin", "country": "Y"}
+
+
+def test_events_are_filtered_by_user_role_and_country():
+    application = {"type": "application_created", "user_ids": ["u1"], "roles": server.REVIEWER_ROLES, "country": "X"}
+    pool = server.fund_pool_event({"total_deposits": 10.0})
+
+    assert [server.event_visible_to(application, user) for user in
+            [MEMBER, OTHER_MEMBER, COORDINATOR, OTHER_COORDINATOR, FUND_ADMIN]] == [True, False, True, False, True]
+    assert [server.event_visible_to(pool, user) for user in [MEMBER, COORDINATOR, FUND_ADMIN]] == [False, False, True]
+    assert server.event_visible_to({"type": "resync", "data": {}}, OTHER_MEMBER)
+
+
+def test_slow_subscribers_get_a_resync_instead_of_the_backlog():
+    bus = server.EventBus()
+
+    async def overflow():
+        queue = bus.subscribe()
+        for number in range(server.EVENT_QUEUE_SIZE + 1):
+            bus.publish({"type": "fund_pool_updated", "data": {"number": number}})
+        await asyncio.sleep(0)
+        bus.unsubscribe(queue)
+        return [queue.get_nowait() for _ in range(queue.qsize())]
+
+    assert asyncio.run(overflow()) == [{"type": "resync", "data": {}}]
+    assert not bus.has_subscribers()
+
+
+@pytest.fixture
+def application(mongo):
+    for name in ["users", "finance_applications"]:
+        mongo[name].delete_many({})
+    mongo.users.insert_one(server.with_id({"id": "u1", "country": "X"}))
+    document = {"id": "a1", "user_id": "u1", "amount": 500.0, "status": "pending"}
+    mongo.finance_applications.insert_one(server.with_id(document))
+    return document
+
+
+def change(collection, operation, document, updated_fields=None):
+    return {
+        "ns": {"coll": collection},
+        "operationType": operation,
+        "fullDocument": document,
+        "updateDescription": {"updatedFields": updated_fields or {}}
+    }
+
+
+def test_changes_map_to_events(application):
+    guarantor = {
+        "id": "g1", "application_id": "a1", "guarantor_user_id": "u2", "guarantor_name": "Guarantor",
+        "status": "accepted"
+    }
+    history = {
+        "application_id": "a1", "action": "approve", "previous_status": "pending", "new_status": "approved",
+        "approver_name": "Admin"
+    }
+
+    created = server.change_to_event(change("finance_applications", "insert", application))
+    approved = server.change_to_event(change("approval_history", "insert", history))
+    responded = server.change_to_event(change("guarantors", "update", guarantor, {"status": "accepted"}))
+
+    assert (created["type"], created["country"], created["user_ids"]) == ("application_created", "X", ["u1"])
+    assert (approved["type"], approved["data"]["status"]) == ("approval_action", "approved")
+    assert (responded["type"], responded["user_ids"]) == ("guarantor_response", ["u1", "u2"])
+
+
+def test_unrelated_changes_are_ignored(application):
+    guarantor = {"id": "g1", "application_id": "a1", "guarantor_user_id": "u2", "status": "pending"}
+
+    assert server.change_to_event(change("guarantors", "update", guarantor, {"exposure": 0.0})) is None
+    assert server.change_to_event(change("finance_applications", "update", application)) is None
+    assert server.change_to_event(change("finance_applications", "insert", None)) is None
+    assert server.change_to_event(change("approval_history", "insert", {"application_id": "missing"})) is None
+
+
+def test_stream_tickets_open_one_connection(application, mongo):
+    mongo.stream_tickets.delete_many({})
+    ticket = asyncio.run(server.create_stream_ticket({"id": "u1"}))["ticket"]
+
+    assert server.get_stream_user(ticket=ticket, credentials=None)["id"] == "u1"
+    with pytest.raises(HTTPException) as reused:
+        server.get_stream_user(ticket=ticket, credentials=None)
+    assert reused.value.status_code == 401
+
+    # An access token is no longer accepted in place of a ticket
+    with pytest.raises(HTTPException):
+        server.get_stream_user(ticket=server.create_access_token({"sub": "u1"}), credentials=None)
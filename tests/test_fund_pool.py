@@ -0,0 +1,159 @@
+"""Striped fund pool and fund reservations"""
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from fastapi import HTTPException
+
+import server
+
+
+@pytest.fixture
+def pool(mongo):
+    mongo.fund_pool.delete_many({})
+    mongo.fund_pool_stripes.delete_many({})
+    # Reservations rely on it to tell which conditional takes missed
+    mongo.fund_pool_stripes.create_index("stripe", unique=True)
+    return mongo
+
+
+def test_writes_spread_over_stripes_and_reads_sum_them(pool):
+    for _ in range(40):
+        server.update_fund_pool(deposit_amount=10.0)
+    server.update_fund_pool(repayment_amount=5.0)
+
+    fund_pool = server.get_fund_pool()
+
+    assert pool.fund_pool_stripes.count_documents({}) > 1
+    assert (fund_pool.total_deposits, fund_pool.total_repaid, fund_pool.available_balance) == (400.0, 5.0, 405.0)
+
+
+def test_concurrent_reservations_never_overdraw(pool):
+    for stripe in range(4):
+        pool.fund_pool_stripes.insert_one({
+            "stripe": stripe, "total_deposits": 100.0, "total_disbursed": 0.0, "total_repaid": 0.0,
+            "available_balance": 100.0, "total_receivables": 0.0, "last_updated": server.datetime.utcnow()
+        })
+
+    def reserve(_):
+        try:
+            return sum(take for _, take in server.reserve_funds(70.0, "admin"))
+        except HTTPException:
+            return 0.0
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        reserved = list(executor.map(reserve, range(8)))
+
+    # At most five of the eight fit, and each one got all of its amount or nothing
+    fund_pool = server.get_fund_pool()
+    assert all(amount == 0.0 or amount == pytest.approx(70.0) for amount in reserved)
+    assert 0 < sum(reserved) <= 350.0 + 0.01
+    assert fund_pool.available_balance == pytest.approx(400.0 - sum(reserved))
+    assert pool.fund_pool_stripes.count_documents({"available_balance": {"$lt": 0}}) == 0
+
+
+def test_failed_reservation_releases_what_it_took(pool):
+    server.update_fund_pool(deposit_amount=100.0)
+
+    with pytest.raises(HTTPException) as error:
+        server.reserve_funds(150.0, "admin")
+
+    assert error.value.status_code == 400
+    assert server.get_fund_pool().available_balance == 100.0
+
+
+def test_takes_that_miss_are_taken_from_other_stripes(pool, monkeypatch):
+    for stripe, balance in [(0, 100.0), (1, 50.0)]:
+        pool.fund_pool_stripes.insert_one({
+            "stripe": stripe, "total_deposits": balance, "total_disbursed": 0.0, "total_repaid": 0.0,
+            "available_balance": balance, "total_receivables": 0.0, "last_updated": server.datetime.utcnow()
+        })
+    stripe_update = server.fund_pool_stripe_update
+    drained = []
+
+    def drain_stripe_0_first(*args, **kwargs):
+        # Another disbursement empties stripe 0 after this one read it
+        if not drained:
+            drained.append(pool.fund_pool_stripes.update_one({"stripe": 0}, {"$set": {"available_balance": 10.0}}))
+        return stripe_update(*args, **kwargs)
+
+    monkeypatch.setattr(server, "fund_pool_stripe_update", drain_stripe_0_first)
+
+    assert server.reserve_funds(40.0, "admin") == [(1, 40.0)]
+    assert pool.fund_pool_stripes.count_documents({}) == 2
+    assert [s["available_balance"] for s in pool.fund_pool_stripes.find().sort("stripe", 1)] == [10.0, 10.0]
+
+
+def test_single_pool_document_moves_into_stripes(pool):
+    pool.fund_pool.insert_one({
+        "id": "fund_pool", "total_deposits": 500.0, "total_disbursed": 200.0, "total_repaid": 50.0,
+        "available_balance": 350.0, "total_receivables": 150.0
+    })
+
+    server.migrate_fund_pool_stripes()
+
+    assert pool.fund_pool.count_documents({}) == 0
+    assert pool.fund_pool_stripes.count_documents({}) == server.FUND_POOL_STRIPES
+    assert server.get_fund_pool().available_balance == 350.0
+
+
+@pytest.fixture
+def approved_application(pool):
+    for name in ["finance_applications", "guarantors", "disbursements", "payment_schedules", "loan_schedules"]:
+        pool[name].delete_many({})
+    server.ensure_disbursement_index()
+    pool.finance_applications.insert_one(server.with_id({
+        "id": "loan", "user_id": "u1", "amount": 300.0, "approved_amount": None, "status": "approved",
+        "requested_duration_months": 3, "guarantors": [], "created_at": server.datetime.utcnow()
+    }))
+    return pool
+
+
+ADMIN = {"id": "admin", "full_name": "Admin"}
+
+
+def test_application_is_disbursed_once(approved_application):
+    server.update_fund_pool(deposit_amount=1000.0)
+    result = server.disburse("loan", server.DisbursementRequest(), ADMIN)
+
+    # A second attempt that got past the status check still hits the unique index
+    approved_application.finance_applications.update_one(server.by_id("loan"), {"$set": {"status": "approved"}})
+    with pytest.raises(HTTPException) as error:
+        server.disburse("loan", server.DisbursementRequest(), ADMIN)
+
+    assert result["disbursement"].disbursed_amount == 300.0
+    assert error.value.detail == "Application has already been disbursed"
+    assert approved_application.disbursements.count_documents({"application_id": "loan"}) == 1
+    assert server.get_fund_pool().available_balance == 700.0
+
+
+def test_failed_disbursement_writes_nothing(approved_application):
+    server.update_fund_pool(deposit_amount=100.0)
+
+    with pytest.raises(HTTPException) as error:
+        server.disburse("loan", server.DisbursementRequest(), ADMIN)
+
+    assert error.value.status_code == 400
+    assert approved_application.disbursements.count_documents({}) == 0
+    assert approved_application.finance_applications.find_one(server.by_id("loan"))["status"] == "approved"
+    assert server.get_fund_pool().available_balance == 100.0
+
+
+def test_recount_keeps_movements_that_land_meanwhile(pool, monkeypatch):
+    for name in ["deposits", "disbursements", "payment_schedules", "loan_schedules"]:
+        pool[name].delete_many({})
+        pool[server.ARCHIVE_COLLECTIONS.get(name, name)].delete_many({})
+    pool.deposits.insert_one({"id": "dep1", "user_id": "u1", "amount": 300.0, "status": "completed"})
+    for _ in range(20):
+        server.update_fund_pool(deposit_amount=10.0)
+    load_fund_pool_stripes = server.load_fund_pool_stripes
+
+    def deposit_after_the_read(session=None):
+        stripes = load_fund_pool_stripes(session)
+        pool.fund_pool_stripes.update_one({"stripe": 3}, server.fund_pool_stripe_update(deposit_amount=25.0), upsert=True)
+        return stripes
+
+    monkeypatch.setattr(server, "load_fund_pool_stripes", deposit_after_the_read)
+    fund_pool = server.recalculate_fund_pool_totals("admin")
+
+    assert (fund_pool.total_deposits, fund_pool.available_balance) == (325.0, 325.0)
+    assert pool.fund_pool_stripes.count_documents({"available_balance": {"$lt": 0}}) == 0
@@ -0,0 +1,145 @@
+"""Guarantor exposure and exposure-aware eligibility"""
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import pytest
+from fastapi import HTTPException
+
+import server
+
+NOW = datetime.utcnow()
+
+
+def test_capacity_moves_with_deposits_and_exposure():
+    assert server.member_stats_update({"total_deposits": 100.0})["$inc"]["guarantee_capacity"] == 100.0
+    assert server.member_stats_update({"guarantee_exposure": 40.0})["$inc"]["guarantee_capacity"] == -40.0
+    assert server.member_stats_update({"total_applications": 1})["$inc"]["guarantee_capacity"] == 0
+
+
+@pytest.fixture
+def legacy_guarantees(mongo):
+    for name in ["users", "deposits", "finance_applications", "guarantors", "disbursements", "payment_schedules", "member_stats"]:
+        mongo[name].delete_many({})
+        mongo[server.ARCHIVE_COLLECTIONS.get(name, name)].delete_many({})
+
+    mongo.users.insert_many([{"id": "g1"}, {"id": "g2"}])
+    mongo.deposits.insert_many([
+        {"id": "dep1", "user_id": "g1", "amount": 1000.0, "status": "completed", "created_at": NOW},
+        {"id": "dep2", "user_id": "g2", "amount": 600.0, "status": "completed", "created_at": NOW},
+    ])
+    mongo.finance_applications.insert_many([server.with_id(document) for document in [
+        {"id": "pending", "user_id": "u1", "amount": 1000.0, "status": "pending", "created_at": NOW},
+        {"id": "half", "user_id": "u1", "amount": 1000.0, "status": "disbursed", "created_at": NOW},
+        {"id": "repaid", "user_id": "u1", "amount": 400.0, "status": "disbursed", "created_at": NOW},
+        {"id": "rejected", "user_id": "u1", "amount": 300.0, "status": "rejected", "created_at": NOW},
+    ]])
+    mongo.disbursements.insert_many([
+        {"id": "d1", "application_id": "half", "user_id": "u1", "disbursed_amount": 500.0, "status": "disbursed"},
+        {"id": "d2", "application_id": "repaid", "user_id": "u1", "disbursed_amount": 400.0, "status": "disbursed"},
+    ])
+    mongo.payment_schedules.insert_many([
+        {"id": "s1", "application_id": "half", "user_id": "u1", "status": "pending"},
+        {"id": "s2", "application_id": "repaid", "user_id": "u1", "status": "paid", "paid_date": NOW},
+    ])
+    # Guarantees recorded before exposure was tracked per guarantee
+    mongo.guarantors.insert_many([server.with_id(document) for document in [
+        {"id": "a", "application_id": "pending", "guarantor_user_id": "g1", "status": "accepted", "guaranteed_amount": 400.0},
+        {"id": "b", "application_id": "half", "guarantor_user_id": "g1", "status": "accepted", "guaranteed_amount": 400.0},
+        {"id": "c", "application_id": "repaid", "guarantor_user_id": "g1", "status": "accepted", "guaranteed_amount": 200.0},
+        {"id": "d", "application_id": "rejected", "guarantor_user_id": "g2", "status": "accepted", "guaranteed_amount": 300.0},
+        {"id": "e", "application_id": "pending", "guarantor_user_id": "g2", "status": "pending", "guaranteed_amount": 200.0},
+    ]])
+    return mongo
+
+
+def test_migration_keeps_only_live_exposure(legacy_guarantees):
+    assert server.migrate_guarantee_exposure() == 5
+    server.rebuild_member_stats()
+
+    exposures = {g["id"]: g["exposure"] for g in legacy_guarantees.guarantors.find()}
+    stats = server.get_member_stats_map(["g1", "g2"])
+
+    assert exposures == {"a": 400.0, "b": 200.0, "c": 0.0, "d": 0.0, "e": 0.0}
+    assert (stats["g1"]["guarantee_exposure"], stats["g1"]["guarantee_capacity"]) == (600.0, 400.0)
+    assert (stats["g2"]["guarantee_exposure"], stats["g2"]["guarantee_capacity"]) == (0.0, 600.0)
+
+    config = server.SystemConfig(minimum_deposit_for_guarantor=500.0)
+    assert server.check_guarantor_eligibility("g1", stats["g1"], config) == (False, 1000.0)
+    assert server.check_guarantor_eligibility("g2", stats["g2"], config) == (True, 600.0)
+
+
+def test_released_exposure_matches_the_rebuild(legacy_guarantees):
+    server.migrate_guarantee_exposure()
+    server.rebuild_member_stats()
+
+    assert server.release_guarantee_exposure(["pending", "half"]) == ["g1"]
+    incremental = server.get_member_stats("g1")
+    server.rebuild_member_stats()
+    rebuilt = server.get_member_stats("g1")
+
+    assert incremental["guarantee_capacity"] == rebuilt["guarantee_capacity"] == 1000.0
+    assert incremental["guarantee_exposure"] == rebuilt["guarantee_exposure"] == 0.0
+
+
+@pytest.fixture
+def pending_requests(legacy_guarantees):
+    server.migrate_guarantee_exposure()
+    server.rebuild_member_stats()
+    legacy_guarantees.system_config.delete_many({})
+    legacy_guarantees.guarantors.insert_many([server.with_id(document) for document in [
+        {"id": "f", "application_id": "pending", "guarantor_user_id": "g2", "status": "pending",
+         "guaranteed_amount": 400.0, "exposure": 0.0},
+        {"id": "g", "application_id": "half", "guarantor_user_id": "g2", "status": "pending",
+         "guaranteed_amount": 400.0, "exposure": 0.0},
+    ]])
+    return legacy_guarantees
+
+
+def respond(guarantor_id, user_id, status="accepted"):
+    return asyncio.run(server.respond_to_guarantor_request(guarantor_id, {"status": status}, {"id": user_id}))
+
+
+def safely(call):
+    try:
+        call()
+    except HTTPException as error:
+        return error.status_code
+
+
+def test_accepting_needs_free_deposits(pending_requests):
+    # g2 has 600 of deposits: one 400 guarantee fits, a second would not
+    respond("e", "g2")
+    with pytest.raises(HTTPException) as error:
+        respond("f", "g2")
+
+    stats = server.get_member_stats("g2")
+    assert error.value.status_code == 400
+    assert (stats["guarantee_exposure"], stats["guarantee_capacity"]) == (200.0, 400.0)
+    assert pending_requests.guarantors.find_one(server.by_id("f"))["status"] == "pending"
+
+
+def test_a_request_is_answered_once(pending_requests):
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        outcomes = list(executor.map(lambda _: safely(lambda: respond("f", "g2")), range(4)))
+
+    assert outcomes.count(None) == 1
+    assert server.get_member_stats("g2")["guarantee_exposure"] == 400.0
+
+
+def test_overlapping_exposure_updates_count_once(pending_requests):
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        list(executor.map(lambda _: server.release_guarantee_exposure(["pending", "half"]), range(4)))
+
+    incremental = server.get_member_stats("g1")
+    server.rebuild_member_stats()
+    assert incremental["guarantee_exposure"] == server.get_member_stats("g1")["guarantee_exposure"] == 0.0
+
+
+
+def test_eligibility_and_acceptance_apply_the_same_rule(pending_requests):
+    config = server.get_system_config()
+    for guarantor_id in ["f", "g"]:
+        eligible, _ = server.check_guarantor_eligibility("g2", config=config, guaranteed_amount=400.0)
+        # g2's 600 of deposits cover the first 400 guarantee but not the second
+        assert eligible == (safely(lambda: respond(guarantor_id, "g2")) is None) == (guarantor_id == "f")
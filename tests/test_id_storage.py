@@ -0,0 +1,50 @@
+"""Primary-key id storage"""
+import pytest
+
+import repository
+import server
+
+
+def test_by_id_targets_the_configured_key(monkeypatch):
+    assert server.by_id("u1") == {"id": "u1"}
+
+    monkeypatch.setattr(repository, "ID_STORAGE", "primary")
+
+    assert server.by_id({"$in": ["u1", "u2"]}) == {"_id": {"$in": ["u1", "u2"]}}
+    assert server.with_id({"id": "u1", "email": "a@example.com"})["_id"] == "u1"
+
+
+def test_migration_moves_uuids_into_the_primary_key(mongo, monkeypatch):
+    for name in server.ID_COLLECTIONS:
+        mongo[name].delete_many({})
+    mongo.users.drop()
+    mongo.users.create_index("id", unique=True)
+    mongo.users.insert_many([{"id": f"u{number}", "email": f"u{number}@example.com"} for number in range(5)])
+
+    monkeypatch.setattr(repository, "ID_STORAGE", "primary")
+    server.ensure_id_indexes()
+    assert server.migrate_id_storage(batch_size=2) == 5
+
+    assert "id_1" not in mongo.users.index_information()
+    assert sorted(user["_id"] for user in mongo.users.find()) == [f"u{number}" for number in range(5)]
+    assert mongo.users.find_one(server.by_id("u3"))["email"] == "u3@example.com"
+    assert server.migrate_id_storage() == 0
+
+
+def test_an_interrupted_migration_is_finished_and_gates_startup(mongo, monkeypatch):
+    for name in server.ID_COLLECTIONS:
+        mongo[name].delete_many({})
+    mongo.disbursements.drop()
+    mongo.disbursements.insert_many([{"id": f"d{number}", "application_id": f"a{number}"} for number in range(3)])
+    monkeypatch.setattr(repository, "ID_STORAGE", "primary")
+
+    # A run that dropped the unique index and copied d0 before it was stopped
+    mongo.disbursements.insert_one({"_id": "d0", "id": "d0", "application_id": "a0"})
+
+    with pytest.raises(RuntimeError):
+        server.require_id_storage_migrated()
+    assert server.migrate_id_storage(batch_size=2) == 3
+
+    server.require_id_storage_migrated()
+    assert sorted(d["_id"] for d in mongo.disbursements.find()) == ["d0", "d1", "d2"]
+    assert mongo.disbursements.index_information()["application_id_1"].get("unique")
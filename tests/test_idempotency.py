@@ -0,0 +1,134 @@
+"""Idempotency-Key handling for money-moving POSTs"""
+import asyncio
+import time
+from datetime import datetime, timedelta
+
+import pytest
+from fastapi import HTTPException
+from starlette.requests import Request
+
+import server
+
+
+@pytest.fixture
+def keys(mongo):
+    mongo.idempotency_keys.delete_many({})
+    mongo.idempotency_keys.create_index("id", unique=True)
+    return mongo.idempotency_keys
+
+
+def keyed_request(key):
+    return Request({"type": "http", "headers": [(b"idempotency-key", key.encode())]})
+
+
+def test_retries_replay_the_stored_response(keys):
+    calls = []
+
+    def execute():
+        calls.append(1)
+        return {"id": len(calls)}
+
+    first = asyncio.run(server.idempotent(keyed_request("k1"), "test", {"amount": 5}, execute))
+    retry = asyncio.run(server.idempotent(keyed_request("k1"), "test", {"amount": 5}, execute))
+
+    assert first == {"id": 1}
+    assert retry.headers["idempotent-replayed"] == "true"
+    assert retry.body == b'{"id":1}'
+    assert len(calls) == 1
+
+    with pytest.raises(HTTPException) as reused:
+        asyncio.run(server.idempotent(keyed_request("k1"), "test", {"amount": 6}, execute))
+    assert reused.value.status_code == 400
+
+
+def test_concurrent_duplicates_wait_for_the_first(keys):
+    calls = []
+
+    async def duplicate_while_first_runs():
+        leader = asyncio.Event()
+
+        async def finish_leader():
+            await asyncio.sleep(0.3)
+            keys.update_one(
+                {"id": "test:k2"},
+                {"$set": {"status": "completed", "status_code": 200, "response": {"id": "leader"}}}
+            )
+            leader.set()
+
+        # The first request has claimed the key and is still executing
+        now = datetime.utcnow()
+        keys.insert_one({
+            "id": "test:k2",
+            "fingerprint": server.request_fingerprint({}),
+            "status": "in_progress",
+            "locked_until": now + timedelta(seconds=30),
+            "created_at": now,
+            "expires_at": now + timedelta(hours=1)
+        })
+        finishing = asyncio.create_task(finish_leader())
+        response = await server.idempotent(keyed_request("k2"), "test", {}, lambda: calls.append(1))
+        await finishing
+        return response, leader.is_set()
+
+    response, leader_finished = asyncio.run(duplicate_while_first_runs())
+
+    assert leader_finished
+    assert response.body == b'{"id":"leader"}'
+    assert calls == []
+
+
+def test_failures_release_the_key(keys):
+
+    def fail():
+        raise HTTPException(status_code=400, detail="Insufficient funds")
+
+    with pytest.raises(HTTPException):
+        asyncio.run(server.idempotent(keyed_request("k3"), "test", {}, fail))
+
+    assert asyncio.run(server.idempotent(keyed_request("k3"), "test", {}, lambda: {"ok": True})) == {"ok": True}
+
+
+def test_long_executions_keep_their_claim(keys, monkeypatch):
+    monkeypatch.setattr(server, "IDEMPOTENCY_LOCK_SECONDS", 0.3)
+    seen = {}
+
+    def slow():
+        time.sleep(1)
+        seen["record"] = keys.find_one({"id": "test:k4"})
+        return {"ok": True}
+
+    asyncio.run(server.idempotent(keyed_request("k4"), "test", {}, slow))
+
+    # Past the original lock, but renewed, so a duplicate could not take over
+    assert seen["record"]["locked_until"] > datetime.utcnow() - timedelta(seconds=0.1)
+    assert keys.find_one({"id": "test:k4"})["status"] == "completed"
+
+
+def test_a_lost_claim_is_not_completed(keys):
+
+    def taken_over():
+        keys.update_one({"id": "test:k5"}, {"$set": {"owner": "another attempt"}})
+        return {"ok": True}
+
+    with pytest.raises(HTTPException) as lost:
+        asyncio.run(server.idempotent(keyed_request("k5"), "test", {}, taken_over))
+    assert lost.value.status_code == 409
+
+    record = keys.find_one({"id": "test:k5"})
+    assert (record["status"], record["owner"]) == ("in_progress", "another attempt")
+
+
+def test_renewals_flag_a_claim_taken_over_mid_execution(keys, monkeypatch, caplog):
+    monkeypatch.setattr(server, "IDEMPOTENCY_LOCK_SECONDS", 0.3)
+
+    def taken_over_then_slow():
+        keys.update_one({"id": "test:k6"}, {"$set": {"owner": "another attempt"}})
+        time.sleep(0.5)
+        return {"ok": True}
+
+    with pytest.raises(HTTPException) as lost:
+        asyncio.run(server.idempotent(keyed_request("k6"), "test", {}, taken_over_then_slow))
+
+    assert lost.value.status_code == 409
+    assert "test:k6 was taken over while its request ran" in caplog.text
+    assert keys.find_one({"id": "test:k6"})["status"] == "in_progress"
@@ -0,0 +1,103 @@
+"""Background job runner"""
+from datetime import datetime, timedelta
+import threading
+import time
+
+from jobs import FAILED, QUEUED, SUCCEEDED, JobRunner, JobType
+
+
+def wait_for(runner, job_id, statuses=(SUCCEEDED, FAILED), timeout=5):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        job = runner.get(job_id)
+        if job["status"] in statuses:
+            return job
+        time.sleep(0.05)
+    raise AssertionError(f"job {job_id} still {job['status']}")
+
+
+def make_runner(mongo, job_types, **options):
+    mongo.jobs.delete_many({})
+    mongo.job_locks.delete_many({})
+    runner = JobRunner(lambda: mongo, job_types, process_workers=0, poll_seconds=0.05, **options)
+    runner.ensure_indexes()
+    return runner
+
+
+def test_jobs_run_and_record_their_outcome(mongo):
+    def count(params, progress):
+        progress(params["to"], params["to"], "done")
+        return {"counted": params["to"]}
+
+    def explode(params, progress):
+        raise ValueError("boom")
+
+    runner = make_runner(mongo, [JobType("count", count), JobType("explode", explode)])
+    runner.start()
+    try:
+        counted = wait_for(runner, runner.submit("count", {"to": 3})["id"])
+        failed = wait_for(runner, runner.submit("explode")["id"])
+    finally:
+        runner.stop()
+
+    assert counted["status"] == SUCCEEDED
+    assert counted["result"] == {"counted": 3}
+    assert counted["progress"] == {"done": 3, "total": 3, "message": "done"}
+    assert failed["status"] == FAILED
+    assert failed["error"] == "ValueError: boom"
+
+
+def test_singletons_are_not_queued_twice(mongo):
+    release = threading.Event()
+    runner = make_runner(mongo, [JobType("rebuild", lambda params, progress: release.wait(5), singleton=True)])
+    runner.start()
+    try:
+        first = runner.submit("rebuild")
+        second = runner.submit("rebuild")
+        release.set()
+        wait_for(runner, first["id"])
+    finally:
+        runner.stop()
+
+    assert second["id"] == first["id"]
+    assert mongo.jobs.count_documents({}) == 1
+    assert mongo.job_locks.count_documents({}) == 0
+
+
+def test_a_requeued_singleton_waits_for_the_stalled_worker(mongo):
+    release = threading.Event()
+    job_types = [JobType("rebuild", lambda params, progress: release.wait(5), singleton=True)]
+    stalled = make_runner(mongo, job_types)
+    other = JobRunner(lambda: mongo, job_types, process_workers=0)
+    stalled.start()
+    try:
+        job = stalled.submit("rebuild")
+        wait_for(stalled, job["id"], statuses=("running",))
+        # The worker stops renewing while the handler is still running
+        stalled.stop()
+        mongo.jobs.update_one({"id": job["id"]}, {"$set": {"lease_expires_at": datetime.utcnow() - timedelta(seconds=1)}})
+        other._recover_expired()
+        other._claim()
+
+        requeued = other.get(job["id"])
+        assert requeued["status"] == QUEUED
+        assert not other._running
+        assert mongo.job_locks.find_one({"_id": "rebuild"})["owner"] == f"{stalled.worker_id}:{job['id']}"
+        # Still the active singleton, so submitting again returns it
+        assert other.submit("rebuild")["id"] == job["id"]
+    finally:
+        release.set()
+
+
+def test_jobs_from_a_dead_worker_are_requeued_then_failed(mongo):
+    runner = make_runner(mongo, [JobType("work", lambda params, progress: None)], max_attempts=2)
+    expired = datetime.utcnow() - timedelta(seconds=1)
+    job = runner.submit("work")
+    mongo.jobs.update_one({"id": job["id"]}, {"$set": {"status": "running", "attempts": 1, "lease_expires_at": expired}})
+
+    runner._recover_expired()
+    assert runner.get(job["id"])["status"] == QUEUED
+
+    mongo.jobs.update_one({"id": job["id"]}, {"$set": {"status": "running", "attempts": 2, "lease_expires_at": expired}})
+    runner._recover_expired()
+    assert runner.get(job["id"])["status"] == FAILED
@@ -0,0 +1,104 @@
+"""Mongo client lifecycle and startup tasks"""
+import asyncio
+
+import pytest
+
+import server
+
+
+class FakeClient:
+    def __init__(self, url, **options):
+        self.url = url
+        self.options = options
+        self.closed = False
+
+    def __getitem__(self, name):
+        return ("db", name)
+
+    def get_database(self, name, read_preference=None):
+        return ("db", name, read_preference.mongos_mode)
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def isolated(monkeypatch):
+    """Keep the session's real client and handles intact"""
+    for name in ["client", "db"]:
+        monkeypatch.setattr(server, name, getattr(server, name))
+    for name in ["read_dbs", "transaction_support"]:
+        monkeypatch.setattr(server, name, dict(getattr(server, name)))
+    monkeypatch.setattr(server, "MongoClient", FakeClient)
+
+
+def test_connect_and_close_manage_the_client(isolated, monkeypatch):
+    monkeypatch.setattr(server, "MONGO_MAX_POOL_SIZE", 20)
+    monkeypatch.setattr(server, "MONGO_COMPRESSORS", "zstd")
+
+    server.connect_mongo()
+    client = server.client
+
+    assert (client.options["maxPoolSize"], client.options["compressors"]) == (20, "zstd")
+    assert server.db == ("db", server.DB_NAME)
+    assert server.read_db("analytics") == ("db", server.DB_NAME, "secondaryPreferred")
+
+    server.close_mongo()
+
+    assert client.closed
+    assert (server.client, server.db, server.read_dbs) == (None, None, {})
+
+
+@pytest.fixture
+def calls(isolated, monkeypatch):
+    calls = []
+    for name in ["connect_mongo", "run_startup_tasks", "require_id_storage_migrated", "start_change_stream_watcher",
+                 "stop_change_stream_watcher", "close_mongo"]:
+        monkeypatch.setattr(server, name, lambda name=name: calls.append(name))
+    monkeypatch.setattr(server.job_runner, "start", lambda: calls.append("job_runner.start"))
+    monkeypatch.setattr(server.job_runner, "stop", lambda: calls.append("job_runner.stop"))
+    return calls
+
+
+def serve():
+    async def run():
+        async with server.lifespan(server.app):
+            pass
+    asyncio.run(run())
+
+
+def test_lifespan_connects_first_and_closes_last(calls, monkeypatch):
+    monkeypatch.delenv("RUN_STARTUP_TASKS", raising=False)
+    serve()
+
+    assert calls == [
+        "connect_mongo", "run_startup_tasks", "require_id_storage_migrated", "start_change_stream_watcher",
+        "job_runner.start",
+        "job_runner.stop", "stop_change_stream_watcher", "close_mongo"
+    ]
+
+
+def test_workers_skip_startup_tasks_run_by_the_parent(calls, monkeypatch):
+    monkeypatch.setenv("RUN_STARTUP_TASKS", "false")
+    serve()
+
+    assert "run_startup_tasks" not in calls
+    # Workers still refuse to serve before the id storage migration finished
+    assert calls[:2] == ["connect_mongo", "require_id_storage_migrated"]
+
+
+def test_startup_tasks_create_indexes_before_migrating(monkeypatch):
+    steps = []
+    for name in ["create_admin_user", "ensure_indexes", "migrate_id_storage", "migrate_schedule_layout",
+                 "migrate_fund_pool_stripes", "migrate_guarantee_exposure", "migrate_member_stats",
+                 "migrate_existing_applications", "migrate_search_index", "migrate_daily_rollups",
+                 "get_system_config"]:
+        monkeypatch.setattr(server, name, lambda name=name: steps.append(name))
+    monkeypatch.setattr(server, "bump_versions", lambda *names: steps.append(("bump_versions", names)))
+
+    server.run_startup_tasks()
+
+    assert steps.index("ensure_indexes") < min(steps.index(step) for step in steps if str(step).startswith("migrate_"))
+    # Member stats are rebuilt from exposure the guarantee migration fills in
+    assert steps.index("migrate_guarantee_exposure") < steps.index("migrate_member_stats")
+    assert steps[-1] == ("bump_versions", ("epoch",))
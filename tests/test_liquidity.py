@@ -0,0 +1,87 @@
+"""Liquidity cash-flow forecast"""
+from datetime import date, datetime
+
+import pandas as pd
+import pytest
+
+from liquidity import compute_liquidity_forecast
+
+START = date(2024, 6, 15)
+
+
+def inflows(*rows):
+    return pd.DataFrame({
+        "due_date": pd.to_datetime([datetime.fromisoformat(due) for due, _ in rows]),
+        "remaining": [float(amount) for _, amount in rows]
+    })
+
+
+@pytest.fixture
+def schedule():
+    return inflows(
+        ("2024-06-10", 40),   # overdue, left out of the projection
+        ("2024-06-15", 100),
+        ("2024-06-17", 50),
+        ("2024-07-20", 200),
+    )
+
+
+def test_daily_balances(schedule):
+    forecast = compute_liquidity_forecast(1000, schedule, 300, 900, START, "daily", 5)
+    series = forecast["series"]
+
+    assert [row["period_start"] for row in series][:3] == ["2024-06-15", "2024-06-16", "2024-06-17"]
+    assert [row["balance"] for row in series] == [800, 800, 850, 850, 850]
+    assert forecast["overdue_inflows"] == 40
+    assert forecast["scheduled_inflows"] == 150
+    assert forecast["first_shortfall"] is None
+    assert forecast["first_shortfall_with_pending"] == "2024-06-15"
+    assert forecast["minimum_balance_with_pending"] == -100
+
+
+def test_monthly_balances(schedule):
+    forecast = compute_liquidity_forecast(0, schedule, 500, 0, START, "monthly", 3)
+
+    assert [row["period_start"] for row in forecast["series"]] == ["2024-06-01", "2024-07-01", "2024-08-01"]
+    assert [row["inflows"] for row in forecast["series"]] == [150, 200, 0]
+    assert [row["balance"] for row in forecast["series"]] == [-350, -150, -150]
+    assert forecast["first_shortfall"] == "2024-06-01"
+
+
+def test_no_scheduled_inflows():
+    forecast = compute_liquidity_forecast(250, inflows(), 0, 0, START, "daily", 3)
+
+    assert [row["balance"] for row in forecast["series"]] == [250, 250, 250]
+
+
+class ReadOnlyCache:
+    """Database handle whose report cache refuses writes, like a secondary"""
+
+    def __init__(self, database):
+        self.database = database
+
+    def __getattr__(self, name):
+        collection = getattr(self.database, name)
+        if name == "report_cache":
+            collection = type("ReadOnlyCollection", (), {
+                "find_one": collection.find_one,
+                "update_one": lambda *args, **kwargs: pytest.fail("report_cache written through a read handle")
+            })()
+        return collection
+
+    def __getitem__(self, name):
+        return self.__getattr__(name)
+
+
+def test_forecasts_are_cached_on_the_primary(mongo, monkeypatch):
+    import portfolio
+    import server
+
+    mongo.report_cache.delete_many({})
+    portfolio._memory_cache.clear()
+    monkeypatch.setattr(server, "read_db", lambda profile: ReadOnlyCache(mongo))
+
+    forecast = server.get_liquidity_forecast(server.ForecastGranularity.DAILY, 3, {"id": "admin"})
+
+    assert len(forecast["series"]) == 3
+    assert mongo.report_cache.count_documents({"id": {"$regex": "^liquidity:"}}) == 1
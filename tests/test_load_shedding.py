@@ -0,0 +1,64 @@
+"""Time budgets and concurrency limits for heavy reads"""
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from fastapi import Depends, FastAPI
+from fastapi.testclient import TestClient
+from pymongo.errors import ExecutionTimeout
+
+import server
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(server, "LOAD_SHED_WAIT_SECONDS", 0.1)
+    monkeypatch.setitem(server.route_limits, "exports", server.RouteLimit(1))
+    app = FastAPI()
+
+    @app.get("/report", dependencies=[Depends(server.route_class("exports"))])
+    def report():
+        return {"ok": True}
+
+    @app.get("/slow-report", dependencies=[Depends(server.route_class("exports"))])
+    def slow_report():
+        raise ExecutionTimeout("operation exceeded time limit", 50)
+
+    # One event loop for every request, as in a worker
+    with TestClient(app) as client:
+        yield client
+
+
+def test_requests_past_the_limit_are_shed(client):
+    limit = server.route_limits["exports"]
+    assert client.portal.call(limit.acquire, 1)
+    try:
+        response = client.get("/report")
+    finally:
+        client.portal.call(limit.release)
+
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == str(server.LOAD_SHED_RETRY_AFTER_SECONDS)
+    assert client.get("/report").status_code == 200
+
+
+def test_waiting_requests_get_the_released_slot(client, monkeypatch):
+    monkeypatch.setattr(server, "LOAD_SHED_WAIT_SECONDS", 5)
+    limit = server.route_limits["exports"]
+    assert client.portal.call(limit.acquire, 1)
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        waiting = executor.submit(client.get, "/report")
+        time.sleep(0.2)
+        assert not waiting.done()
+        client.portal.call(limit.release)
+        assert waiting.result(timeout=5).status_code == 200
+    assert limit.in_flight == 0
+
+
+def test_exceeded_budget_is_a_retryable_503(client):
+    response = client.get("/slow-report")
+
+    assert response.status_code == 503
+    assert "Retry-After" in response.headers
+    assert server.route_limits["exports"].in_flight == 0
@@ -0,0 +1,64 @@
+"""Incrementally maintained member stats"""
+import asyncio
+
+import pytest
+
+import server
+
+MEMBER = {"id": "u1", "full_name": "Member", "email": "u1@example.com", "country": "X", "role": "member"}
+ADMIN = {"id": "admin", "full_name": "Admin", "role": "general_admin", "country": "X"}
+REBUILT_FIELDS = [
+    "total_deposits", "deposit_count", "total_applications", "outstanding_principal",
+    "guarantee_exposure", "guarantee_capacity"
+]
+
+
+def test_status_deltas_move_one_application_between_counts():
+    assert server.application_status_deltas(None, "pending") == {
+        "application_counts.pending": 1, "total_applications": 1
+    }
+    assert server.application_status_deltas("pending", "approved") == {
+        "application_counts.approved": 1, "application_counts.pending": -1
+    }
+    assert server.application_status_deltas("approved", "approved") == {}
+
+
+@pytest.fixture
+def member(mongo):
+    for name in ["users", "deposits", "finance_applications", "guarantors", "approval_history", "member_stats", "system_config"]:
+        mongo[name].delete_many({})
+        mongo[server.ARCHIVE_COLLECTIONS.get(name, name)].delete_many({})
+    mongo.users.insert_one(server.with_id({**MEMBER, "is_active": True}))
+    return mongo
+
+
+def apply(amount):
+    request = server.FinanceApplicationCreate(amount=amount, purpose="stock", requested_duration_months=6)
+    return asyncio.run(server.create_finance_application(request, MEMBER))
+
+
+def decide(application_id, action):
+    request = server.BulkDecisionRequest(items=[server.BulkDecisionItem(application_id=application_id, action=action)])
+    return asyncio.run(server.bulk_decide_applications(request, ADMIN))
+
+
+def counts(stats):
+    return {status: count for status, count in stats["application_counts"].items() if count}
+
+
+def test_increments_match_the_rebuild(member):
+    server.record_deposit(server.DepositCreate(amount=250.0), MEMBER)
+    server.record_deposit(server.DepositCreate(amount=50.0), MEMBER)
+    first = apply(100.0)
+    second = apply(200.0)
+    decide(first.id, "approve")
+    decide(second.id, "reject")
+
+    incremental = server.get_member_stats("u1")
+    server.rebuild_member_stats()
+    rebuilt = server.get_member_stats("u1")
+
+    assert {field: incremental[field] for field in REBUILT_FIELDS} == {field: rebuilt[field] for field in REBUILT_FIELDS}
+    assert (incremental["total_deposits"], incremental["deposit_count"]) == (300.0, 2)
+    # Increments leave emptied statuses at zero where the rebuild omits them
+    assert counts(incremental) == counts(rebuilt) == {"approved": 1, "rejected": 1}
@@ -0,0 +1,114 @@
+"""Loan portfolio metrics"""
+from datetime import datetime
+
+import pandas as pd
+import pytest
+
+from portfolio import compute_portfolio_metrics, get_portfolio_report
+
+AS_OF = datetime(2024, 6, 30, 23, 59, 59)
+
+
+def installment(application_id, user_id, due, principal, interest, paid=0.0, paid_date=None):
+    return {
+        "application_id": application_id,
+        "user_id": user_id,
+        "due_date": datetime.fromisoformat(due),
+        "amount": principal + interest,
+        "principal_amount": principal,
+        "interest_amount": interest,
+        "paid_amount": paid,
+        "paid_date": datetime.fromisoformat(paid_date) if paid_date else None
+    }
+
+
+@pytest.fixture
+def book():
+    rows = [
+        # Loan A: first installment paid, second not yet due -> current
+        installment("A", "u1", "2024-06-01", 100, 10, paid=110, paid_date="2024-06-01"),
+        installment("A", "u1", "2024-07-01", 100, 10),
+        # Loan B: 45 days past due, half of the overdue installment paid
+        installment("B", "u2", "2024-05-16", 200, 20, paid=110, paid_date="2024-05-20"),
+        installment("B", "u2", "2024-06-16", 200, 20),
+        # Loan C: fully repaid, but the last payment lands after the as-of date
+        installment("C", "u3", "2024-06-20", 50, 5, paid=55, paid_date="2024-07-05"),
+    ]
+    countries = {"u1": "Kenya", "u2": "Uganda"}
+    return pd.DataFrame(rows), countries
+
+
+def test_outstanding_and_interest(book):
+    report = compute_portfolio_metrics(*book, AS_OF)
+
+    assert report["loan_count"] == 3
+    assert report["outstanding_principal"] == pytest.approx(100 + 300 + 50)
+    assert report["interest_income"] == pytest.approx(10 + 10)
+
+
+def test_aging_and_par(book):
+    report = compute_portfolio_metrics(*book, AS_OF)
+    aging = {row["bucket"]: row for row in report["aging"]}
+
+    assert aging["current"]["loan_count"] == 1
+    assert aging["1-30"]["outstanding_principal"] == pytest.approx(50)
+    assert aging["31-60"]["outstanding_principal"] == pytest.approx(300)
+    assert aging["90+"]["loan_count"] == 0
+    assert report["par"]["par_1"] == pytest.approx(350 / 450, abs=1e-4)
+    assert report["par"]["par_30"] == pytest.approx(300 / 450, abs=1e-4)
+    assert report["par"]["par_90"] == 0
+
+
+def test_country_breakdown(book):
+    report = compute_portfolio_metrics(*book, AS_OF)
+    countries = {row["country"]: row for row in report["countries"]}
+
+    assert [row["country"] for row in report["countries"]] == ["Uganda", "Kenya", "Unknown"]
+    assert countries["Uganda"]["par_30"] == 1.0
+    assert countries["Kenya"]["interest_income"] == pytest.approx(10)
+    assert countries["Unknown"]["outstanding_principal"] == pytest.approx(50)
+
+
+def test_empty_book():
+    report = compute_portfolio_metrics(pd.DataFrame(), {}, AS_OF)
+
+    assert report["loan_count"] == 0
+    assert report["par"]["par_30"] == 0.0
+
+
+def test_report_is_cached_per_version(mongo):
+    mongo.users.insert_one({"id": "u1", "country": "Kenya"})
+    mongo.disbursements.insert_one({
+        "application_id": "A", "status": "disbursed", "disbursement_date": datetime(2024, 5, 1)
+    })
+    mongo.payment_schedules.insert_one(installment("A", "u1", "2024-06-01", 100, 10))
+
+    first = get_portfolio_report(mongo, AS_OF.date(), version=1)
+    assert first["aging"][1]["outstanding_principal"] == 100
+
+    mongo.payment_schedules.update_one({"application_id": "A"}, {"$set": {"paid_amount": 110, "paid_date": datetime(2024, 6, 1)}})
+    assert get_portfolio_report(mongo, AS_OF.date(), version=1) == first
+    assert get_portfolio_report(mongo, AS_OF.date(), version=2)["loan_count"] == 0
+
+
+def test_report_only_loads_loans_disbursed_by_the_as_of_date(mongo):
+    for name in ["users", "disbursements", "payment_schedules", "loan_schedules"]:
+        mongo[name].delete_many({})
+    mongo.users.insert_one({"id": "u1", "country": "Kenya"})
+    mongo.disbursements.insert_many([
+        {"application_id": "A", "status": "disbursed", "disbursement_date": datetime(2024, 5, 1)},
+        {"application_id": "B", "status": "disbursed", "disbursement_date": datetime(2024, 8, 1)},
+    ])
+    mongo.payment_schedules.insert_many([
+        installment("A", "u1", "2024-06-01", 100, 10),
+        installment("B", "u1", "2024-06-01", 300, 30),
+    ])
+    mongo.loan_schedules.insert_one({
+        "application_id": "C", "user_id": "u1",
+        "installments": [installment("C", "u1", "2024-06-01", 500, 50)]
+    })
+
+    report = get_portfolio_report(mongo, AS_OF.date(), version=3)
+
+    assert report["loan_count"] == 1
+    assert report["outstanding_principal"] == 100
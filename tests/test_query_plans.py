@@ -0,0 +1,364 @@
+"""Query plans of the queries the API issues.
+
+The endpoints are exercised against a seeded database while every command is
+recorded. Each distinct query shape is then explained as a find of its filter
+and sort, and the suite fails on collection scans, in-memory sorts and
+filters that examine many more documents than they return. Startup tasks are
+not recorded.
+"""
+import json
+import os
+import traceback
+import uuid
+from datetime import date, datetime, timedelta
+
+import pytest
+from bson import SON
+from fastapi.testclient import TestClient
+from pymongo import MongoClient, monitoring
+
+import server
+
+BACKEND = os.path.dirname(os.path.abspath(server.__file__))
+MAX_EXAMINED_RATIO = 10
+MIN_EXAMINED = 50
+FILLER_MEMBERS = 200
+ADMIN = ("admin@fundmanager.com", "FundAdmin2024!")
+
+# Deliberate exceptions: (function on the call stack or None for any,
+# collection, top-level filter fields or None for any) -> reason
+ALLOWED = {
+    (None, "system_config", None): "single-document collection",
+    (None, "fund_pool_stripes", None): "a few stripe documents, read whole",
+    ("get_approval_queue", "finance_applications", frozenset({"user_id", "status", "amount"})):
+        "coordinator queue filters by the country's user ids and sorts them in memory",
+    ("find_outstanding_installments", "payment_schedules", None):
+        "one member's open installments, sorted by due date and number in memory",
+    ("get_fund_admin_dashboard", None, None): "analytics counts over all applications",
+    ("get_general_admin_dashboard", None, None): "analytics counts over all applications",
+    ("build_liquidity_forecast", None, None): "forecast reads every outstanding installment",
+    ("recalculate_fund_pool_totals", None, None): "full recount on demand",
+    ("rebuild_member_stats", None, None): "rebuilds read every document",
+    ("rebuild_daily_rollups", None, None): "rebuilds read every document",
+    ("rescore_members", None, None): "batch scoring reads every installment that has fallen due",
+    ("run_archival", None, None): "maintenance batch over closed loans",
+}
+
+RECORDED_COMMANDS = {"find", "aggregate", "count", "distinct", "findAndModify", "update", "delete"}
+
+
+class CommandRecorder(monitoring.CommandListener):
+    """Keeps query commands with the backend functions that issued them"""
+
+    def __init__(self):
+        self.recording = False
+        self.commands = []
+
+    def started(self, event):
+        if not self.recording or event.command_name not in RECORDED_COMMANDS:
+            return
+        callers = tuple(
+            frame.name for frame in traceback.extract_stack()
+            if os.path.dirname(os.path.abspath(frame.filename)) == BACKEND
+        )
+        self.commands.append((event.command_name, SON(event.command), callers))
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+
+def selections(command_name: str, command: dict) -> list:
+    """(collection, filter, sort) of each document selection in a command"""
+    if command_name == "find":
+        return [(command["find"], command.get("filter", {}), command.get("sort"))]
+    if command_name == "findAndModify":
+        return [(command["findAndModify"], command.get("query", {}), command.get("sort"))]
+    if command_name in ("count", "distinct"):
+        return [(command[command_name], command.get("query", {}), None)]
+    if command_name == "update":
+        return [(command["update"], update["q"], None) for update in command["updates"]]
+    if command_name == "delete":
+        return [(command["delete"], delete["q"], None) for delete in command["deletes"]]
+    if command_name == "aggregate" and isinstance(command["aggregate"], str):
+        # A $match after $unionWith is pushed into both collections
+        pipeline = list(command["pipeline"])
+        unions = []
+        while pipeline and "$unionWith" in pipeline[0]:
+            unions.append(pipeline.pop(0)["$unionWith"])
+        match = pipeline[0]["$match"] if pipeline and "$match" in pipeline[0] else {}
+        sort = pipeline[1]["$sort"] if match and len(pipeline) > 1 and "$sort" in pipeline[1] else None
+        found = [(command["aggregate"], match, sort)]
+        for union in unions:
+            inner = union.get("pipeline") or []
+            found.append((union["coll"], inner[0]["$match"] if inner and "$match" in inner[0] else match, sort))
+        return found
+    return []
+
+
+def shape(value):
+    """Filter with its values replaced by their types"""
+    if isinstance(value, dict):
+        return {key: shape(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [shape(item) for item in value[:1]]
+    return type(value).__name__
+
+
+def plan_stages(plan) -> list:
+    if isinstance(plan, dict):
+        return ([plan["stage"]] if "stage" in plan else []) + [
+            stage for key, item in plan.items() if key != "rejectedPlans" for stage in plan_stages(item)
+        ]
+    if isinstance(plan, list):
+        return [stage for item in plan for stage in plan_stages(item)]
+    return []
+
+
+def plan_problems(explain: dict, filtered: bool) -> list:
+    problems = []
+    stages = plan_stages(explain["queryPlanner"]["winningPlan"])
+    if "COLLSCAN" in stages and filtered:
+        problems.append("collection scan")
+    if "SORT" in stages:
+        problems.append("in-memory sort")
+    examined = explain["executionStats"]["totalDocsExamined"]
+    returned = explain["executionStats"]["nReturned"]
+    if examined > MIN_EXAMINED and examined > MAX_EXAMINED_RATIO * max(returned, 1):
+        problems.append(f"examined {examined} documents to return {returned}")
+    return problems
+
+
+def allowed(callers: tuple, collection: str, query: dict) -> bool:
+    fields = frozenset(query)
+    return any(
+        (function is None or function in callers)
+        and (name is None or name == collection)
+        and (filter_fields is None or filter_fields == fields)
+        for function, name, filter_fields in ALLOWED
+    )
+
+
+def seed_filler_members():
+    """Members of another country with deposits and applications in every status"""
+    statuses = ["pending", "under_review", "requires_higher_approval", "approved", "rejected"]
+    now = datetime.utcnow()
+    users, deposits, applications = [], [], []
+    for number in range(FILLER_MEMBERS):
+        user_id = str(uuid.uuid4())
+        created_at = now - timedelta(days=number)
+        users.append({
+            "id": user_id, "email": f"filler{number}@example.com", "full_name": f"Filler {number}",
+            "country": "Filler", "phone": None, "role": "member", "is_active": True, "created_at": created_at
+        })
+        deposits.append({
+            "id": str(uuid.uuid4()), "user_id": user_id, "amount": 50.0, "description": None,
+            "status": "completed", "created_at": created_at
+        })
+        applications.append({
+            "id": str(uuid.uuid4()), "user_id": user_id, "amount": 40.0 + number, "purpose": "Filler",
+            "requested_duration_months": 6, "description": None, "status": statuses[number % len(statuses)],
+            "priority_score": 100.0, "previous_finances_count": 0, "review_notes": None, "conditions": None,
+            "approved_amount": None, "requires_higher_approval": False,
+            "reviewed_at": None, "reviewed_by": None, "created_at": created_at, "updated_at": created_at
+        })
+    server.db.users.insert_many([server.with_id(user) for user in users])
+    server.db.deposits.insert_many([server.with_id(deposit) for deposit in deposits])
+    server.db.finance_applications.insert_many([server.with_id(app) for app in applications])
+    server.rebuild_member_stats()
+    server.rebuild_daily_rollups()
+    server.rebuild_search_index()
+
+
+class ApiDriver:
+    """Calls endpoints by route path and remembers which routes were called"""
+
+    def __init__(self):
+        self.client = TestClient(server.app)
+        self.called = set()
+
+    def call(self, method: str, route: str, headers: dict = None, path: dict = None, **kwargs):
+        self.called.add(route)
+        response = self.client.request(method, route.format(**(path or {})), headers=headers, **kwargs)
+        assert response.status_code < 500, (route, response.text)
+        return response
+
+    def login(self, email: str, password: str) -> dict:
+        response = self.call("POST", "/api/auth/login", json={"email": email, "password": password})
+        return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+    def register(self, name: str, country: str) -> tuple:
+        response = self.call("POST", "/api/auth/register", json={
+            "email": f"{name}@example.com", "password": "secret1", "full_name": name, "country": country
+        })
+        body = response.json()
+        return body["user"]["id"], {"Authorization": f"Bearer {body['access_token']}"}
+
+
+def exercise_endpoints(api: ApiDriver):
+    admin = api.login(*ADMIN)
+    applicant_id, applicant = api.register("amina", "Kenya")
+    guarantor_id, guarantor = api.register("gideon", "Kenya")
+    coordinator_id, coordinator = api.register("cora", "Kenya")
+    api.call("PUT", "/api/admin/users/role", admin,
+             json={"user_id": coordinator_id, "new_role": "country_coordinator"})
+
+    api.call("POST", "/api/deposits", {**guarantor, "Idempotency-Key": "plan-deposit"}, json={"amount": 1000})
+    api.call("POST", "/api/deposits", applicant, json={"amount": 100})
+    loan = api.call("POST", "/api/finance-applications", applicant, json={
+        "amount": 300, "purpose": "Stock", "requested_duration_months": 3, "guarantors": [guarantor_id]
+    }).json()["id"]
+    declined = api.call("POST", "/api/finance-applications", applicant, json={
+        "amount": 20, "purpose": "Tools", "requested_duration_months": 2
+    }).json()["id"]
+
+    guarantee = api.call("GET", "/api/guarantor-requests", guarantor).json()[0]["id"]
+    api.call("PUT", "/api/guarantor-requests/{guarantor_id}/respond", guarantor,
+             path={"guarantor_id": guarantee}, json={"status": "accepted"})
+
+    queue = api.call("GET", "/api/admin/approval-queue", coordinator)
+    api.call("GET", "/api/admin/approval-queue", coordinator, params={"since": queue.headers["X-Change-Token"]})
+    api.call("GET", "/api/dashboard", coordinator)
+    api.call("PUT", "/api/admin/applications/{application_id}/approve", admin,
+             path={"application_id": loan}, json={"action": "approve", "recommended_amount": 300})
+    api.call("POST", "/api/admin/applications/bulk-decision", admin,
+             json={"items": [{"application_id": declined, "action": "reject"}]})
+    api.call("POST", "/api/admin/applications/{application_id}/disburse", {**admin, "Idempotency-Key": "plan-loan"},
+             path={"application_id": loan}, json={})
+    api.call("POST", "/api/admin/repayments", admin,
+             json={"user_id": applicant_id, "amount": 60, "reference": "plan-1"})
+    api.call("POST", "/api/admin/repayments/import", admin,
+             files={"file": ("statement.csv", "email,amount,reference\namina@example.com,40,plan-2\n", "text/csv")})
+
+    for route in ["/api/auth/me", "/api/deposits", "/api/guarantors/eligible", "/api/repayments", "/api/dashboard"]:
+        api.call("GET", route, applicant)
+    api.call("POST", "/api/events/ticket", applicant)
+    for params in [{}, {"include_archived": "true"}, {"fields": "amount,status", "expand": ""}]:
+        api.call("GET", "/api/finance-applications", applicant, params=params)
+    for params in [{}, {"include_archived": "true"}]:
+        api.call("GET", "/api/payment-schedules", applicant, params=params)
+        api.call("GET", "/api/guarantor-requests", guarantor, params=params)
+
+    today = date.today()
+    job = api.call("POST", "/api/admin/jobs", admin, json={"type": "rebuild_search_index"}).json()["id"]
+    api.call("GET", "/api/admin/jobs/{job_id}", admin, path={"job_id": job})
+    for route, params in [
+        ("/api/health", {}),
+        ("/api/dashboard", {}),
+        ("/api/admin/system-config", {}),
+        ("/api/admin/approval-queue", {}),
+        ("/api/admin/applications", {}),
+        ("/api/admin/applications", {"fields": "amount,applicant_name,can_approve"}),
+        ("/api/admin/disbursements", {}),
+        ("/api/admin/ready-for-disbursement", {}),
+        ("/api/admin/disbursement-plan", {"strategy": "optimal"}),
+        ("/api/admin/fund-pool", {}),
+        ("/api/admin/reports/money-movement", {"start": str(today - timedelta(days=365)), "end": str(today)}),
+        ("/api/admin/jobs", {}),
+        ("/api/admin/users", {}),
+        ("/api/admin/search", {"q": "amina"}),
+        ("/api/admin/deposits", {}),
+        ("/api/admin/guarantors", {}),
+        ("/api/admin/approval-history", {}),
+        ("/api/admin/portfolio", {}),
+        ("/api/admin/liquidity-forecast", {}),
+    ]:
+        api.call("GET", route, admin, params=params)
+    api.call("PUT", "/api/admin/system-config", admin, json={"priority_weight": 100})
+    for route in [
+        "/api/admin/fund-pool/recalculate", "/api/admin/archive/run",
+        "/api/admin/rollups/rebuild", "/api/admin/member-stats/rebuild", "/api/admin/credit-scores/rebuild"
+    ]:
+        api.call("POST", route, admin)
+
+
+@pytest.fixture(scope="module")
+def recorded(mongo):
+    """Commands issued while exercising the API, and the routes exercised"""
+    for name in mongo.list_collection_names():
+        mongo.drop_collection(name)
+    server.run_startup_tasks()
+    seed_filler_members()
+
+    recorder = CommandRecorder()
+    recording_client = MongoClient(server.MONGO_URL, event_listeners=[recorder])
+    with pytest.MonkeyPatch.context() as patch:
+        patch.setattr(server, "client", recording_client)
+        patch.setattr(server, "db", recording_client[server.DB_NAME])
+        for profile, database in list(server.read_dbs.items()):
+            patch.setitem(server.read_dbs, profile, recording_client.get_database(
+                server.DB_NAME, read_preference=database.read_preference
+            ))
+        api = ApiDriver()
+        recorder.recording = True
+        exercise_endpoints(api)
+        recorder.recording = False
+    recording_client.close()
+
+    yield recorder.commands, api.called
+    for name in mongo.list_collection_names():
+        mongo.drop_collection(name)
+
+
+def test_every_route_is_exercised(recorded):
+    _, called = recorded
+    routes = {route.path for route in server.app.routes if route.path.startswith("/api/")}
+
+    # The event stream never ends, so it is left out
+    assert routes - called - {"/api/events/stream"} == set()
+
+
+def test_queries_use_indexes(recorded, mongo):
+    commands, _ = recorded
+    problems = []
+    explained = set()
+    for command_name, command, callers in commands:
+        for collection, query, sort in selections(command_name, command):
+            key = json.dumps([collection, shape(query), list(sort or {}), callers], default=str)
+            if key in explained or allowed(callers, collection, query):
+                continue
+            explained.add(key)
+            find = SON([("find", collection), ("filter", query)] + ([("sort", sort)] if sort else []))
+            explain = mongo.command("explain", find, verbosity="executionStats")
+            for problem in plan_problems(explain, filtered=bool(query)):
+                problems.append(f"{' > '.join(callers)}: {collection} {json.dumps(shape(query))} "
+                                f"sort={dict(sort or {})}: {problem}")
+
+    assert commands, "no queries were recorded"
+    assert not problems, "\n".join(problems)
+
+
+def test_plan_problems_are_detected():
+    explain = {
+        "queryPlanner": {
+            "winningPlan": {"stage": "SORT", "inputStage": {"stage": "COLLSCAN"}},
+            "rejectedPlans": [{"stage": "IXSCAN"}]
+        },
+        "executionStats": {"totalDocsExamined": 500, "nReturned": 3}
+    }
+
+    assert plan_problems(explain, filtered=True) == [
+        "collection scan", "in-memory sort", "examined 500 documents to return 3"
+    ]
+    assert plan_problems(explain, filtered=False) == ["in-memory sort", "examined 500 documents to return 3"]
+
+
+def test_selections_follow_matches_into_unions():
+    command = {
+        "aggregate": "finance_applications",
+        "pipeline": [
+            {"$unionWith": {"coll": "archived_finance_applications", "pipeline": []}},
+            {"$match": {"status": "disbursed"}},
+            {"$group": {"_id": None}}
+        ]
+    }
+
+    assert selections("aggregate", command) == [
+        ("finance_applications", {"status": "disbursed"}, None),
+        ("archived_finance_applications", {"status": "disbursed"}, None),
+    ]
+    assert selections("update", {"update": "users", "updates": [{"q": {"id": "u1"}, "u": {}}]}) == [
+        ("users", {"id": "u1"}, None)
+    ]
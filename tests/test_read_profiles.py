@@ -0,0 +1,48 @@
+"""Read preference profiles.
+
+The routing tests need a replica set with at least one secondary, e.g.
+MONGO_URL="mongodb://localhost:27017,localhost:27018,localhost:27019/?replicaSet=rs0"
+"""
+import pytest
+from pymongo import WriteConcern
+
+import server
+
+
+def test_profiles_map_to_read_preferences():
+    server.connect_mongo()
+    try:
+        assert server.read_db("transactional").read_preference.mongos_mode == "primary"
+        analytics = server.read_db("analytics").read_preference
+        assert analytics.mongos_mode == "secondaryPreferred"
+        assert analytics.max_staleness == 120
+        assert server.read_db("export").read_preference.max_staleness == 600
+    finally:
+        server.close_mongo()
+
+
+@pytest.fixture
+def replica_set(mongo):
+    hello = server.client.admin.command("hello")
+    if "setName" not in hello:
+        pytest.skip("MONGO_URL is not a replica set")
+    if len(hello.get("hosts", [])) < 2:
+        pytest.skip("Replica set has no secondaries")
+    return hello
+
+
+def test_analytics_reads_go_to_a_secondary(replica_set):
+    collection = server.db.get_collection("read_profile_probe", write_concern=WriteConcern(w="majority"))
+    collection.insert_one({"probe": 1})
+
+    with server.client.start_session(causal_consistency=True) as session:
+        cursor = server.read_db("analytics").read_profile_probe.find({}, session=session)
+        assert list(cursor)
+        assert cursor.address != server.client.primary
+
+
+def test_causal_session_sees_prior_write_on_secondary(replica_set):
+    with server.client.start_session(causal_consistency=True) as session:
+        server.db.read_profile_probe.insert_one({"probe": 2}, session=session)
+        found = server.read_db("analytics").read_profile_probe.find_one({"probe": 2}, session=session)
+        assert found is not None
@@ -0,0 +1,169 @@
+"""Repayment allocation, statement parsing and concurrent postings"""
+from datetime import datetime
+
+import pytest
+
+import server
+
+PAID = datetime(2024, 3, 5)
+
+
+def installment(number, amount=100.0, principal=90.0, paid=None, status="scheduled", late_fee=0.0):
+    return {
+        "id": f"s{number}", "application_id": "loan", "user_id": "u1", "installment_number": number,
+        "due_date": datetime(2024, number, 1), "amount": amount, "principal_amount": principal,
+        "late_fee": late_fee, "paid_amount": paid, "paid_date": None, "status": status
+    }
+
+
+def test_payments_fill_the_oldest_installments_first():
+    schedules = [installment(1, paid=40.0, status="partial"), installment(2, late_fee=5.0), installment(3)]
+
+    allocations, unallocated = server.allocate_repayment(schedules, 200.0, PAID)
+
+    assert [(a["schedule_id"], a["amount"], a["status"]) for a in allocations] == [
+        ("s1", 60.0, "paid"), ("s2", 105.0, "paid"), ("s3", 35.0, "partial")
+    ]
+    # Principal follows the share of the installment amount covered; late fees carry none
+    assert [a["principal_amount"] for a in allocations] == [54.0, 90.0, 31.5]
+    assert unallocated == 0.0
+    assert (schedules[2]["paid_amount"], schedules[2]["paid_date"]) == (35.0, PAID)
+
+
+def test_overpayments_are_left_unallocated():
+    allocations, unallocated = server.allocate_repayment([installment(1, status="paid", paid=100.0), installment(2)], 150.0, PAID)
+
+    assert [a["schedule_id"] for a in allocations] == ["s2"]
+    assert unallocated == 50.0
+
+
+def test_statements_parse_csv_and_ndjson():
+    csv_rows, csv_errors = server.parse_repayment_statement(
+        b"user_id,email,amount,reference,paid_date\n"
+        b"u1,,100.456,R1,2024-03-05\n"
+        b",m@example.com,20,,\n"
+        b",,10,,\n"
+        b"u2,,-5,,\n"
+        b"u3,,abc,,\n"
+        b"u4,,5,,yesterday\n",
+        "statement.csv"
+    )
+    ndjson_rows, ndjson_errors = server.parse_repayment_statement(
+        b'{"user_id": "u1", "amount": 50, "application_id": "loan"}\n\nnot json\n', "statement.ndjson"
+    )
+
+    assert [(row["line"], row["user_id"], row["email"], row["amount"], row["reference"]) for row in csv_rows] == [
+        (2, "u1", None, 100.46, "R1"), (3, None, "m@example.com", 20.0, None)
+    ]
+    assert csv_rows[0]["paid_date"] == PAID
+    assert csv_errors == [
+        {"line": 4, "error": "Missing user_id or email"},
+        {"line": 5, "error": "Amount must be positive"},
+        {"line": 6, "error": "Invalid amount"},
+        {"line": 7, "error": "Invalid paid_date"},
+    ]
+    assert [(row["line"], row["application_id"]) for row in ndjson_rows] == [(1, "loan")]
+    assert ndjson_errors == [{"line": 3, "error": "Malformed line"}]
+
+
+@pytest.fixture
+def loan(mongo, monkeypatch):
+    monkeypatch.setattr(server, "SCHEDULE_LAYOUT", "installments")
+    for name in ["payment_schedules", "repayment_postings", "fund_pool_stripes", "guarantors"]:
+        mongo[name].delete_many({})
+    server.ensure_repayment_reference_index()
+    mongo.payment_schedules.insert_many([server.with_id(installment(number)) for number in (1, 2)])
+    return mongo
+
+
+def concurrent_posting_during_first_read(monkeypatch, compete):
+    """Run ``compete()`` right after the first read of outstanding installments"""
+    find = server.find_outstanding_installments
+    calls = []
+
+    def find_then_compete(user_ids, session=None):
+        found = find(user_ids, session)
+        calls.append(1)
+        if len(calls) == 1:
+            compete()
+        return found
+
+    monkeypatch.setattr(server, "find_outstanding_installments", find_then_compete)
+    return calls
+
+
+def test_postings_retry_when_installments_change_underneath(loan, monkeypatch):
+    calls = concurrent_posting_during_first_read(
+        monkeypatch, lambda: server.post_repayments([{"user_id": "u1", "amount": 100.0}], "admin", "manual")
+    )
+
+    result = server.post_repayments([{"user_id": "u1", "amount": 100.0}], "admin", "manual")
+
+    # The second posting saw the first one's payment and moved on to the next installment
+    assert len(calls) == 3
+    assert [a["schedule_id"] for a in result["postings"][0]["allocations"]] == ["s2"]
+    assert [s["paid_amount"] for s in loan.payment_schedules.find().sort("installment_number", 1)] == [100.0, 100.0]
+    assert server.get_fund_pool().total_repaid == 200.0
+
+
+def test_a_reference_is_posted_once_across_concurrent_imports(loan, monkeypatch):
+    payment = {"user_id": "u1", "amount": 100.0, "reference": "R1", "line": 2}
+    concurrent_posting_during_first_read(
+        monkeypatch, lambda: server.post_repayments([dict(payment)], "admin", "statement")
+    )
+
+    result = server.post_repayments([dict(payment)], "admin", "statement")
+
+    assert result["postings"] == []
+    assert result["duplicates"] == [{"line": 2, "reference": "R1"}]
+    assert loan.repayment_postings.count_documents({"reference": "R1"}) == 1
+    assert server.get_fund_pool().total_repaid == 100.0
+
+
+@pytest.fixture
+def two_loans(loan):
+    loan.payment_schedules.insert_one(server.with_id({
+        **installment(1), "id": "t1", "application_id": "loan2", "user_id": "u2"
+    }))
+    return loan
+
+
+def test_members_that_keep_conflicting_do_not_hold_back_the_import(two_loans, monkeypatch):
+    find = server.find_outstanding_installments
+    reads = []
+
+    def find_while_u1_keeps_paying(user_ids, session=None):
+        found = find(user_ids, session)
+        if "u1" in user_ids:
+            # Another posting pays a little more into u1's loan after every read
+            reads.append(1)
+            two_loans.payment_schedules.update_one(server.by_id("s1"), {"$set": {"paid_amount": float(len(reads))}})
+        return found
+
+    monkeypatch.setattr(server, "find_outstanding_installments", find_while_u1_keeps_paying)
+    result = server.post_repayments([
+        {"user_id": "u1", "amount": 100.0, "line": 2},
+        {"user_id": "u2", "amount": 100.0, "line": 3},
+    ], "admin", "statement")
+
+    assert [posting["user_id"] for posting in result["postings"]] == ["u2"]
+    assert result["conflicts"] == [{"line": 2, "user_id": "u1", "amount": 100.0}]
+    assert two_loans.payment_schedules.find_one(server.by_id("t1"))["paid_amount"] == 100.0
+    assert server.get_fund_pool().total_repaid == 100.0
+
+
+def test_imports_are_written_in_member_chunks(two_loans, monkeypatch):
+    monkeypatch.setattr(server, "REPAYMENT_CHUNK_SIZE", 1)
+    payments = [
+        {"user_id": "u1", "amount": 100.0},
+        {"user_id": "u2", "amount": 100.0},
+        {"user_id": "u1", "amount": 100.0},
+    ]
+
+    assert [[p["user_id"] for p in chunk] for chunk in server.repayment_chunks(payments, 1)] == [["u1", "u1"], ["u2"]]
+
+    result = server.post_repayments(payments, "admin", "statement")
+
+    assert sorted(posting["user_id"] for posting in result["postings"]) == ["u1", "u1", "u2"]
+    assert (result["conflicts"], result["total_allocated"]) == ([], 300.0)
+    assert [s["paid_amount"] for s in two_loans.payment_schedules.find().sort("id", 1)] == [100.0, 100.0, 100.0]
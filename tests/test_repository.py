@@ -0,0 +1,98 @@
+"""Projection and batch lookup helpers"""
+from datetime import datetime
+
+import pytest
+from fastapi import HTTPException
+
+import repository
+import server
+
+
+def test_including_only_extends_inclusion_projections():
+    assert repository.including(repository.USER_ID, "country") == {"_id": 0, "id": 1, "country": 1}
+    assert repository.including(repository.USER_PROFILE, "country") == repository.USER_PROFILE
+
+
+def test_field_lists_are_validated():
+    assert server.parse_field_list(" amount,status,amount ", server.APPLICATION_FIELDS, "fields") == ["amount", "status"]
+    assert server.parse_field_list("", server.APPLICATION_EXPANSIONS, "expand") == []
+    with pytest.raises(HTTPException) as error:
+        server.parse_field_list("amount,password_hash", server.APPLICATION_FIELDS, "fields")
+    assert error.value.status_code == 400
+
+
+def test_review_fields_load_what_they_are_computed_from():
+    assert server.application_projection(["status", "can_approve"]) == {
+        "_id": 0, "id": 1, "status": 1, "amount": 1, "user_id": 1
+    }
+
+
+def test_batch_lookups(mongo):
+    for name in ["finance_applications", "archived_finance_applications", "approval_history"]:
+        mongo[name].delete_many({})
+    mongo.finance_applications.insert_one({"id": "a1", "purpose": "hot"})
+    mongo.archived_finance_applications.insert_many([{"id": "a1", "purpose": "stale"}, {"id": "a2", "purpose": "cold"}])
+    mongo.approval_history.insert_many([
+        {"id": "h2", "application_id": "a1", "created_at": 2},
+        {"id": "h1", "application_id": "a1", "created_at": 1},
+    ])
+
+    applications = server.find_applications_by_ids(["a1", "a2", "a1", "missing"], {"_id": 0, "purpose": 1})
+    history = repository.find_grouped(
+        [mongo.approval_history], "application_id", ["a1", "a2"], {"_id": 0, "id": 1}, sort_by="created_at"
+    )
+
+    assert applications == {"a1": {"id": "a1", "purpose": "hot"}, "a2": {"id": "a2", "purpose": "cold"}}
+    assert [h["id"] for h in history["a1"]] == ["h1", "h2"]
+    assert history["a2"] == []
+
+
+def test_sparse_fieldsets_merge_the_archive_in_order(mongo):
+    for name in ["finance_applications", "archived_finance_applications"]:
+        mongo[name].delete_many({})
+    mongo.finance_applications.insert_many([server.with_id(document) for document in [
+        {"id": "new", "user_id": "u1", "amount": 300.0, "priority_score": 80.0, "created_at": datetime(2024, 3, 1)},
+        {"id": "legacy", "user_id": "u1", "amount": 100.0, "created_at": datetime(2024, 2, 1)},
+    ]])
+    mongo.archived_finance_applications.insert_one(server.with_id(
+        {"id": "old", "user_id": "u1", "amount": 200.0, "priority_score": 90.0, "created_at": datetime(2023, 1, 1)}
+    ))
+
+    fields = ["amount"]
+    by_date = server.find_with_archive(
+        "finance_applications", {"user_id": "u1"}, server.application_projection(fields),
+        sort=[("created_at", -1)], include_archived=True
+    )
+    by_priority = server.find_with_archive(
+        "finance_applications", {}, server.application_projection(fields),
+        sort=[("priority_score", -1), ("created_at", 1)], include_archived=True
+    )
+
+    assert server.render_applications(by_date, fields, []) == [
+        {"id": "new", "amount": 300.0}, {"id": "legacy", "amount": 100.0}, {"id": "old", "amount": 200.0}
+    ]
+    # Applications without a priority score sort last, as Mongo orders them
+    assert [app["id"] for app in by_priority] == ["old", "new", "legacy"]
+
+
+def test_user_and_application_reads(mongo):
+    for name in ["users", "finance_applications"]:
+        mongo[name].delete_many({})
+    mongo.users.insert_many([server.with_id(document) for document in [
+        {"id": "u1", "email": "u1@example.com", "country": "X", "role": "member", "is_active": True, "password_hash": "x"},
+        {"id": "u2", "email": "u2@example.com", "country": "Y", "role": "member", "is_active": False},
+    ]])
+    mongo.finance_applications.insert_many([server.with_id(document) for document in [
+        {"id": "a1", "user_id": "u1", "amount": 100.0, "created_at": datetime(2024, 1, 1)},
+        {"id": "a2", "user_id": "u1", "amount": 200.0, "created_at": datetime(2024, 2, 1)},
+    ]])
+
+    assert "password_hash" not in repository.get_user(mongo, "u1")
+    assert repository.get_user(mongo, "u2", repository.USER_ID, is_active=True) is None
+    assert repository.get_user_by_email(mongo, "u2@example.com") == {"id": "u2"}
+    assert list(repository.users_by_ids(mongo, ["u1", "u2", "u1"], repository.USER_COUNTRY, is_active=True)) == ["u1"]
+    assert repository.country_user_ids(mongo, "Y") == ["u2"]
+    assert repository.get_application(mongo, "a2", {"_id": 0, "amount": 1}) == {"amount": 200.0}
+    assert [app["id"] for app in repository.find_applications(
+        mongo, {"user_id": "u1"}, {"_id": 0}, sort=[("created_at", -1)], limit=1
+    )] == ["a2"]
@@ -0,0 +1,45 @@
+"""Daily money movement rollups"""
+from datetime import datetime
+
+import server
+
+
+def test_periods():
+    day = datetime(2024, 8, 5)
+
+    assert server.rollup_period(day, "day") == "2024-08-05"
+    assert server.rollup_period(day, "month") == "2024-08"
+    assert server.rollup_period(day, "quarter") == "2024-Q3"
+    assert server.rollup_period(day, "year") == "2024"
+    assert server.rollup_period(day, "total") == "total"
+
+
+def test_incremental_rollups_match_the_backfill(mongo):
+    for name in ["users", "deposits", "disbursements", "repayment_postings", "daily_rollups"]:
+        mongo[name].delete_many({})
+    mongo.users.insert_many([{"id": "u1", "country": "Kenya"}, {"id": "u2", "country": "Ghana"}])
+    deposits = [
+        {"user_id": "u1", "amount": 100.0, "status": "completed", "created_at": datetime(2024, 1, 1, 9)},
+        {"user_id": "u1", "amount": 50.0, "status": "completed", "created_at": datetime(2024, 1, 1, 17)},
+        {"user_id": "u2", "amount": 75.0, "status": "completed", "created_at": datetime(2024, 1, 2, 8)},
+    ]
+    mongo.deposits.insert_many([dict(deposit) for deposit in deposits])
+
+    server.record_rollups([
+        ("deposits", deposit["created_at"], {"u1": "Kenya", "u2": "Ghana"}[deposit["user_id"]], deposit["amount"])
+        for deposit in deposits
+    ])
+    incremental = sorted(
+        (row["day"], row["country"], row["total"], row["count"])
+        for row in mongo.daily_rollups.find({"metric": "deposits"})
+    )
+    server.rebuild_daily_rollups()
+    rebuilt = sorted(
+        (row["day"], row["country"], row["total"], row["count"])
+        for row in mongo.daily_rollups.find({"metric": "deposits"})
+    )
+
+    assert incremental == rebuilt == [
+        (datetime(2024, 1, 1), "Kenya", 150.0, 2),
+        (datetime(2024, 1, 2), "Ghana", 75.0, 1),
+    ]
@@ -0,0 +1,62 @@
+"""Embedded payment schedule layout"""
+from datetime import datetime
+
+import server
+
+
+def installments(disbursement_id, ids):
+    return [
+        {
+            "id": installment_id,
+            "application_id": "a1",
+            "disbursement_id": disbursement_id,
+            "user_id": "u1",
+            "installment_number": number,
+            "amount": 105.0,
+            "principal_amount": 100.0,
+            "interest_amount": 5.0,
+            "due_date": datetime(2024, number, 1),
+            "status": "paid" if number == 1 else "scheduled",
+            "paid_date": datetime(2024, 1, 1) if number == 1 else None,
+            "paid_amount": 105.0 if number == 1 else None,
+            "late_fee": 0.0
+        }
+        for number, installment_id in enumerate(ids, start=1)
+    ]
+
+
+def test_embedding_round_trips_and_only_stores_custom_ids():
+    flat = installments("d1", ["legacy-uuid", server.installment_id("d1", 2)])
+
+    schedule = server.embed_installments(list(reversed(flat)))
+    expanded = server.embedded_installments(schedule)
+
+    assert schedule["open"] is True
+    assert [installment.get("id") for installment in schedule["installments"]] == ["legacy-uuid", None]
+    assert [
+        {key: value for key, value in installment.items() if key not in ["loan_schedule_id", "position"]}
+        for installment in expanded
+    ] == flat
+    assert [installment["position"] for installment in expanded] == [0, 1]
+
+
+def test_migration_moves_schedules_both_ways(mongo, monkeypatch):
+    for name in ["payment_schedules", "loan_schedules", "archived_payment_schedules", "archived_loan_schedules"]:
+        mongo[name].delete_many({})
+    flat = installments("d1", ["i1", "i2", "i3"]) + installments("d2", ["j1", "j2"])
+    mongo.payment_schedules.insert_many([dict(installment) for installment in flat])
+
+    monkeypatch.setattr(server, "SCHEDULE_LAYOUT", "embedded")
+    assert server.migrate_schedule_layout(batch_size=1) == 2
+    assert mongo.payment_schedules.count_documents({}) == 0
+    assert mongo.loan_schedules.count_documents({}) == 2
+    assert [installment["id"] for installment in server.find_installments({"user_id": "u1"})] == [
+        "i1", "j1", "i2", "j2", "i3"
+    ]
+
+    monkeypatch.setattr(server, "SCHEDULE_LAYOUT", "installments")
+    assert server.migrate_schedule_layout() == 2
+    assert mongo.loan_schedules.count_documents({}) == 0
+    assert sorted(mongo.payment_schedules.find({}, {"_id": 0}), key=lambda installment: installment["id"]) == sorted(
+        flat, key=lambda installment: installment["id"]
+    )
@@ -0,0 +1,24 @@
+"""Member and application search"""
+import server
+
+
+def test_tokens_are_folded_split_and_deduplicated():
+    assert server.search_tokens("Zoë Ndlovu", "zoe.ndlovu@Example.com", None) == [
+        "zoe", "ndlovu", "example", "com"
+    ]
+
+
+def test_title_matches_rank_above_other_fields():
+    member = server.user_search_document({
+        "id": "u1", "full_name": "Amina Otieno", "email": "farmer@example.com", "country": "Kenya"
+    })
+    application = server.application_search_document(
+        {"id": "a1", "purpose": "Farm equipment", "description": "Irrigation for Amina"},
+        {"full_name": "Amina Otieno", "country": "Kenya"}
+    )
+
+    assert server.search_score(member, ["amina"]) == 3
+    assert server.search_score(member, ["ami", "farm"]) == 2 + 0.5
+    assert server.search_score(application, ["farm"]) == 3
+    assert server.search_score(application, ["amina"]) == 1
+    assert application["country"] == "Kenya"